@@ -0,0 +1 @@
+"""Synthetic dumps and throughput benchmarks for holland_restore"""
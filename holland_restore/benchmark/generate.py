@@ -0,0 +1,328 @@
+"""Generate synthetic mysqldump output of a configurable shape
+
+The output follows the layout of ``mysqldump --databases`` from MySQL 5.1:
+session setup, then for each database its tables with their data and
+triggers, temporary view structures and routines, then the final view
+structures of every database and the session restore.  Rows are generated
+from a seeded random number generator, so the same shape always produces
+the same dump.
+"""
+
+import sys
+import random
+from collections import namedtuple
+from optparse import OptionParser
+
+__all__ = [
+    'DumpShape',
+    'generate_dump',
+    'main',
+]
+
+class DumpShape(namedtuple('DumpShape', ['databases', 'tables', 'rows',
+                                         'insert_size', 'views', 'routines',
+                                         'triggers', 'seed'])):
+    """Shape of a generated dump
+
+    ``tables``, ``views`` and ``routines`` are counts per database,
+    ``rows`` is the number of rows per table and ``triggers`` the number
+    of tables per database that have a trigger.  ``insert_size`` is the
+    length an extended INSERT line grows to before a new one is started,
+    like mysqldump's ``--net_buffer_length``.
+    """
+    __slots__ = ()
+
+#: Shape used when no option is given, about 50MB of output
+DEFAULT_SHAPE = DumpShape(databases=2, tables=20, rows=20000,
+                          insert_size=1024*1024, views=2, routines=2,
+                          triggers=2, seed=0)
+
+# mysqldump leaves a space after "Database:" when dumping several
+HEADER = """-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database:\x20
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET @OLD_CHARACTER_SET_RESULTS=@@CHARACTER_SET_RESULTS */;
+/*!40101 SET @OLD_COLLATION_CONNECTION=@@COLLATION_CONNECTION */;
+/*!40101 SET NAMES utf8 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
+/*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
+
+"""
+
+DATABASE = """--
+-- Current Database: `%(db)s`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `%(db)s` /*!40100 DEFAULT CHARACTER SET latin1 */;
+
+USE `%(db)s`;
+
+"""
+
+TABLE = """--
+-- Table structure for table `%(table)s`
+--
+
+DROP TABLE IF EXISTS `%(table)s`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `%(table)s` (
+  `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `name` varchar(64) NOT NULL,
+  `amount` int(11) DEFAULT NULL,
+  `last_update` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_name` (`name`)
+) ENGINE=%(engine)s DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `%(table)s`
+--
+
+LOCK TABLES `%(table)s` WRITE;
+/*!40000 ALTER TABLE `%(table)s` DISABLE KEYS */;
+"""
+
+TABLE_END = """/*!40000 ALTER TABLE `%(table)s` ENABLE KEYS */;
+UNLOCK TABLES;
+"""
+
+TRIGGER = """/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET @saved_cs_results     = @@character_set_results */ ;
+/*!50003 SET @saved_col_connection = @@collation_connection */ ;
+/*!50003 SET character_set_client  = utf8 */ ;
+/*!50003 SET character_set_results = utf8 */ ;
+/*!50003 SET collation_connection  = utf8_general_ci */ ;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = '' */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`localhost`*/ /*!50003 TRIGGER `%(table)s_update` BEFORE UPDATE ON `%(table)s` FOR EACH ROW BEGIN
+--
+-- keep the update time current
+--
+    SET NEW.last_update = NOW();
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+/*!50003 SET character_set_results = @saved_cs_results */ ;
+/*!50003 SET collation_connection  = @saved_col_connection */ ;
+"""
+
+TEMP_VIEW = """
+--
+-- Temporary table structure for view `%(view)s`
+--
+
+DROP TABLE IF EXISTS `%(view)s`;
+/*!50001 DROP VIEW IF EXISTS `%(view)s`*/;
+SET @saved_cs_client     = @@character_set_client;
+SET character_set_client = utf8;
+/*!50001 CREATE TABLE `%(view)s` (
+  `id` int(10) unsigned,
+  `name` varchar(64)
+) ENGINE=MyISAM */;
+SET character_set_client = @saved_cs_client;
+"""
+
+ROUTINES = """
+--
+-- Dumping routines for database '%(db)s'
+--
+"""
+
+ROUTINE = """/*!50003 DROP PROCEDURE IF EXISTS `%(routine)s` */;
+/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET @saved_cs_results     = @@character_set_results */ ;
+/*!50003 SET @saved_col_connection = @@collation_connection */ ;
+/*!50003 SET character_set_client  = utf8 */ ;
+/*!50003 SET character_set_results = utf8 */ ;
+/*!50003 SET collation_connection  = utf8_general_ci */ ;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = '' */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50020 DEFINER=`root`@`localhost`*/ /*!50003 PROCEDURE `%(routine)s`(IN p_id INT)
+    READS SQL DATA
+BEGIN
+    SELECT * FROM `%(table)s` WHERE id = p_id;
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+/*!50003 SET character_set_results = @saved_cs_results */ ;
+/*!50003 SET collation_connection  = @saved_col_connection */ ;
+"""
+
+FINAL_DATABASE = """
+--
+-- Current Database: `%(db)s`
+--
+
+USE `%(db)s`;
+"""
+
+FINAL_VIEW = """
+--
+-- Final view structure for view `%(view)s`
+--
+
+/*!50001 DROP TABLE IF EXISTS `%(view)s`*/;
+/*!50001 DROP VIEW IF EXISTS `%(view)s`*/;
+/*!50001 SET @saved_cs_client          = @@character_set_client */;
+/*!50001 SET @saved_cs_results         = @@character_set_results */;
+/*!50001 SET @saved_col_connection     = @@collation_connection */;
+/*!50001 SET character_set_client      = utf8 */;
+/*!50001 SET character_set_results     = utf8 */;
+/*!50001 SET collation_connection      = utf8_general_ci */;
+/*!50001 CREATE ALGORITHM=UNDEFINED */
+/*!50013 DEFINER=`root`@`localhost` SQL SECURITY DEFINER */
+/*!50001 VIEW `%(view)s` AS select `%(table)s`.`id` AS `id`,`%(table)s`.`name` AS `name` from `%(table)s` */;
+/*!50001 SET character_set_client      = @saved_cs_client */;
+/*!50001 SET character_set_results     = @saved_cs_results */;
+/*!50001 SET collation_connection      = @saved_col_connection */;
+"""
+
+FOOTER = """/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+
+/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+/*!40101 SET CHARACTER_SET_RESULTS=@OLD_CHARACTER_SET_RESULTS */;
+/*!40101 SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION */;
+/*!40111 SET SQL_NOTES=@OLD_SQL_NOTES */;
+
+-- Dump completed on 2010-04-22 14:44:42
+"""
+
+#: Words names are made of; some need escaping or contain parentheses,
+#: as real data does
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', "o\\'brien", 'echo (2)',
+         'foxtrot', 'golf', 'hotel', 'india', 'back\\\\slash', 'juliet']
+
+ENGINES = ['InnoDB', 'InnoDB', 'InnoDB', 'MyISAM']
+
+def database_name(index):
+    return 'db%d' % index
+
+def table_name(index):
+    return 't%d' % index
+
+def view_name(index):
+    return 'v%d' % index
+
+def _rows(rng, count):
+    """Generate the value tuples of a table"""
+    choice = rng.choice
+    randint = rng.randint
+    for row_id in xrange(1, count + 1):
+        yield "(%d,'%s %s',%s,'2006-02-15 %02d:%02d:%02d')" % (
+            row_id, choice(WORDS), choice(WORDS),
+            choice(['NULL', str(randint(-100000, 100000))]),
+            randint(0, 23), randint(0, 59), randint(0, 59))
+
+def write_data(fileobj, table, rows, insert_size):
+    """Write the rows of a table as extended INSERT statements"""
+    prefix = 'INSERT INTO `%s` VALUES ' % table
+    values = []
+    length = len(prefix)
+    for row in rows:
+        if values and length + len(row) + 1 > insert_size:
+            fileobj.write(prefix + ','.join(values) + ';\n')
+            values = []
+            length = len(prefix)
+        values.append(row)
+        length += len(row) + 1
+    if values:
+        fileobj.write(prefix + ','.join(values) + ';\n')
+
+def generate_dump(fileobj, shape=DEFAULT_SHAPE):
+    """Write a synthetic dump of the given shape
+
+    :param fileobj: file-like object to write to
+    :param shape: `DumpShape` of the dump
+    """
+    rng = random.Random(shape.seed)
+    fileobj.write(HEADER)
+    for db_index in xrange(shape.databases):
+        database = database_name(db_index)
+        fileobj.write(DATABASE % dict(db=database))
+        for index in xrange(shape.tables):
+            table = table_name(index)
+            fileobj.write(TABLE % dict(table=table,
+                                       engine=ENGINES[index % len(ENGINES)]))
+            write_data(fileobj, table, _rows(rng, shape.rows),
+                       shape.insert_size)
+            fileobj.write(TABLE_END % dict(table=table))
+            if index < shape.triggers:
+                fileobj.write(TRIGGER % dict(table=table))
+            fileobj.write('\n')
+        for index in xrange(shape.views):
+            fileobj.write(TEMP_VIEW % dict(view=view_name(index)))
+        if shape.routines:
+            fileobj.write(ROUTINES % dict(db=database))
+            for index in xrange(shape.routines):
+                fileobj.write(ROUTINE % dict(routine='p%d' % index,
+                                             table=table_name(0)))
+            fileobj.write('\n')
+    if shape.views:
+        for db_index in xrange(shape.databases):
+            fileobj.write(FINAL_DATABASE % dict(db=database_name(db_index)))
+            for index in xrange(shape.views):
+                fileobj.write(FINAL_VIEW % dict(view=view_name(index),
+                                                table=table_name(0)))
+        fileobj.write('\n')
+    fileobj.write(FOOTER)
+
+def build_opt_parser():
+    """Build an OptionParser"""
+    opt_parser = OptionParser(usage="%prog [options] [output file]")
+    for name, help_text in [
+        ('databases', "Number of databases."),
+        ('tables', "Number of tables per database."),
+        ('rows', "Number of rows per table."),
+        ('insert-size', "Length in bytes an extended INSERT line grows "
+                        "to before another is started."),
+        ('views', "Number of views per database."),
+        ('routines', "Number of stored procedures per database."),
+        ('triggers', "Number of tables per database with a trigger."),
+        ('seed', "Seed of the random row data."),
+    ]:
+        dest = name.replace('-', '_')
+        opt_parser.add_option('--' + name,
+                              type='int',
+                              dest=dest,
+                              help=help_text + " Defaults to %d." %
+                                   getattr(DEFAULT_SHAPE, dest),
+                              default=getattr(DEFAULT_SHAPE, dest))
+    return opt_parser
+
+def main(args=None):
+    """Write a synthetic dump to a file or stdout"""
+    opt_parser = build_opt_parser()
+    opts, args = opt_parser.parse_args(args)
+    if len(args) > 1:
+        opt_parser.error("Only one output file may be given")
+    shape = DumpShape(*[getattr(opts, name) for name in DumpShape._fields])
+    if args and args[0] != '-':
+        fileobj = open(args[0], 'wb')
+    else:
+        fileobj = sys.stdout
+    try:
+        generate_dump(fileobj, shape)
+    finally:
+        if fileobj is not sys.stdout:
+            fileobj.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Measure the throughput of each stage of parsing a dump
+
+Each stage reads the whole dump through one more layer of the pipeline:
+
+- ``scanner``: lines from a `BlockScanner`
+- ``scanner-mmap``: lines from an `MmapScanner`
+- ``tokenizer``: tokens from a `Tokenizer` with the default rules
+- ``nodestream``: nodes from a `NodeStream`, reading every token
+- ``nodefilter``: the text of every node passed through a `NodeFilter`
+- ``restore``: ``mysqlrestore`` run on the dump with its output discarded
+
+The best of several runs of each stage is reported in MB/s and lines/s.
+Results are written as JSON, and a previous result file may be given to
+compare against.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from optparse import OptionParser
+from holland_restore.scanner import BlockScanner, MmapScanner
+from holland_restore.tokenizer import Tokenizer, RULES
+from holland_restore.node import NodeStream, NodeFilter
+
+__all__ = [
+    'STAGES',
+    'run_benchmark',
+    'compare',
+    'main',
+]
+
+def count_lines(path, block_size=1024*1024):
+    """Count the lines of a file, including a last line without a newline"""
+    count = 0
+    last = '\n'
+    fileobj = open(path, 'rb')
+    try:
+        while True:
+            block = fileobj.read(block_size)
+            if not block:
+                break
+            count += block.count('\n')
+            last = block[-1]
+    finally:
+        fileobj.close()
+    if last != '\n':
+        count += 1
+    return count
+
+def stage_scanner(path, args):
+    fileobj = open(path, 'rb')
+    try:
+        for line in BlockScanner(fileobj):
+            pass
+    finally:
+        fileobj.close()
+
+def stage_scanner_mmap(path, args):
+    fileobj = open(path, 'rb')
+    scanner = MmapScanner(fileobj)
+    try:
+        for line in scanner:
+            pass
+    finally:
+        scanner.close()
+        fileobj.close()
+
+def stage_tokenizer(path, args):
+    fileobj = open(path, 'rb')
+    try:
+        for token in Tokenizer(BlockScanner(fileobj), RULES):
+            pass
+    finally:
+        fileobj.close()
+
+def stage_nodestream(path, args):
+    fileobj = open(path, 'rb')
+    try:
+        for node in NodeStream(BlockScanner(fileobj)):
+            for token in node.tokens:
+                pass
+    finally:
+        fileobj.close()
+
+def stage_nodefilter(path, args):
+    fileobj = open(path, 'rb')
+    node_filter = NodeFilter()
+    try:
+        for node in NodeStream(BlockScanner(fileobj)):
+            for chunk in node_filter(node):
+                pass
+    finally:
+        fileobj.close()
+
+def stage_restore(path, args):
+    devnull = open(os.devnull, 'wb')
+    try:
+        status = subprocess.call([sys.executable, '-c',
+                                  'from holland_restore.script import main; '
+                                  'main()'] + list(args) + [path],
+                                 stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+    if status != 0:
+        raise RuntimeError("mysqlrestore exited with status %d" % status)
+
+#: Stages in pipeline order, as (name, function) pairs.  Each function
+#: takes the path of the dump and the extra arguments to mysqlrestore.
+STAGES = [
+    ('scanner', stage_scanner),
+    ('scanner-mmap', stage_scanner_mmap),
+    ('tokenizer', stage_tokenizer),
+    ('nodestream', stage_nodestream),
+    ('nodefilter', stage_nodefilter),
+    ('restore', stage_restore),
+]
+
+def cpu_time():
+    """CPU time used by this process and its finished children"""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def time_stage(function, path, args, repeat=3):
+    """Run a stage ``repeat`` times
+
+    :returns: tuple of (wall clock seconds, CPU seconds) of the fastest run
+    """
+    best = None
+    for _ in xrange(repeat):
+        cpu = cpu_time()
+        wall = time.time()
+        function(path, args)
+        result = (time.time() - wall, cpu_time() - cpu)
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+def run_benchmark(path, stages=None, repeat=3, restore_args=(),
+                  report=None):
+    """Benchmark the stages of parsing a dump
+
+    :param path: path of an uncompressed dump
+    :param stages: names of the stages to run, defaults to all of them
+    :param repeat: number of runs of each stage
+    :param restore_args: extra arguments to mysqlrestore for the
+                         ``restore`` stage
+    :param report: optional callable called with the name and result of
+                   each stage as it completes
+    :returns: dict of results, as written to JSON
+    """
+    size = os.path.getsize(path)
+    lines = count_lines(path)
+    results = {}
+    for name, function in STAGES:
+        if stages and name not in stages:
+            continue
+        seconds, cpu = time_stage(function, path, restore_args, repeat)
+        seconds = max(seconds, 1e-6)
+        results[name] = {
+            'seconds': seconds,
+            'cpu_seconds': cpu,
+            'mb_per_second': size / 1024.0**2 / seconds,
+            'lines_per_second': lines / seconds,
+        }
+        if report:
+            report(name, results[name])
+    return {
+        'dump': {
+            'path': os.path.abspath(path),
+            'bytes': size,
+            'lines': lines,
+        },
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'restore_args': list(restore_args),
+        'stages': results,
+    }
+
+def format_result(name, result, baseline=None):
+    """Format the result of a stage as a line of text"""
+    line = "%-14s %9.2f MB/s %12.0f lines/s %8.2fs" % (
+        name, result['mb_per_second'], result['lines_per_second'],
+        result['seconds'])
+    if baseline is not None:
+        line += "  %+6.1f%%" % ((result['mb_per_second'] /
+                                 baseline['mb_per_second'] - 1)*100)
+    return line
+
+def compare(results, baseline):
+    """Compare the throughput of each stage with an earlier run
+
+    :returns: list of lines of text; stages missing from either run are
+              left out
+    """
+    lines = []
+    if results['dump']['bytes'] != baseline['dump']['bytes']:
+        lines.append("Warning: the runs used dumps of different sizes")
+    for name, function in STAGES:
+        try:
+            result = results['stages'][name]
+            previous = baseline['stages'][name]
+        except KeyError:
+            continue
+        lines.append(format_result(name, result, previous))
+    return lines
+
+def build_opt_parser():
+    """Build an OptionParser"""
+    opt_parser = OptionParser(usage="%prog [options] dumpfile")
+    opt_parser.add_option('--stage',
+                          dest='stages',
+                          action='append',
+                          metavar='name',
+                          help=("Only run the specified stage: one of %s. "
+                                "This option may be specified multiple "
+                                "times." %
+                                ', '.join([name for name, _ in STAGES])),
+                          default=[])
+    opt_parser.add_option('--repeat',
+                          type='int',
+                          metavar='N',
+                          help="Run each stage N times and keep the fastest.",
+                          default=3)
+    opt_parser.add_option('--restore-args',
+                          metavar='args',
+                          help=("Extra arguments to mysqlrestore in the "
+                                "restore stage, e.g. '--mmap'."),
+                          default='')
+    opt_parser.add_option('--output', '-o',
+                          metavar='file',
+                          help="Write the results to the specified JSON file.",
+                          default=None)
+    opt_parser.add_option('--compare',
+                          metavar='file',
+                          help=("Compare the results with an earlier JSON "
+                                "results file."),
+                          default=None)
+    return opt_parser
+
+def main(args=None):
+    """Benchmark a dump and report the throughput of each stage"""
+    opt_parser = build_opt_parser()
+    opts, args = opt_parser.parse_args(args)
+    if len(args) != 1:
+        opt_parser.error("A single dump file is required")
+    names = [name for name, _ in STAGES]
+    for name in opts.stages:
+        if name not in names:
+            opt_parser.error("Unknown stage %r" % name)
+
+    def report(name, result):
+        print format_result(name, result)
+        sys.stdout.flush()
+
+    results = run_benchmark(args[0], opts.stages, opts.repeat,
+                            opts.restore_args.split(), report)
+    if opts.output:
+        fileobj = open(opts.output, 'w')
+        try:
+            json.dump(results, fileobj, indent=2, sort_keys=True)
+            fileobj.write('\n')
+        finally:
+            fileobj.close()
+    if opts.compare:
+        baseline = json.load(open(opts.compare))
+        print
+        print "Compared with %s:" % opts.compare
+        for line in compare(results, baseline):
+            print line
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
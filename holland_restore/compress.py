@@ -0,0 +1,374 @@
+"""Transparent decompression of compressed dump files
+
+Compression is detected from the magic bytes at the start of the input.
+Data is decompressed by a background thread that feeds a bounded queue, so
+decompression, which releases the GIL, overlaps with tokenizing.  The same
+thread can read ahead in uncompressed input with a `PrefetchReader`.
+"""
+
+import sys
+import bz2
+import zlib
+from threading import Thread
+from Queue import Queue, Full
+from holland_restore import zran
+from holland_restore.util import binary_mode
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+__all__ = [
+    'CompressionError',
+    'DecompressingReader',
+    'PrefetchReader',
+    'detect_compression',
+    'open_input',
+]
+
+#: Number of compressed bytes read from the input at a time
+DEFAULT_READ_SIZE = 256*1024
+
+#: Number of decompressed chunks buffered between the decompression thread
+#: and the reader
+DEFAULT_QUEUE_SIZE = 16
+
+#: Number of bytes a `PrefetchReader` reads from its file at a time
+DEFAULT_PREFETCH_SIZE = 4*1024*1024
+
+#: Number of blocks buffered between a `PrefetchReader` thread and the
+#: reader
+DEFAULT_PREFETCH_QUEUE_SIZE = 4
+
+#: Number of bytes needed to recognize every supported format
+MAGIC_SIZE = 6
+
+class CompressionError(Exception):
+    """Raised when compressed input cannot be read"""
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS expects a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _xz_decompressor():
+    if lzma is None:
+        raise CompressionError("xz input requires the lzma module "
+                               "(backports.lzma on python2)")
+    return lzma.LZMADecompressor()
+
+#: Supported formats: name, magic bytes, decompressor factory
+FORMATS = [
+    ('gzip', '\x1f\x8b', _gzip_decompressor),
+    ('bzip2', 'BZh', bz2.BZ2Decompressor),
+    ('xz', '\xfd7zXZ\x00', _xz_decompressor),
+]
+
+def detect_compression(head):
+    """Detect the compression format from the first bytes of a file
+
+    :param head: at least `MAGIC_SIZE` bytes from the start of the input,
+                 unless the input is shorter
+    :returns: tuple of (name, decompressor factory) or (None, None) for
+              uncompressed input
+    """
+    for name, magic, factory in FORMATS:
+        if head.startswith(magic):
+            return name, factory
+    return None, None
+
+def _stream_ended(decompressor):
+    """Check whether a decompressor has read the end of its stream"""
+    eof = getattr(decompressor, 'eof', None)
+    if eof is not None:
+        return eof
+    # python 2's zlib and bz2 decompressors do not record the end of their
+    # stream, but refuse input after it or keep it as unused data
+    try:
+        decompressor.decompress('\x00')
+    except EOFError:
+        return True
+    except (zlib.error, IOError, ValueError):
+        return False
+    return bool(decompressor.unused_data)
+
+class StreamDecompressor(object):
+    """Decompress a sequence of concatenated compressed streams
+
+    gzip files may hold several members and bzip2 and xz files several
+    streams; each one is decompressed in turn with a new decompressor.
+    Zero bytes padding the input after the end of a stream are skipped.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._decompressor = factory()
+        # True once a stream has ended and no data of another one was read
+        self._ended = False
+
+    def decompress(self, data):
+        """Decompress the next piece of input
+
+        :returns: decompressed data, which may be empty
+        """
+        result = []
+        while data:
+            if self._ended:
+                data = data.lstrip('\x00')
+                if not data:
+                    break
+                self._decompressor = self.factory()
+                self._ended = False
+            try:
+                result.append(self._decompressor.decompress(data))
+            except EOFError:
+                # bz2 refuses input once its stream has ended
+                self._ended = True
+                continue
+            data = self._decompressor.unused_data
+            if data:
+                self._ended = True
+        return ''.join(result)
+
+    def finish(self):
+        """Check that the input ended with the end of a stream
+
+        :raises: `CompressionError` if the input was truncated
+        """
+        if not self._ended and not _stream_ended(self._decompressor):
+            raise CompressionError("unexpected end of file")
+
+class PrefetchReader(object):
+    """File-like object that reads data produced by a background thread
+
+    The thread reads blocks from the underlying file into a bounded queue,
+    so the ``read()`` system calls, which release the GIL, overlap with
+    tokenizing.
+    """
+
+    def __init__(self,
+                 fileobj,
+                 head='',
+                 name=None,
+                 read_size=DEFAULT_PREFETCH_SIZE,
+                 queue_size=DEFAULT_PREFETCH_QUEUE_SIZE):
+        """Start reading ``fileobj``
+
+        :param fileobj: file to read from
+        :param head: bytes already read from ``fileobj``
+        :param name: name of the input, defaults to ``fileobj.name``
+        :param read_size: number of bytes to read at a time
+        :param queue_size: number of blocks to buffer
+        """
+        self.fileobj = fileobj
+        self.name = name or getattr(fileobj, 'name', '<stdin>')
+        self.read_size = read_size
+        #: number of bytes read from ``fileobj`` so far
+        self.input_offset = len(head)
+        self._head = head
+        self._queue = Queue(maxsize=queue_size)
+        self._buffer = ''
+        self._index = 0
+        self._eof = False
+        self._closed = False
+        self._thread = Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _convert(self, data):
+        """Convert a block read from the input to the data to return"""
+        return data
+
+    def _finish(self):
+        """Check the input once all of it has been read"""
+
+    def _error(self, exc):
+        """Return the exception to raise for an error in the thread"""
+        return exc
+
+    def _put(self, item):
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def _run(self):
+        data = self._head
+        try:
+            if not data:
+                data = self.fileobj.read(self.read_size)
+                self.input_offset += len(data)
+            while data and not self._closed:
+                chunk = self._convert(data)
+                if chunk:
+                    self._put(chunk)
+                data = self.fileobj.read(self.read_size)
+                self.input_offset += len(data)
+            if not self._closed:
+                self._finish()
+            self._put(None)
+        except Exception, exc:
+            self._put(exc)
+
+    def _fill(self):
+        """Wait for the next block of data
+
+        :returns: False at the end of the input
+        """
+        if self._eof:
+            return False
+        item = self._queue.get()
+        if item is None:
+            self._eof = True
+            return False
+        if isinstance(item, Exception):
+            self._eof = True
+            raise self._error(item)
+        self._buffer = item
+        self._index = 0
+        return True
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes
+
+        :returns: str, empty at the end of the input
+        """
+        parts = []
+        length = 0
+        while size < 0 or length < size:
+            if self._index >= len(self._buffer) and not self._fill():
+                break
+            start = self._index
+            if size < 0:
+                end = len(self._buffer)
+            else:
+                end = start + size - length
+            part = self._buffer[start:end]
+            self._index = start + len(part)
+            parts.append(part)
+            length += len(part)
+        return ''.join(parts)
+
+    def close(self):
+        """Stop reading and close the underlying file"""
+        self._closed = True
+        self._thread.join()
+        self.fileobj.close()
+
+class DecompressingReader(PrefetchReader):
+    """File-like object that reads decompressed data produced by a
+    background thread
+    """
+
+    def __init__(self,
+                 fileobj,
+                 factory,
+                 head='',
+                 name=None,
+                 compression=None,
+                 read_size=DEFAULT_READ_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 decompressor=None):
+        """Start decompressing ``fileobj``
+
+        :param fileobj: compressed file to read from
+        :param factory: callable returning a new decompressor object
+        :param head: compressed bytes already read from ``fileobj``
+        :param name: name of the input, defaults to ``fileobj.name``
+        :param compression: name of the compression format
+        :param read_size: number of compressed bytes to read at a time
+        :param queue_size: number of decompressed chunks to buffer
+        :param decompressor: object decompressing every stream of the input
+                             in turn, used instead of ``factory``
+        """
+        self.compression = compression
+        self._decompressor = decompressor or StreamDecompressor(factory)
+        #: zran checkpoints recorded while decompressing, if any
+        self.checkpoints = getattr(self._decompressor, 'checkpoints', None)
+        PrefetchReader.__init__(self, fileobj, head,
+                                name or getattr(fileobj, 'name',
+                                                '<compressed>'),
+                                read_size, queue_size)
+
+    @property
+    def compressed_offset(self):
+        """Number of compressed bytes read so far"""
+        return self.input_offset
+
+    def _convert(self, data):
+        return self._decompressor.decompress(data)
+
+    def _finish(self):
+        self._decompressor.finish()
+
+    def _error(self, exc):
+        return CompressionError("Failed to decompress %s: %s" %
+                                (self.name, exc))
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes of decompressed data
+
+        :returns: str, empty at the end of the input
+        :raises: `CompressionError` if the input is corrupt or truncated
+        """
+        return PrefetchReader.read(self, size)
+
+class PrefixedReader(object):
+    """Replay bytes already read from a non-seekable file"""
+
+    def __init__(self, head, fileobj):
+        self.head = head
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, 'name', '<stdin>')
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes"""
+        head, self.head = self.head, ''
+        if size < 0:
+            return head + self.fileobj.read()
+        if len(head) >= size:
+            self.head = head[size:]
+            return head[:size]
+        return head + self.fileobj.read(size - len(head))
+
+    def close(self):
+        """Close the underlying file"""
+        self.fileobj.close()
+
+def open_input(path, checkpoint_span=None):
+    """Open a dump for reading, decompressing it if necessary
+
+    :param path: path of the dump, or '-' for standard input
+    :param checkpoint_span: record a `zran` checkpoint every
+                            ``checkpoint_span`` bytes of gzip input, when
+                            libz is available
+    :returns: a file object for uncompressed regular files, which can be
+              memory-mapped and seeked, or a file-like object with a
+              ``read()`` method otherwise.  Decompressing readers have a
+              ``compression`` attribute naming the format and a
+              ``checkpoints`` attribute listing the checkpoints recorded.
+    """
+    if path == '-':
+        fileobj = binary_mode(sys.stdin)
+    else:
+        fileobj = open(path, 'rb')
+    head = fileobj.read(MAGIC_SIZE)
+    name, factory = detect_compression(head)
+    if name is None:
+        try:
+            fileobj.seek(0)
+            return fileobj
+        except IOError:
+            return PrefixedReader(head, fileobj)
+    decompressor = None
+    if name == 'gzip' and checkpoint_span and zran.available:
+        decompressor = zran.Inflater(span=checkpoint_span)
+    return DecompressingReader(fileobj, factory, head=head,
+                               name=getattr(fileobj, 'name', path),
+                               compression=name,
+                               decompressor=decompressor)
@@ -0,0 +1,411 @@
+"""Sidecar index of the nodes in a mysqldump file
+
+An index records, for every node in a dump, the node type, database,
+table, byte range, line range and size.  It is written as tab separated
+text next to the dump (``dump.sql.idx``) and starts with a header line
+recording the size and modification time of the dump it describes, so a
+stale index can be detected and ignored.  It ends with an ``#end`` line
+recording the number of entries and where the dump ends; an index without
+it was interrupted and is not read.  The index is written to a temporary
+file that only replaces the previous index once it is complete.
+
+Byte ranges always refer to the uncompressed dump.  The index of a gzip
+compressed dump may also hold `zran` checkpoints, on ``#checkpoint``
+lines, from which decompression can resume close to any node.
+"""
+
+import os
+from collections import namedtuple
+from holland_restore.scanner import Span
+from holland_restore.zran import format_checkpoint, parse_checkpoint
+
+__all__ = [
+    'INDEX_SUFFIX',
+    'IndexEntry',
+    'IndexBuilder',
+    'IndexWriter',
+    'Index',
+    'IndexFormatError',
+    'IndexedNode',
+    'index_path',
+    'map_range',
+    'open_index',
+    'read_index',
+    'read_range',
+]
+
+#: Suffix added to a dump's path to name its index
+INDEX_SUFFIX = '.idx'
+
+#: Version of the index format written by this module
+INDEX_VERSION = 2
+
+#: Suffix added to an index's path while it is being written
+TEMP_SUFFIX = '.tmp'
+
+#: Number of bytes copied at a time by `read_range`
+DEFAULT_COPY_SIZE = 1024*1024
+
+_MAGIC = '#holland_restore-index'
+
+_CHECKPOINT = '#checkpoint'
+
+_END = '#end'
+
+class IndexFormatError(Exception):
+    """Raised when an index file cannot be read"""
+
+class IndexEntry(namedtuple('IndexEntry', ['type', 'database', 'table',
+                                           'start', 'end',
+                                           'start_line', 'end_line'])):
+    """Location of a single node in a dump
+
+    ``start`` and ``end`` are byte offsets, ``end`` being just past the
+    last byte of the node.  Line numbers are inclusive.
+    """
+    __slots__ = ()
+
+    def size(self):
+        """Number of bytes in the node"""
+        return self.end - self.start
+    size = property(size)
+
+def _escape(name):
+    return (name or '').encode('string_escape')
+
+def _unescape(field):
+    return field.decode('string_escape') or None
+
+def format_entry(entry):
+    """Format an entry as a line of the index file"""
+    return '\t'.join([
+        entry.type,
+        _escape(entry.database),
+        _escape(entry.table),
+        str(entry.start),
+        str(entry.end),
+        str(entry.start_line),
+        str(entry.end_line),
+        str(entry.size),
+    ]) + '\n'
+
+def parse_entry(line):
+    """Parse a line of an index file
+
+    :raises: `IndexFormatError` if the line is malformed
+    """
+    try:
+        (node_type, database, table,
+         start, end, start_line, end_line, _) = line.rstrip('\n').split('\t')
+        return IndexEntry(node_type, _unescape(database), _unescape(table),
+                          int(start), int(end),
+                          int(start_line), int(end_line))
+    except ValueError, exc:
+        raise IndexFormatError("Invalid index entry %r: %s" % (line, exc))
+
+class IndexedNode(object):
+    """Stand-in for a `Node` described by an index entry
+
+    An IndexedNode has no tokens; it carries the type, database and table
+    recorded in the index so filters that only look at those can decide
+    whether the node's byte range is needed.
+    """
+    __slots__ = ('entry', 'type', 'database', 'table', 'location', 'tokens')
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.type = entry.type
+        self.database = entry.database
+        self.table = entry.table
+        self.location = (entry.start_line, entry.start)
+        self.tokens = ()
+
+    def __repr__(self):
+        return "IndexedNode(type=%r)" % self.type
+
+    def clear(self):
+        """Nothing to clear; an indexed node has not read anything"""
+
+class IndexBuilder(object):
+    """Compute index entries from the nodes of a `NodeStream`
+
+    A node ends where the next one starts, so the entry for a node is only
+    complete once the following node, or the end of the stream, is seen.
+    Nodes without a database of their own inherit the most recent one seen,
+    as the mysqldump output they come from applies to it.
+    """
+
+    def __init__(self):
+        self.database = None
+        self.table = None
+        self._pending = None
+
+    def add(self, node):
+        """Record the start of a node
+
+        :param node: next `Node` from the stream
+        :returns: the completed `IndexEntry` of the previous node, or None
+        """
+        try:
+            self.database = node.database or self.database
+        except AttributeError:
+            pass
+        try:
+            self.table = node.table
+        except AttributeError:
+            self.table = None
+        entry = self._complete(node.location)
+        self._pending = (node.type, self.database, self.table, node.location)
+        return entry
+
+    def finish(self, position):
+        """Record the end of the stream
+
+        :param position: (line number, byte offset) just past the last byte,
+                         as given by ``scanner.lineno`` and
+                         ``scanner.next_offset``
+        :returns: the completed `IndexEntry` of the last node, or None
+        """
+        lineno, offset = position
+        return self._complete((lineno + 1, offset))
+
+    def _complete(self, position):
+        if self._pending is None:
+            return None
+        node_type, database, table, start = self._pending
+        self._pending = None
+        return IndexEntry(node_type, database, table,
+                          start[1], position[1],
+                          start[0], position[0] - 1)
+
+class IndexWriter(object):
+    """Write the index of a dump as its nodes are read"""
+
+    def __init__(self, fileobj, source_size, source_mtime, checkpoints=None,
+                 path=None):
+        """Create a new index writer
+
+        :param fileobj: file-like object to write the index to
+        :param source_size: size in bytes of the dump being indexed
+        :param source_mtime: modification time of the dump being indexed
+        :param checkpoints: list of `zran.Checkpoint` filled in while the
+                            dump is read and written when the index is
+                            finished
+        :param path: path the index is moved to once it is finished;
+                     ``fileobj`` is then a temporary file, removed if the
+                     index is aborted
+        """
+        self.fileobj = fileobj
+        self.builder = IndexBuilder()
+        self.checkpoints = checkpoints
+        self.path = path
+        self.entries = 0
+        fileobj.write('%s\t%d\t%d\t%d\n' % (_MAGIC, INDEX_VERSION,
+                                            source_size, int(source_mtime)))
+
+    def add(self, node):
+        """Add a node to the index
+
+        :returns: the `IndexEntry` written for the previous node, or None
+        """
+        entry = self.builder.add(node)
+        if entry is not None:
+            self._write(entry)
+        return entry
+
+    def _write(self, entry):
+        self.fileobj.write(format_entry(entry))
+        self.entries += 1
+
+    def finish(self, position):
+        """Finish the index and close the underlying file
+
+        The index is only moved to its path once it is complete.
+
+        :param position: (line number, byte offset) of the end of the dump
+        :returns: the `IndexEntry` written for the last node, or None
+        """
+        entry = self.builder.finish(position)
+        if entry is not None:
+            self._write(entry)
+        for checkpoint in self.checkpoints or ():
+            self.fileobj.write('%s\t%s\n' % (_CHECKPOINT,
+                                             format_checkpoint(checkpoint)))
+        self.fileobj.write('%s\t%d\t%d\n' % (_END, self.entries,
+                                             position[1]))
+        self.fileobj.close()
+        if self.path is not None:
+            _replace(self.fileobj.name, self.path)
+        return entry
+
+    def abort(self):
+        """Discard an index that cannot be finished"""
+        self.fileobj.close()
+        if self.path is not None:
+            try:
+                os.remove(self.fileobj.name)
+            except OSError:
+                pass
+
+def _replace(source, destination):
+    """Rename ``source`` to ``destination``, replacing it if it exists"""
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # windows does not rename over an existing file
+        if not os.path.exists(destination):
+            raise
+        os.remove(destination)
+        os.rename(source, destination)
+
+class Index(object):
+    """Entries read from an index file"""
+
+    def __init__(self, source_size, source_mtime, entries, checkpoints=(),
+                 end=None):
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self.entries = entries
+        self.checkpoints = list(checkpoints)
+        # offset of the end of the dump when the index was finished
+        self.end = end
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def matches(self, path):
+        """Check whether this index describes the current contents of
+        ``path``
+
+        :returns: True if the file's size and modification time match those
+                  recorded when the index was written
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (st.st_size == self.source_size and
+                int(st.st_mtime) == self.source_mtime)
+
+    def complete(self):
+        """Check whether the entries cover the dump without gaps, from its
+        start to the end recorded when the index was finished
+        """
+        offset = 0
+        for entry in self.entries:
+            if entry.start != offset or entry.end < entry.start:
+                return False
+            offset = entry.end
+        return offset == self.end
+
+def read_range(fileobj, start, end, block_size=DEFAULT_COPY_SIZE):
+    """Read a byte range from a seekable file
+
+    :param fileobj: file to read from
+    :param start: offset of the first byte to read
+    :param end: offset just past the last byte to read
+    :param block_size: maximum number of bytes to read at once
+    :returns: iterator over blocks of data
+    :raises: IOError if the file ends before ``end``
+    """
+    if fileobj.tell() != start:
+        fileobj.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = fileobj.read(min(block_size, remaining))
+        if not block:
+            raise IOError("Unexpected end of file reading bytes %d-%d" %
+                          (start, end))
+        remaining -= len(block)
+        yield block
+
+def map_range(source, start, end, block_size=DEFAULT_COPY_SIZE):
+    """Reference a byte range of a memory-mapped file without copying it
+
+    :param source: mapped file, such as a `holland_restore.scanner.MappedFile`
+    :param start: offset of the first byte of the range
+    :param end: offset just past the last byte of the range
+    :param block_size: maximum number of bytes per span
+    :returns: iterator over `holland_restore.scanner.Span` blocks
+    :raises: IOError if the map ends before ``end``
+    """
+    if end > len(source):
+        raise IOError("Unexpected end of file reading bytes %d-%d" %
+                      (start, end))
+    for offset in xrange(start, end, block_size):
+        yield Span(source, offset, min(offset + block_size, end))
+
+def index_path(path):
+    """Return the path of the index for the dump at ``path``"""
+    return path + INDEX_SUFFIX
+
+def open_index(path, source_path, checkpoints=None):
+    """Create an `IndexWriter` for the dump at ``source_path``
+
+    :param path: path to write the index to
+    :param source_path: path of the dump being indexed
+    :param checkpoints: list the checkpoints of a compressed dump will be
+                        recorded to
+    """
+    st = os.stat(source_path)
+    return IndexWriter(open(path + TEMP_SUFFIX, 'wb'), st.st_size,
+                       st.st_mtime, checkpoints, path)
+
+def _parse_checkpoint(line):
+    try:
+        return parse_checkpoint(line.rstrip('\n').split('\t')[1:])
+    except ValueError, exc:
+        raise IndexFormatError("Invalid checkpoint: %s" % exc)
+
+def _parse_end(line, count, path):
+    try:
+        _, entries, end = line.rstrip('\n').split('\t')
+        entries, end = int(entries), int(end)
+    except ValueError:
+        raise IndexFormatError("Invalid end of index in %s" % path)
+    if entries != count:
+        raise IndexFormatError("%s is incomplete: %d of %d entries" %
+                               (path, count, entries))
+    return end
+
+def read_index(path):
+    """Read an index file
+
+    :param path: path of the index
+    :returns: `Index`
+    :raises: `IndexFormatError` if the file is not an index this version
+             can read, or was not finished
+    """
+    fileobj = open(path, 'rb')
+    try:
+        header = fileobj.readline().rstrip('\n').split('\t')
+        if len(header) != 4 or header[0] != _MAGIC:
+            raise IndexFormatError("%s is not a holland_restore index" % path)
+        try:
+            version, source_size, source_mtime = [int(x) for x in header[1:]]
+        except ValueError:
+            raise IndexFormatError("Invalid index header in %s" % path)
+        if version != INDEX_VERSION:
+            raise IndexFormatError("Unsupported index version %d in %s" %
+                                   (version, path))
+        entries = []
+        checkpoints = []
+        end = None
+        for line in fileobj:
+            if end is not None:
+                raise IndexFormatError("Unexpected data after the end of %s" %
+                                       path)
+            if line.startswith(_CHECKPOINT + '\t'):
+                checkpoints.append(_parse_checkpoint(line))
+            elif line.startswith(_END + '\t'):
+                end = _parse_end(line, len(entries), path)
+            else:
+                entries.append(parse_entry(line))
+        if end is None:
+            raise IndexFormatError("%s is incomplete" % path)
+        return Index(source_size, source_mtime, entries, checkpoints, end)
+    finally:
+        fileobj.close()
@@ -2,3 +2,4 @@
 
 from holland_restore.node.stream import NodeStream
 from holland_restore.node.filter import NodeFilter
+from holland_restore.node.feed import NodeParser
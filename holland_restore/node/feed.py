@@ -0,0 +1,188 @@
+"""Parse nodes from data pushed to the parser instead of read from a file
+
+A `NodeParser` does no I/O of its own.  The caller feeds it data as it
+arrives, from a socket, a pipe or a subprocess driven by any event loop,
+and takes the nodes that are complete after each feed::
+
+    parser = NodeParser()
+    for data in source:
+        parser.feed(data)
+        for node in parser:
+            write(node_filter(node))
+    parser.feed_eof()
+    for node in parser:
+        write(node_filter(node))
+
+Nodes are only returned once all of their tokens have been read, so they
+can be filtered and written without blocking.  The rows of a table are
+returned as they arrive instead, as several consecutive table-dml nodes
+for the same table, so a table's data never has to be held in memory at
+once.
+"""
+
+from holland_restore.scanner import FeedScanner, NeedData
+from holland_restore.tokenizer import read_until
+from holland_restore.node.stream import NodeStream, first_location
+from holland_restore.node.node_types import HeaderNode, SetupSessionNode, \
+                                            TableDML, first_identifier
+
+__all__ = [
+    'NodeParser',
+]
+
+#: Default number of bytes of table data returned in a single table-dml
+#: node
+DEFAULT_PART_SIZE = 4*1024*1024
+
+#: Symbols of the tokens that start a table's data
+TABLE_DATA_SYMBOLS = frozenset(['LockTable', 'AlterTable', 'InsertRow'])
+
+class NodeParser(NodeStream):
+    """Incrementally parse nodes from data fed piece by piece
+
+    Iterating over the parser returns the nodes that can be parsed from the
+    data fed so far.  A node that is cut off by the end of that data is
+    parsed again from its start once more data has been fed.
+    """
+
+    def __init__(self, database=None, header=True,
+                 part_size=DEFAULT_PART_SIZE):
+        """Create a new NodeParser
+
+        :param database: database the stream starts in
+        :param header: False if the stream starts after the dump header and
+                       session setup, at the start of a later node
+        :param part_size: number of bytes of table data after which a
+                          table-dml node is returned even if more rows
+                          could be read
+        """
+        self.scanner = FeedScanner()
+        NodeStream.__init__(self, self.scanner, database, header)
+        self.part_size = part_size
+        self._setup = header
+        self._location = None
+        # (database, table) whose data is being read
+        self._table = None
+        self._saved = None
+        self._commit()
+
+    def feed(self, data):
+        """Add data to the end of the dump"""
+        self.scanner.feed(data)
+
+    def feed_eof(self):
+        """Mark the end of the dump
+
+        The nodes still buffered are returned by the next iteration.
+        """
+        self.scanner.feed_eof()
+
+    def _commit(self):
+        self.scanner.commit()
+        self._saved = (list(self._queue), self._current_db, self._location,
+                       list(self._tokenizer.token_queue))
+
+    def _rewind(self):
+        self.scanner.rewind()
+        queue, self._current_db, self._location, lookahead = self._saved
+        self._queue[:] = queue
+        self._tokenizer.token_queue.clear()
+        self._tokenizer.token_queue.extend(lookahead)
+
+    def __iter__(self):
+        """Iterate over the nodes that are complete in the data fed so far"""
+        while self.scanner.ready():
+            try:
+                node = self._parse()
+            except NeedData:
+                self._rewind()
+                return
+            except StopIteration:
+                # end of the dump
+                self._rewind()
+                return
+            self._commit()
+            if node is not None:
+                yield node
+
+    def _parse(self):
+        """Parse the next node
+
+        :returns: the node, or None if the tokens read only start a node
+        :raises: `NeedData` if the data fed so far ends inside the node
+        """
+        if self._table is not None:
+            return self._parse_table_data([])
+        if self.header:
+            tokens = read_until(['BlankLine'], self._tokenizer,
+                                inclusive=True)
+            node = HeaderNode(tokens)
+            node.location = first_location(tokens)
+            if node.database:
+                self._current_db = node.database
+            self.header = False
+            return node
+        if self._setup:
+            tokens = read_until(['BlankLine'], self._tokenizer,
+                                inclusive=True)
+            node = SetupSessionNode(tokens)
+            node.location = first_location(tokens)
+            self._setup = False
+            return node
+        token = self._tokenizer.next()
+        if self._location is None:
+            # the first token read after a node starts the next one
+            self._location = first_location([token])
+        if token.symbol in TABLE_DATA_SYMBOLS:
+            leading = self._queue.flush() + [token]
+            self._table = (self._current_db, first_identifier(leading))
+            return self._parse_table_data(leading)
+        node = None
+        for node in self.next_chunk(token):
+            pass
+        if node is not None:
+            node.location = self._location
+            self._location = None
+        return node
+
+    def _parse_table_data(self, tokens):
+        """Read the rows of the current table that have been fed, up to
+        ``part_size`` bytes of them
+
+        :param tokens: tokens already read that start the node
+        :returns: table-dml node, or None if the table has no more rows
+        :raises: `NeedData` if no rows could be read
+        """
+        tokenizer = self._tokenizer
+        scanner = self.scanner
+        database, table = self._table
+        size = 0
+        while size < self.part_size:
+            if not tokenizer.token_queue:
+                # only the scanner's position changes while reading rows
+                scanner.commit()
+            try:
+                token = tokenizer.next()
+            except NeedData:
+                scanner.rewind()
+                if not tokens:
+                    raise
+                break
+            except StopIteration:
+                self._table = None
+                break
+            if token.symbol == 'SqlComment':
+                tokenizer.push_back(token)
+                self._table = None
+                break
+            tokens.append(token)
+            size += len(token.text)
+        if not tokens:
+            # the previous node ended with the last row
+            return None
+        node = TableDML(tokens)
+        node.database = database
+        node.table = table
+        node.location = self._location or first_location(tokens)
+        self._location = None
+        return node
@@ -1,5 +1,11 @@
 """Node Filtering"""
 
+from holland_restore.node.base import SkipNode
+
+#: Node types that define a table or view; a verdict reached on one of these
+#: applies to the nodes that follow for the same table
+DEFINING_TYPES = frozenset(['table-ddl', 'view-temp-ddl'])
+
 def emit_node(node):
     """Yield the concatenated text of all tokens in a node.
 
@@ -11,10 +17,14 @@ def stream_node(node):
     """Stream text from a node.
 
     Unlike emit_node this will go in smaller chunks intentionally to avoid 
-    materializing a very large node
+    materializing a very large node.  Token text backed by a memory-mapped
+    file is yielded as a `holland_restore.scanner.Span` so it can be
+    written without being copied, and oversized lines are yielded a block
+    at a time.
     """
     for token in node.tokens:
-        yield str(token.text)
+        for chunk in token.chunks():
+            yield chunk
 
 class NodeFilter(object):
     """Filter a Node from a NodeStream with a simple
@@ -43,11 +53,27 @@ class NodeFilter(object):
             'database-events' : emit_node,
         }
         self._rewriters = {}
+        self.database = None
+        self.table = None
+        # (database, table) pairs skipped when their ddl was filtered
+        self.rejected = set()
+        # (database, table) pairs whose ddl passed every filter
+        self.accepted = set()
+        # exact databases the output is restricted to, if tracked
+        self.databases = None
+        self._outstanding = set()
+        self._ended = set()
+        self._section = None
+        # database -> views whose final ddl has yet to be written
+        self._views = {}
         self.register('dump-header', parse_header)
         self.register('database-ddl', parse_database)
+        self.register('view-finalize-db', parse_database)
         self.register('table-ddl', parse_table)
         self.register('view-temp-ddl', parse_view)
         self.register('view-ddl', parse_view)
+        self.register('table-dml', skip_rejected)
+        self.register('view-ddl', skip_rejected)
 
     def register(self, event, callback):
         """Register a node handler"""
@@ -77,37 +103,133 @@ class NodeFilter(object):
         except KeyError:
             # no rewriter for node type
             pass
+        except SkipNode:
+            if node.type in DEFINING_TYPES:
+                self.reject(self.database, self.table)
+            node.clear()
+            raise
         except:
             node.clear()
             raise
+        if node.type in DEFINING_TYPES:
+            self.accept(self.database, self.table)
+        if self.databases is not None:
+            self._accepted(node)
         return dispatch(node)
 
+    def _accepted(self, node):
+        """Note a view whose final ddl must still be written"""
+        if node.type == 'view-temp-ddl':
+            self._views.setdefault(self.database, set()).add(self.table)
+        elif node.type == 'view-ddl':
+            self._views.get(self.database, set()).discard(self.table)
+
+    def track(self, databases):
+        """Track the nodes written for an exact list of databases, so that
+        `finished` can tell when nothing more may be written
+
+        :param databases: names of the only databases whose nodes may be
+                          written
+        """
+        self.databases = frozenset(databases)
+
+    def finished(self, node):
+        """Check whether every node that may be written preceded ``node``
+
+        A tracked database is finished once its section of tables and
+        routines has ended and the final ddl of every view accepted in it
+        was written.  A database that is missing from the dump is never
+        finished, so the whole dump is read.  This must be called with each
+        node of a dump before the node is filtered.
+
+        :returns: True if the rest of the dump can be skipped, apart from
+                  the session restore and final nodes
+        """
+        if self.databases is None:
+            return False
+        if node.type == 'dump-header':
+            self._outstanding = set(self.databases)
+            self._ended = set()
+            self._section = None
+            self._views = {}
+            return False
+        if node.type in ('restore-session', 'final'):
+            return False
+        if node.type in ('database-ddl', 'view-finalize-db'):
+            # the tables and routines of the previous database end here
+            if self._section is not None:
+                self._ended.add(self._section)
+            self._section = None
+            if node.type == 'database-ddl':
+                self._section = node.database
+        for database in list(self._ended):
+            if not self._views.get(database):
+                self._outstanding.discard(database)
+                self._ended.discard(database)
+        return not self._outstanding
+
+    def reject(self, database, table):
+        """Skip all later nodes for the given table or view
+
+        :param database: database name of the table
+        :param table: name of the table or view
+        """
+        self.accepted.discard((database, table))
+        self.rejected.add((database, table))
+
+    def accept(self, database, table):
+        """Keep all later nodes for the given table or view
+
+        :param database: database name of the table
+        :param table: name of the table or view
+        """
+        self.rejected.discard((database, table))
+        self.accepted.add((database, table))
+
+    def is_rejected(self, database, table):
+        """Check whether a table or view was previously rejected
+
+        :returns: True if nodes for this table should be skipped
+        """
+        return (database, table) in self.rejected
+
+    def is_accepted(self, database, table):
+        """Check whether a table or view previously passed every filter
+
+        :returns: True if nodes for this table should be kept
+        """
+        return (database, table) in self.accepted
+
 def parse_database(self, node):
-    for token in node:
-        if token.symbol in ('UseDatabase', 'CreateDatabase'):
-            self.database, = token.extract('.*?`((?:``|[^`])+)`')
-            break
+    """Track the current database from a database-ddl node"""
+    self.database = node.database
     return node
 
 def parse_table(self, node):
-    for token in node:
-        if token.symbol in ('CreateTable',):
-            self.table, = token.extract('.*?`((?:``|[^`])+)`')
-            break
+    """Track the current table from a table-ddl node"""
+    self.table = node.table
     return node
 
 def parse_view(self, node):
-    for token in node:
-        if token.symbol == 'CreateTmpView':
-            self.table, = token.extract('.*?`((?:``|[^`])+)`')
-            break
-        if token.symbol == 'CreateView':
-            self.table, = token.extract('^/[*]!50001 VIEW `((?:``|[^`])+)`')
-            break
+    """Track the current view from a view-temp-ddl or view-ddl node"""
+    self.table = node.table
+    return node
+
+def skip_rejected(self, node):
+    """Skip a table-dml or view-ddl node whose table was already rejected
+
+    The verdict reached on the table's ddl decides the node; name filters
+    are only evaluated on the `DEFINING_TYPES`.  Data of a table whose ddl
+    is not in the dump has no verdict and is kept.
+    """
+    if self.is_accepted(self.database, self.table):
+        return node
+    if self.is_rejected(self.database, self.table):
+        raise SkipNode()
     return node
 
 def parse_header(self, node):
-    for token in node:
-        if 'Database: ' in token.text:
-            self.database, = token.extract('.*Database: (.*)$')
+    """Track the database named in the dump header, if any"""
+    if node.database:
+        self.database = node.database
     return node
@@ -1,17 +1,31 @@
 """Node types emitted by a NodeStream"""
 
 import itertools
+from holland_restore.scanner import ChunkedLine
+from holland_restore.tokenizer.extract import EXTRACTORS
+
+IDENTIFIER = EXTRACTORS['identifier']
 
 class Node(object):
     """A collection of tokens representing a logical section
     in a mysqldump file
+
+    The database and table a node refers to are parsed from its tokens the
+    first time they are requested and cached on the node.  Subclasses
+    describe how to find them by overriding `parse_database` and
+    `parse_table`.
+
+    ``location`` is the (line number, byte offset) of the start of the node
+    in the source, as set by the `NodeStream` that produced it.
     """
+    __slots__ = ('tokens', 'location', '_database', '_table')
 
     def __init__(self, tokens=()):
         self.tokens = tokens
+        self.location = None
 
     def __str__(self):
-        return "".join([t.text for t in self.tokens])
+        return "".join([str(t.text) for t in self.tokens])
 
     def __repr__(self):
         return self.__class__.__name__ + "(type=%r)" % self.type
@@ -19,6 +33,54 @@ class Node(object):
     def __iter__(self):
         return iter(self.tokens)
 
+    def database(self):
+        """Name of the database this node refers to
+
+        :raises: AttributeError if this node type has no database and none
+                 has been assigned
+        """
+        try:
+            return self._database
+        except AttributeError:
+            self._database = self.parse_database()
+            return self._database
+
+    def _set_database(self, name):
+        self._database = name
+    database = property(database, _set_database)
+
+    def table(self):
+        """Name of the table or view this node refers to
+
+        :raises: AttributeError if this node type has no table and none
+                 has been assigned
+        """
+        try:
+            return self._table
+        except AttributeError:
+            self._table = self.parse_table()
+            return self._table
+
+    def _set_table(self, name):
+        self._table = name
+    table = property(table, _set_table)
+
+    def parse_database(self):
+        """Parse the database name from this node's tokens
+
+        This must be overriden in a subclass to be useful
+        as the default implementation raises AttributeError
+        """
+        raise AttributeError("%r has no database" % self)
+
+    def parse_table(self):
+        """Parse the table name from this node's tokens
+
+        This must be overriden in a subclass to be useful
+        as the default implementation raises AttributeError
+        """
+        raise AttributeError("%r has no table" % self)
+
     def find(self, symbol):
         """Find a token with the given symbol in this node
 
@@ -37,18 +99,29 @@ class Node(object):
         as the default implementation does nothing
         """
 
+def first_identifier(tokens):
+    """Return the first backtick quoted identifier in a list of tokens"""
+    for token in tokens:
+        text = token.text
+        if isinstance(text, ChunkedLine):
+            # only look at the part of an oversized line held in memory
+            text = text.head
+        if '`' in text:
+            return IDENTIFIER(str(text))[0]
+
 class ReplicationNode(Node):
     """Representation of a node containing replication status
 
     CHANGE MASTER TO ...
     """
+    __slots__ = ()
     type = 'replication'
 
     def position(self):
         """A convenience function to extract out the position in replication"""
         for token in self.tokens:
             if token.symbol == 'ChangeMaster':
-                binlog, position = token.extract("'([^']+).*(\d+)'")
+                binlog, position = token.extract(EXTRACTORS['binlog-position'])
                 position = int(position)
                 return binlog, position
     position = property(position)
@@ -57,76 +130,86 @@ class HeaderNode(Node):
     """Representation of the initial comment block in a mysqldump
     file.
     """
+    __slots__ = ()
     type = 'dump-header'
 
-    def database(self):
-        """In a --databases dump, the header will also list the name of 
+    def parse_database(self):
+        """In a --databases dump, the header will also list the name of
         the database
         """
         for token in self.tokens:
             if 'Database:' in token.text:
-                return token.extract("Database: (.*)$")[0]
-    database = property(database)
+                return token.extract(EXTRACTORS['header-database'])[0]
 
 class DatabaseDDL(Node):
-    """Representation of a node containing DDL to create/connect to a 
+    """Representation of a node containing DDL to create/connect to a
     database
     """
+    __slots__ = ()
     type = 'database-ddl'
 
-    def database(self):
-        for token in self.tokens:
-            if '`' in token.text:
-                return token.extract('`((?:``|[^`])+)`')[0]
-    database = property(database)
+    def parse_database(self):
+        return first_identifier(self.tokens)
 
 class SetupSessionNode(Node):
     """Representation of a node containing a set of SET VARIABLE statements
     used to save the state of the existing session before proceeding with
     a dump
     """
+    __slots__ = ()
     type = 'setup-session'
 
 class RestoreSessionNode(Node):
     """Representation of a node containing a set of SET VARIABLE statemetns
     to restore the previous state of a session before a dump started
     """
+    __slots__ = ()
     type = 'restore-session'
 
 class ViewDDL(Node):
     """Node containing CREATE VIEW DDL"""
+    __slots__ = ()
     type = 'view-ddl'
- 
-    def table(self):
-        tokens = []
-        for token in self.tokens:
-            tokens.append(token)
-            if '`' in token.text:
-                return token.extract('`((?:``|[^`])+)`')[0]
-    table = property(table)   
+
+    def parse_table(self):
+        return first_identifier(self.tokens)
 
 class ViewTemporaryDDL(ViewDDL):
+    __slots__ = ()
     type = 'view-temp-ddl'
 
 class TableDDL(Node):
     """Node containing CREATE TABLE DDL"""
+    __slots__ = ()
     type = 'table-ddl'
 
-    def table(self):
-        tokens = []
-        for token in self.tokens:
-            tokens.append(token)
-            if '`' in token.text:
-                return token.extract('`((?:``|[^`])+)`')[0]
-    table = property(table)
+    def parse_table(self):
+        return first_identifier(self.tokens)
+
+#: Lines that may end the data of a table: a comment, normally the start
+#: of the next section, or a DELIMITER block whose body has to be
+#: tokenized as a whole since it may contain comment lines
+DML_SKIP_PREFIXES = ('--', 'DELIMITER ;;')
 
 class TableDML(Node):
-    """Node containing table data"""
+    """Node containing table data
+
+    The tokens of a TableDML node are read lazily, so the table name is
+    assigned by the `NodeStream` rather than parsed from the tokens.
+    """
+    __slots__ = ('tokenizer',)
     type = 'table-dml'
-    
-    def table(self):
-        return 'dml'
-    table = property(table)
+
+    def __init__(self, tokens=(), tokenizer=None):
+        """Create a new TableDML node
+
+        :param tokens: lazy iterator over the node's tokens
+        :param tokenizer: `Tokenizer` the tokens are read from; if given,
+                          `clear()` skips the rest of the node without
+                          tokenizing it
+        """
+        Node.__init__(self, tokens)
+        self.tokenizer = tokenizer
 
     def __str__(self):
         return 'TableDML()'
@@ -135,42 +218,62 @@ class TableDML(Node):
         """Ensure that tokens iterator is always exhausted to
         ensure we progress to the appropriate point in the backing
         tokenizer
+
+        With a tokenizer, the remaining data is skipped by searching the
+        raw input for the next comment line, as the tokens would end at
+        the first SqlComment token.
         """
-        for token in self.tokens:
-            del token
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            for token in self.tokens:
+                if isinstance(token.text, ChunkedLine):
+                    token.text.discard()
+            return
+        self.tokenizer = None
+        self.tokens = iter(())
+        while True:
+            tokenizer.skip_until(DML_SKIP_PREFIXES)
+            try:
+                token = tokenizer.peek()
+            except StopIteration:
+                break
+            if token.symbol == 'SqlComment':
+                break
+            # a trigger or routine block, or a commented CHANGE MASTER
+            tokenizer.next()
 
 class DatabaseRoutines(Node):
     """Node containing routines in a database"""
+    __slots__ = ()
     type = 'database-routines'
 
-    def database(self):
+    def parse_database(self):
         for token in self.tokens:
             if "'" in token.text:
-                return token.extract("'((?:``|[^`])+)'")[0]
-    database = property(database)
+                return token.extract(EXTRACTORS['routines-database'])[0]
 
     def routines(self):
         for token in self.tokens:
             if 'FUNCTION `' in token.text:
-                yield token.extract('FUNCTION `((?:``|[^`])+)`')[0]
+                yield token.extract(EXTRACTORS['function'])[0]
             if 'PROCEDURE `' in token.text:
-                yield token.extract('PROCEDURE `((?:``|[^`])+)`')[0]
+                yield token.extract(EXTRACTORS['procedure'])[0]
     routines = property(routines)
 
 class DatabaseEvents(Node):
     """Node containing database events"""
+    __slots__ = ()
     type = 'database-events'
 
 class ReconnectDBFinalizeView(Node):
     """Node containing a USE statement before restoring views for a schema"""
+    __slots__ = ()
     type = 'view-finalize-db'
- 
-    def database(self):
-        for token in self.tokens:
-            if '`' in token.text:
-                return token.extract('`((?:``|[^`])+)`')[0]
-    database = property(database)
+
+    def parse_database(self):
+        return first_identifier(self.tokens)
 
 class FinalNode(Node):
     """Node containing the final Dump Completed line"""
+    __slots__ = ()
     type = 'final'
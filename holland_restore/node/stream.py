@@ -27,6 +27,15 @@ class TokenQueue(list):
         finally:
             self.clear()
 
+def first_location(tokens):
+    """Return the (line number, byte offset) of the first token in a list
+
+    :returns: tuple or None if the list is empty
+    """
+    if not tokens:
+        return None
+    return tokens[0].line_range[0], tokens[0].offset
+
 def categorize_comment_block(tokens):
     """Generate a node based only on a set of tokens"""
     meat = tokens[1]
@@ -44,24 +53,28 @@ class NodeStream(object):
     generate a Node grouping related tokens
     """
 
-    def __init__(self, stream):
+    def __init__(self, stream, database=None, header=True):
         """Create a new DumpParser
 
         :param stream: stream to parser
-        :type stream: any iterable that yields lines for mysqldump output
+        :type stream: any iterable that yields lines for mysqldump output or
+                      a `holland_restore.scanner.Scanner` instance
+        :param database: database the stream starts in
+        :param header: False if the stream starts after the dump header and
+                       session setup, at the start of a later node
         """
         self._queue = TokenQueue()
         self._tokenizer = Tokenizer(stream, RULES)
-        self._current_db = None
+        self._current_db = database
+        self.header = header
 
     def process_comments(self, token, tokenizer):
         """Process a comment block.  If it is an empty 'section', try to figure 
         out the node type based on the comment text.
         """
-        tokens = read_sequence(['SqlComment', 'SqlComment'], tokenizer)
-        next_token = tokenizer.peek()
-        if next_token.symbol is 'BlankLine':
-            tokens.insert(0, token)
+        tokens = [token] + read_sequence(['SqlComment', 'SqlComment'],
+                                         tokenizer)
+        if tokenizer.peek().symbol is 'BlankLine':
             tokens.append(tokenizer.next())
             if tokenizer.peek().symbol is 'SqlComment':
                 # empty section
@@ -104,12 +117,7 @@ class NodeStream(object):
     def handle_variable(self, token):
         assert 'TIME_ZONE' in token.text
         self._queue.append(token)
-        for _token in self._tokenizer:
-            if _token.symbol in ('SetVariable', 'BlankLine'):
-                self._queue.append(_token)
-            else:
-                self._tokenizer.push_back(_token)
-                break
+        self._queue.extend(self._read_while(('SetVariable', 'BlankLine')))
         return RestoreSessionNode(self._queue.flush())
 
     def handle_comment(self, token):
@@ -121,12 +129,20 @@ class NodeStream(object):
     def handle_conditional_comment(self, token):
         # queue up until we hit something that is != SetVariable
         self._queue.append(token)
-        for _token in self._tokenizer:
-            if _token.symbol == 'SetVariable':
-                self._queue.append(_token)
-            else:
-                self._tokenizer.push_back(_token)
-                break
+        self._queue.extend(self._read_while(('SetVariable',)))
+
+    def _read_while(self, symbols):
+        """Read tokens from the tokenizer as long as the next token's symbol
+        is in ``symbols``
+        """
+        tokenizer = self._tokenizer
+        tokens = []
+        try:
+            while tokenizer.peek().symbol in symbols:
+                tokens.append(tokenizer.next())
+        except StopIteration:
+            pass
+        return tokens
         
     def handle_create_db(self, token):
         tokens = (self._queue.flush() + [token] +
@@ -147,23 +163,26 @@ class NodeStream(object):
 
     # token.symbol in ('LockTable', 'AlterTable', 'InsertRow'):
     def handle_table_data(self, token):
-        tokens = itertools.chain(self._queue.flush() + [token],
+        leading = self._queue.flush() + [token]
+        tokens = itertools.chain(leading,
                                  yield_until(['SqlComment'], 
                                              self._tokenizer))
-        foo = TableDML(tokens)
+        foo = TableDML(tokens, self._tokenizer)
         foo.database = self._current_db
+        foo.table = first_identifier(leading)
         return foo
 
     #elif token.symbol is 'ChangeMaster':
     def handle_replication(self, token):
         tokens = (self._queue.flush() +
-                  [self._tokenizer.next()] # blank line
+                  [token, self._tokenizer.next()] # blank line
                  )
         return ReplicationNode(tokens)
 
     #elif token.symbol is 'CreateRoutine':
     def handle_routines(self, token):
         tokens = (self._queue.flush() +
+                  [token] +
                   read_until(['SqlComment'], self._tokenizer))
         return DatabaseRoutines(tokens)
 
@@ -201,16 +220,31 @@ class NodeStream(object):
         grouped tokens as Node instances
         """
         
+        location = None
         for token in self._tokenizer:
+            if location is None:
+                # the first token read after a node starts the next one
+                location = first_location([token])
             for chunk in self.next_chunk(token):
                 if chunk is not None:
+                    chunk.location = location
+                    location = None
                     yield chunk
+                    if chunk.type == 'table-dml':
+                        # skip any data the consumer did not read
+                        chunk.clear()
 
     def __iter__(self):
+        if not self.header:
+            for chunk in self.iter_chunks():
+                yield chunk
+            return
+
         tokens = read_until(['BlankLine'], 
                             self._tokenizer,
                             inclusive=True)
         foo = HeaderNode(tokens)
+        foo.location = first_location(tokens)
         if foo.database:
             self._current_db = foo.database
         yield foo
@@ -218,7 +252,9 @@ class NodeStream(object):
         tokens = read_until(['BlankLine'], 
                             self._tokenizer, 
                             inclusive=True)
-        yield SetupSessionNode(tokens)
+        foo = SetupSessionNode(tokens)
+        foo.location = first_location(tokens)
+        yield foo
 
         for chunk in self.iter_chunks():
             yield chunk
@@ -1,13 +1,14 @@
 """Node utility methods"""
 
+import re
 import logging
+from holland_restore.scanner import Span, ChunkedLine
 from holland_restore.tokenizer import Token
+from holland_restore.tokenizer.extract import EXTRACTORS
 from holland_restore.node.base import SkipNode
+from holland_restore.node.node_types import RestoreSessionNode, FinalNode
 from holland_restore.util import Filter, FilteredItem
 
-class SkipNode(Exception):
-    """Raised when a node is skipped by a utility filter"""
-
 def skip_databases(include=('*',), exclude=()):
     """Create a handler to evaluate database-ddl and skip the node based
     on an inclusion/exclusion check
@@ -51,6 +52,9 @@ def skip_engines(include=('*',), exclude=()):
     ddl + dml based on a table engine using an inclusion/exclusion
     check
 
+    The data and final view ddl of a skipped table are skipped by the
+    dispatcher's record of rejected tables.
+
     :param include: list of glob patterns that must match for inclusions
     :param exclude: list of glob patterns that should be excluded
     """
@@ -62,7 +66,7 @@ def skip_engines(include=('*',), exclude=()):
         """Process node and skip based on engine filters"""
         for token in node.tokens:
             if token.symbol is 'CreateTable':
-                engine, = token.extract('^[)] ENGINE=([a-zA-Z]+)')
+                engine, = token.extract(EXTRACTORS['engine'])
             elif token.symbol is 'CreateTmpView':
                 engine = 'view'
             else:
@@ -70,13 +74,6 @@ def skip_engines(include=('*',), exclude=()):
             try:
                 check(engine.lower())
             except FilteredItem:
-                name = '%s.%s' % (dispatcher.database, dispatcher.table)
-                # add a check for the dm - should be a one shot check
-                if engine == 'view':
-                    dispatcher.register('view-ddl', skip_tables(exclude=[name]))
-                else:
-                    dispatcher.register('table-dml', 
-                                        skip_tables(exclude=[name]))
                 raise SkipNode()
         return node
     return _skip_handler
@@ -112,10 +109,297 @@ def skip_triggers(dispatcher, node):
     """
     def filter_triggers(tokens):
         for token in tokens:
-            if token.symbol in ('CreateTrigger', 'SetVariable'):
+            if token.symbol == 'CreateTrigger':
+                continue
+            # session settings saved and restored around each trigger
+            if token.symbol == 'SetVariable' and \
+               token.text.startswith('/*!50003 SET'):
                 continue
             yield token
-            if token.symbol == 'BlankLine':
-                break
     node.tokens = filter_triggers(node.tokens)
     return node
+
+#: Any backtick quoted identifier
+_IDENTIFIER = re.compile(r'`((?:``|[^`])+)`')
+
+#: A backtick quoted identifier qualifying a table or routine name
+_QUALIFIER = re.compile(r'`((?:``|[^`])+)`(?=[.])')
+
+#: The database named in the header of a single database dump
+_HEADER_DATABASE = re.compile(r'^(-- .*Database: )(.+)$', re.M)
+
+#: The database named in the comment before its routines or events
+_SECTION_DATABASE = re.compile(r"^(-- Dumping \w+ for database ')(.+)(')$",
+                               re.M)
+
+def rename_databases(names):
+    """Create a handler that renames databases in the nodes that name them
+
+    Database names are rewritten in the dump header, the CREATE DATABASE and
+    USE statements of database-ddl and view-finalize-db nodes, and the
+    names qualifying tables in view and routine definitions.  A qualifier
+    that is also the name of a table in the current database is left
+    alone, as it more likely qualifies a column; mysqldump does not qualify
+    tables of the current database.  Table data is never rewritten, as
+    mysqldump writes unqualified INSERT statements; the handler only
+    renames the database of the nodes of other types, so sinks see the new
+    name.  The handler must also be registered for table-ddl and
+    view-temp-ddl nodes, after any filters, which match the original names.
+
+    :param names: dict mapping original database names to new names
+    """
+    quoted = dict([(old.replace('`', '``'), new.replace('`', '``'))
+                   for old, new in names.items()])
+
+    # database -> tables and views seen in it
+    tables = {}
+
+    def _rename_identifier(match):
+        try:
+            return '`%s`' % quoted[match.group(1)]
+        except KeyError:
+            return match.group(0)
+
+    def _rename_qualifier(ambiguous):
+        def _rename(match):
+            if match.group(1) in ambiguous:
+                return match.group(0)
+            return _rename_identifier(match)
+        return _rename
+
+    def _rename_section(match):
+        try:
+            return match.group(1) + names[match.group(2)] + match.group(3)
+        except KeyError:
+            return match.group(0)
+
+    def _rename_header(match):
+        try:
+            return match.group(1) + names[match.group(2)]
+        except KeyError:
+            return match.group(0)
+
+    def _rename_tokens(tokens, *rules):
+        result = []
+        for token in tokens:
+            text = str(token.text)
+            renamed = text
+            for pattern, replace in rules:
+                renamed = pattern.sub(replace, renamed)
+            if renamed != text:
+                token = Token(token.symbol, renamed, token.line_range, -1)
+            result.append(token)
+        return result
+
+    def _rename_handler(dispatcher, node):
+        """Rewrite the database names of a node"""
+        if node.type == 'dump-header':
+            node.tokens = _rename_tokens(node.tokens,
+                                         (_HEADER_DATABASE, _rename_header))
+        elif node.type in ('database-ddl', 'view-finalize-db'):
+            node.tokens = _rename_tokens(node.tokens,
+                                         (_IDENTIFIER, _rename_identifier))
+        elif node.type in ('table-ddl', 'view-temp-ddl'):
+            tables.setdefault(dispatcher.database, set()).add(dispatcher.table)
+        elif node.type in ('view-ddl', 'database-routines',
+                           'database-events'):
+            ambiguous = tables.get(dispatcher.database, ())
+            node.tokens = _rename_tokens(node.tokens,
+                                         (_SECTION_DATABASE, _rename_section),
+                                         (_QUALIFIER,
+                                          _rename_qualifier(ambiguous)))
+        try:
+            database = node.database
+        except AttributeError:
+            return node
+        if database in quoted:
+            node.database = quoted[database]
+        return node
+    return _rename_handler
+
+_SAVED_VARIABLE = re.compile(r'/\*!(\d+) SET @OLD_(\w+)=@@\2\b')
+
+def restore_session(setup):
+    """Build the node restoring the session variables saved by a
+    setup-session node
+
+    mysqldump restores these at the end of a dump; this stands in for them
+    when the end of a dump is not read.  The time zone is restored first,
+    as mysqldump does, and the other variables in the reverse order they
+    were saved.
+
+    :param setup: setup-session node of the dump
+    :returns: `RestoreSessionNode`
+    """
+    statements = []
+    for token in setup.tokens:
+        match = _SAVED_VARIABLE.match(str(token.text))
+        if match is None:
+            continue
+        version, name = match.groups()
+        statements.append((name, '/*!%s SET %s=@OLD_%s */;\n' %
+                                 (version, name, name)))
+    statements.reverse()
+    tokens = [Token('SetVariable', text, (), -1)
+              for name, text in statements if name == 'TIME_ZONE']
+    if tokens:
+        tokens.append(Token('BlankLine', '\n', (), -1))
+    tokens.extend([Token('SetVariable', text, (), -1)
+                   for name, text in statements if name != 'TIME_ZONE'])
+    tokens.append(Token('BlankLine', '\n', (), -1))
+    return RestoreSessionNode(tokens)
+
+def final_node():
+    """Build a final node for a dump whose end was not read"""
+    return FinalNode([
+        Token('SqlComment',
+              '-- Rest of dump skipped after the last requested object\n',
+              (), -1)
+    ])
+
+#: Number of bytes of a memory-mapped token examined at a time when
+#: splitting INSERT statements
+SPLIT_CHUNK_SIZE = 1024*1024
+
+def _text_chunks(text, size=SPLIT_CHUNK_SIZE):
+    """Yield the text of a token in pieces of at most ``size`` bytes
+
+    Memory-mapped text is sliced and a `ChunkedLine` is read a block at a
+    time; a str is already in memory and is yielded whole.
+    """
+    if isinstance(text, Span):
+        for start in xrange(0, len(text), size):
+            yield text[start:start + size]
+    elif isinstance(text, ChunkedLine):
+        for chunk in text.chunks():
+            yield chunk
+    else:
+        yield text
+
+_ROW_SPECIAL = re.compile("[()']").search
+_QUOTE_SPECIAL = re.compile(r"[\\']").search
+
+def iter_insert_rows(chunks):
+    """Iterate over the value tuples of an extended INSERT statement
+
+    The statement is read from an iterable of text chunks and each tuple is
+    yielded as soon as its closing parenthesis is seen, so only one tuple
+    is held in memory at a time.  Quotes and backslash escapes are honored,
+    so parentheses and commas inside string values do not end a tuple.
+
+    :param chunks: iterable of strings that together make up the text
+                   following the VALUES keyword
+    :returns: iterator over the text of each tuple, including parentheses
+    """
+    parts = []
+    depth = 0
+    quoted = False
+    escaped = False
+    for chunk in chunks:
+        pos = 0
+        start = 0
+        end = len(chunk)
+        if escaped:
+            pos = 1
+            escaped = False
+        while pos < end:
+            if not depth:
+                pos = chunk.find('(', pos)
+                if pos == -1:
+                    break
+                depth = 1
+                start = pos
+                pos += 1
+            elif quoted:
+                match = _QUOTE_SPECIAL(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == '\\':
+                    if pos == end:
+                        escaped = True
+                    pos += 1
+                else:
+                    quoted = False
+            else:
+                match = _ROW_SPECIAL(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                char = match.group()
+                if char == "'":
+                    quoted = True
+                elif char == '(':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        parts.append(chunk[start:pos])
+                        yield ''.join(parts)
+                        del parts[:]
+        if depth:
+            parts.append(chunk[start:])
+
+def split_insert(token, max_bytes=None, max_rows=None):
+    """Split an extended INSERT token into several smaller statements
+
+    :param token: InsertRow token to split
+    :param max_bytes: maximum size of each generated statement.  A single
+                      row larger than this is still emitted whole.
+    :param max_rows: maximum number of rows in each generated statement
+    :returns: iterator over new InsertRow tokens
+    """
+    text = token.text
+    idx = str(text[:min(len(text), 4096)]).find(' VALUES ')
+    if idx == -1:
+        yield token
+        return
+    prefix = str(text[:idx + len(' VALUES ')])
+    overhead = len(prefix) + len(';\n')
+
+    def flush(rows):
+        statement = prefix + ','.join(rows) + ';\n'
+        return Token(token.symbol, statement, token.line_range, -1)
+
+    def values():
+        chunks = _text_chunks(text)
+        yield chunks.next()[len(prefix):]
+        for chunk in chunks:
+            yield chunk
+
+    rows = []
+    size = overhead
+    for row in iter_insert_rows(values()):
+        if rows and ((max_rows and len(rows) >= max_rows) or
+                     (max_bytes and size + len(row) + 1 > max_bytes)):
+            yield flush(rows)
+            rows = []
+            size = overhead
+        rows.append(row)
+        size += len(row) + 1
+    if rows:
+        yield flush(rows)
+
+def split_inserts(max_bytes=None, max_rows=None):
+    """Create a handler that splits the extended INSERT statements in a
+    table-dml node into statements of bounded size
+
+    :param max_bytes: maximum size in bytes of each INSERT statement
+    :param max_rows: maximum number of rows in each INSERT statement
+    """
+    def _split_tokens(tokens):
+        for token in tokens:
+            # the length of a chunked line is not known until it is read
+            if token.symbol != 'InsertRow' or \
+               (not max_rows and not isinstance(token.text, ChunkedLine) and
+                len(token.text) <= max_bytes):
+                yield token
+                continue
+            for split_token in split_insert(token, max_bytes, max_rows):
+                yield split_token
+
+    def _split_handler(dispatcher, node):
+        """Rewrite the INSERT statements in a table-dml node"""
+        node.tokens = _split_tokens(node.tokens)
+        return node
+    return _split_handler
@@ -1,24 +1,42 @@
 """A simple line scanner implementation"""
 
-import itertools
+import mmap
+from collections import deque
+
+#: Default number of bytes a `BlockScanner` reads from its file per call
+DEFAULT_BLOCK_SIZE = 4*1024*1024
+
+#: Default maximum number of lines that may be pushed back into a scanner
+DEFAULT_PUSHBACK_LIMIT = 64
+
+#: Default size above which a `BlockScanner` returns a line in pieces
+DEFAULT_MAX_LINE_SIZE = 16*1024*1024
+
+#: Number of bytes of a memory map copied at a time to count the lines
+#: skipped by `MmapScanner.skip_until`
+SKIP_COUNT_SIZE = 4*1024*1024
 
 class Scanner(object):
-    """Read lines from an iterable and track the current byte-offset and 
+    """Read lines from an iterable and track the current byte-offset and
     line number
     """
-    
-    def __init__(self, stream):
+
+    def __init__(self, stream, pushback_limit=DEFAULT_PUSHBACK_LIMIT):
         """Create a LineScanner for the specified stream
 
         :param stream: iterable stream to parse lines from
-        :type stream:  any iterable that yields lines of text. This can 
-                       include file-like objects, lists of strings or other 
+        :type stream:  any iterable that yields lines of text. This can
+                       include file-like objects, lists of strings or other
                        sources.
+        :param pushback_limit: maximum number of lines that may be pushed
+                               back before they are read again
         """
         self.stream = iter(stream)
         self.lineno = 0
         self.offset = 0
         self.next_offset = 0
+        self.pushback_limit = pushback_limit
+        self._pushback = deque()
 
     def __iter__(self):
         """Iterate over this scanner"""
@@ -26,24 +44,663 @@ class Scanner(object):
 
     def next(self):
         """Return the next line in the scanner's stream"""
-        atom = self.stream.next()
+        if self._pushback:
+            atom = self._pushback.pop()
+        else:
+            atom = self.read_line()
         self.offset = self.next_offset
         self.next_offset += len(atom)
         self.lineno += 1
         return atom
 
+    def read_line(self):
+        """Read the next line from the underlying stream
+
+        Subclasses override this to change how lines are produced; pushback
+        and position tracking are handled by `next()`.
+
+        :raises: StopIteration when the stream is exhausted
+        """
+        return self.stream.next()
 
     def push_back(self, line):
         """Push a line back into the scanner so it is read again
 
+        Lines are returned in last-in, first-out order.
+
         :param line: line of text to push back into the scanner
+        :raises: ValueError if more than ``pushback_limit`` lines are pending
         """
+        if len(self._pushback) >= self.pushback_limit:
+            raise ValueError("Scanner pushback limit (%d lines) exceeded" %
+                             self.pushback_limit)
         self.next_offset = self.offset
         self.offset -= len(line)
         self.lineno -= 1
-        self.stream = itertools.chain([line], self.stream)
+        self._pushback.append(line)
+
+    def skip_until(self, prefixes):
+        """Discard lines up to the next line starting with one of
+        ``prefixes``
+
+        The matching line is left to be read next.  Skipped lines are never
+        returned, so scanners that buffer their input search it for the
+        next match in bulk rather than splitting it into lines.
+
+        :param prefixes: tuple of line prefixes to stop at
+        """
+        while self._pushback:
+            if self._pushback[-1].startswith(prefixes):
+                return
+            self.next()
+        self._skip_lines(prefixes)
+
+    def _skip_lines(self, prefixes):
+        """Skip lines of the underlying stream for `skip_until`"""
+        while True:
+            try:
+                line = self.next()
+            except StopIteration:
+                return
+            if line.startswith(prefixes):
+                self.push_back(line)
+                return
+
+    def _skipped(self, count, size):
+        """Account for ``count`` lines, ``size`` bytes, skipped by
+        `_skip_lines`
+        """
+        self.lineno += count
+        self.next_offset += size
+        self.offset = self.next_offset
 
     def position(self):
         """Return the scanner's current line number and position"""
         return self.lineno, self.offset
     position = property(position)
+
+class BlockScanner(Scanner):
+    """Scanner that reads large fixed-size blocks from a file-like object
+    and splits lines out of its own buffer.
+
+    This avoids a python-level call into the file object for every line
+    of input.  Lines longer than ``max_line_size`` are returned as a
+    `ChunkedLine` so that they never have to be held in memory at once.
+    """
+
+    def __init__(self,
+                 fileobj,
+                 block_size=DEFAULT_BLOCK_SIZE,
+                 pushback_limit=DEFAULT_PUSHBACK_LIMIT,
+                 max_line_size=DEFAULT_MAX_LINE_SIZE):
+        """Create a BlockScanner for the specified file
+
+        :param fileobj: file-like object to read blocks from
+        :type fileobj: any object with a ``read(size)`` method
+        :param block_size: number of bytes to request per read
+        :param pushback_limit: maximum number of lines that may be pushed
+                               back before they are read again
+        :param max_line_size: number of bytes of a line to buffer before
+                              returning the line as a `ChunkedLine`
+        """
+        Scanner.__init__(self, (), pushback_limit)
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.max_line_size = max_line_size
+        self._buffer = ''
+        self._index = 0
+        self._chunked = None
+
+    def read_line(self):
+        """Split the next line out of the block buffer, reading more blocks
+        from the file as needed.
+        """
+        if self._chunked is not None:
+            self._chunked.detach()
+            self._chunked = None
+        buf = self._buffer
+        start = self._index
+        end = buf.find('\n', start)
+        if end != -1:
+            self._index = end + 1
+            return buf[start:end + 1]
+
+        # line continues past the end of the buffer
+        parts = [buf[start:]]
+        size = len(parts[0])
+        while True:
+            block = self.fileobj.read(self.block_size)
+            if not block:
+                self._buffer = ''
+                self._index = 0
+                line = ''.join(parts)
+                if not line:
+                    raise StopIteration()
+                return line
+            end = block.find('\n')
+            if end != -1:
+                parts.append(block[:end + 1])
+                self._buffer = block
+                self._index = end + 1
+                return ''.join(parts)
+            parts.append(block)
+            size += len(block)
+            if size >= self.max_line_size:
+                self._buffer = ''
+                self._index = 0
+                self._chunked = ChunkedLine(''.join(parts),
+                                            self._read_line_chunks())
+                return self._chunked
+
+    def _skip_lines(self, prefixes):
+        """Search the block buffer for the next line starting with one of
+        ``prefixes``, reading further blocks without splitting them into
+        lines
+        """
+        if self._chunked is not None:
+            self._chunked.discard()
+            self._chunked = None
+        markers = ['\n' + prefix for prefix in prefixes]
+        longest = max([len(prefix) for prefix in prefixes])
+        # False while the skipped text ends in the middle of a line
+        at_line_start = True
+        while True:
+            buf = self._buffer
+            start = self._index
+            if at_line_start:
+                if len(buf) - start < longest and \
+                   buf.find('\n', start) == -1:
+                    # too little of the line to know whether it matches
+                    block = self.fileobj.read(self.block_size)
+                    if block:
+                        self._buffer = buf[start:] + block
+                        self._index = 0
+                        continue
+                    if start < len(buf) and \
+                       not buf.startswith(prefixes, start):
+                        self._skipped(1, len(buf) - start)
+                        self._buffer = ''
+                        self._index = 0
+                    return
+                if buf.startswith(prefixes, start):
+                    return
+            stop = -1
+            for marker in markers:
+                found = buf.find(marker, start)
+                if found != -1 and (stop == -1 or found < stop):
+                    stop = found
+            if stop != -1:
+                self._skipped(buf.count('\n', start, stop + 1),
+                              stop + 1 - start)
+                self._index = stop + 1
+                return
+            last = buf.rfind('\n', start)
+            if last != -1 and len(buf) - (last + 1) < longest:
+                # keep a line too short to rule out a match yet
+                end = last + 1
+                at_line_start = True
+            else:
+                end = len(buf)
+                at_line_start = False
+            self._skipped(buf.count('\n', start, end), end - start)
+            self._buffer = buf[end:]
+            self._index = 0
+            block = self.fileobj.read(self.block_size)
+            if block:
+                self._buffer += block
+            elif not at_line_start:
+                # the last line of the input has no newline
+                self.lineno += 1
+                return
+
+    def _read_line_chunks(self):
+        """Read the rest of the current line a block at a time"""
+        while True:
+            buf = self._buffer
+            start = self._index
+            end = buf.find('\n', start)
+            if end != -1:
+                self._index = end + 1
+                chunk = buf[start:end + 1]
+            else:
+                chunk = buf[start:]
+                self._buffer = self.fileobj.read(self.block_size)
+                self._index = 0
+            if chunk:
+                self.next_offset += len(chunk)
+                yield chunk
+            if end != -1 or not self._buffer:
+                break
+
+class ChunkedLine(object):
+    """A line too long to be held in memory at once
+
+    Only the beginning of the line, the head, is buffered.  The remainder
+    is read from the scanner by iterating over `chunks()`, which may only
+    be done once.  If the scanner has to move past the line before it was
+    read, for instance to look ahead, the line is read into memory; a line
+    that is no longer wanted should be dropped with `discard()`.
+
+    String operations that the tokenizer rules use on the start of a line
+    (``startswith``, ``line[:n]``) are answered from the head.  Other
+    operations, and ``str()``, read and keep the whole line.
+    """
+
+    def __init__(self, head, remainder):
+        """Create a new chunked line
+
+        :param head: text of the beginning of the line
+        :param remainder: iterator over the text of the rest of the line
+        """
+        self.head = head
+        self._remainder = remainder
+        self._length = len(head)
+        self._text = None
+        self._consumed = False
+
+    def chunks(self):
+        """Iterate over the text of the line in bounded-size pieces
+
+        :raises: ValueError if the line has already been consumed
+        """
+        if self._text is not None:
+            yield self._text
+            return
+        if self._consumed:
+            raise ValueError("Chunked line has already been consumed")
+        self._consumed = True
+        yield self.head
+        for chunk in self._remainder:
+            self._length += len(chunk)
+            yield chunk
+
+    def discard(self):
+        """Read and discard any part of the line that has not been read"""
+        for chunk in self._remainder:
+            self._length += len(chunk)
+        self._consumed = True
+
+    def detach(self):
+        """Finish reading the line from the scanner
+
+        An unread line is read into memory so it is still available.  The
+        remainder of a partly read line is discarded.
+        """
+        if self._consumed:
+            self.discard()
+        else:
+            str(self)
+
+    def startswith(self, prefix):
+        """Check if the line starts with ``prefix``
+
+        :param prefix: str or tuple of str to look for
+        """
+        if isinstance(prefix, tuple):
+            for item in prefix:
+                if self.startswith(item):
+                    return True
+            return False
+        if len(prefix) <= len(self.head):
+            return self.head.startswith(prefix)
+        return str(self).startswith(prefix)
+
+    def endswith(self, suffix):
+        """Check if the line ends with ``suffix``"""
+        return str(self).endswith(suffix)
+
+    def strip(self, chars=None):
+        """Return the line text with leading and trailing chars removed"""
+        return str(self).strip(chars)
+
+    def lstrip(self, chars=None):
+        """Return the line text with leading chars removed"""
+        return str(self).lstrip(chars)
+
+    def rstrip(self, chars=None):
+        """Return the line text with trailing chars removed"""
+        return str(self).rstrip(chars)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.start, index.stop, index.step
+            if (start is None or 0 <= start) and \
+               (stop is not None and 0 <= stop <= len(self.head)):
+                return self.head[index]
+        elif 0 <= index < len(self.head):
+            return self.head[index]
+        return str(self)[index]
+
+    def __contains__(self, text):
+        return text in str(self)
+
+    def __len__(self):
+        """Number of bytes of the line read so far
+
+        This is the full length of the line once it has been consumed.
+        """
+        return self._length
+
+    def __str__(self):
+        if self._text is None:
+            self._text = ''.join(self.chunks())
+            self.head = self._text
+        return self._text
+
+    def __repr__(self):
+        return "ChunkedLine(length=%d, consumed=%r)" % (self._length,
+                                                       self._consumed)
+
+# characters str.strip() removes by default
+_WHITESPACE = ' \t\n\r\x0b\x0c'
+
+class Span(object):
+    """A range of bytes within a memory-mapped source
+
+    A Span stands in for the text of a line or token without copying it out
+    of the map.  It supports the handful of string operations the tokenizer
+    rules need; anything else should convert the span with ``str()``, which
+    materializes the text.
+    """
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source, start, end):
+        """Create a new span
+
+        :param source: the mapped data this span refers to
+        :type source: `mmap.mmap` or any object supporting slicing
+        :param start: byte offset of the first byte in the span
+        :param end: byte offset just past the last byte in the span
+        """
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def view(self):
+        """Expose the spanned bytes without copying them
+
+        :returns: a memoryview where the source supports one, otherwise a
+                  read-only buffer object
+        """
+        try:
+            return memoryview(self.source)[self.start:self.end]
+        except TypeError:
+            # python2 mmap objects only support the old buffer interface
+            return buffer(self.source, self.start, self.end - self.start)
+
+    def startswith(self, prefix):
+        """Check if the spanned text starts with ``prefix``
+
+        :param prefix: str or tuple of str to look for
+        """
+        if isinstance(prefix, tuple):
+            for item in prefix:
+                if self[:len(item)] == item:
+                    return True
+            return False
+        return self[:len(prefix)] == prefix
+
+    def endswith(self, suffix):
+        """Check if the spanned text ends with ``suffix``"""
+        if len(suffix) > len(self):
+            return False
+        return self.source[self.end - len(suffix):self.end] == suffix
+
+    def strip(self, chars=None):
+        """Return the span without leading and trailing chars
+
+        The bytes are tested in the source, so no text is copied.
+
+        :returns: `Span`
+        """
+        start = self._skip_leading(chars)
+        return Span(self.source, start, self._skip_trailing(chars, start))
+
+    def lstrip(self, chars=None):
+        """Return the span without leading chars
+
+        :returns: `Span`
+        """
+        return Span(self.source, self._skip_leading(chars), self.end)
+
+    def rstrip(self, chars=None):
+        """Return the span without trailing chars
+
+        :returns: `Span`
+        """
+        return Span(self.source, self.start,
+                    self._skip_trailing(chars, self.start))
+
+    def _skip_leading(self, chars):
+        if chars is None:
+            chars = _WHITESPACE
+        source = self.source
+        start = self.start
+        end = self.end
+        while start < end and source[start] in chars:
+            start += 1
+        return start
+
+    def _skip_trailing(self, chars, start):
+        if chars is None:
+            chars = _WHITESPACE
+        source = self.source
+        end = self.end
+        while end > start and source[end - 1] in chars:
+            end -= 1
+        return end
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            if stop < start:
+                stop = start
+            return self.source[self.start + start:self.start + stop]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("span index out of range")
+        return self.source[self.start + index]
+
+    def __contains__(self, text):
+        return self.source.find(text, self.start, self.end) != -1
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return self.source[self.start:self.end]
+
+    def __repr__(self):
+        return "Span(start=%d, end=%d)" % (self.start, self.end)
+
+class MappedFile(mmap.mmap):
+    """A read-only memory map of a whole file
+
+    The map keeps the file it maps open and its descriptor in ``fd``, so
+    ranges of it can also be copied by the kernel without being read.
+    """
+
+    def __new__(cls, fileobj):
+        """Map ``fileobj``
+
+        :raises: `mmap.error` or ValueError if the file cannot be mapped
+        """
+        self = mmap.mmap.__new__(cls, fileobj.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno()
+        return self
+
+class MmapScanner(Scanner):
+    """Scanner that memory-maps a regular file and returns each line as a
+    `Span` into the map rather than a copy of its text.
+    """
+
+    def __init__(self, fileobj, pushback_limit=DEFAULT_PUSHBACK_LIMIT,
+                 start=0, end=None):
+        """Create an MmapScanner for the specified file
+
+        :param fileobj: regular, non-empty file to map
+        :type fileobj: file-like object with a ``fileno()`` method
+        :param pushback_limit: maximum number of lines that may be pushed
+                               back before they are read again
+        :param start: offset of the first line to scan
+        :param end: offset to stop scanning at, defaults to the end of the
+                    file.  Line numbers count from ``start``.
+        :raises: `mmap.error` or ValueError if the file cannot be mapped
+        """
+        Scanner.__init__(self, (), pushback_limit)
+        self.fileobj = fileobj
+        self.source = MappedFile(fileobj)
+        self.size = len(self.source)
+        if end is not None:
+            self.size = min(end, self.size)
+        self.offset = self.next_offset = start
+        self._index = start
+
+    def read_line(self):
+        """Find the end of the next line in the map and return its span"""
+        start = self._index
+        if start >= self.size:
+            raise StopIteration()
+        end = self.source.find('\n', start)
+        if end == -1:
+            end = self.size
+        else:
+            end += 1
+        self._index = end
+        return Span(self.source, start, end)
+
+    def _skip_lines(self, prefixes):
+        """Search the map for the next line starting with one of
+        ``prefixes``
+        """
+        source = self.source
+        start = self._index
+        if start >= self.size:
+            return
+        for prefix in prefixes:
+            if source[start:start + len(prefix)] == prefix:
+                return
+        stop = self.size
+        for prefix in prefixes:
+            # only search up to the nearest match found so far, or a prefix
+            # that never occurs would be searched for to the end of the map
+            # at each call
+            found = source.find('\n' + prefix, start,
+                                min(stop + len(prefix), self.size))
+            if found != -1 and found + 1 < stop:
+                stop = found + 1
+        count = 0
+        for offset in xrange(start, stop, SKIP_COUNT_SIZE):
+            count += source[offset:min(offset + SKIP_COUNT_SIZE,
+                                       stop)].count('\n')
+        if stop == self.size and source[stop - 1] != '\n':
+            # the last line of the file has no newline
+            count += 1
+        self._skipped(count, stop - start)
+        self._index = stop
+
+    def close(self):
+        """Unmap the underlying file"""
+        self.source.close()
+
+class NeedData(Exception):
+    """Raised by a `FeedScanner` when the next line has not been fed yet"""
+
+class FeedScanner(Scanner):
+    """Scanner over data fed to it piece by piece rather than read from a
+    file, so that whatever produces the data never blocks on the parser
+
+    Reading past the data fed so far raises `NeedData`.  The scanner can be
+    rewound to the position saved by the last call to `commit()`, so a
+    parser can abandon a partly read node and try again once more data has
+    been fed.
+    """
+
+    def __init__(self, pushback_limit=DEFAULT_PUSHBACK_LIMIT):
+        """Create an empty FeedScanner
+
+        :param pushback_limit: maximum number of lines that may be pushed
+                               back before they are read again
+        """
+        Scanner.__init__(self, (), pushback_limit)
+        self._buffer = ''
+        self._index = 0
+        self._start = 0
+        self._pending = []
+        self._pending_size = 0
+        self._needed = 0
+        self._eof = False
+        self._mark = None
+        self.commit()
+
+    def feed(self, data):
+        """Add data to the end of the input"""
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+
+    def feed_eof(self):
+        """Mark the end of the input"""
+        self._eof = True
+
+    def ready(self):
+        """Check whether enough data has been fed to try reading again
+
+        After `NeedData`, reading is only worth retrying once the input
+        has grown by as much again as was buffered when it was raised, so
+        a parser retrying a long node from its start does linear work
+        overall.
+        """
+        return self._eof or self._pending_size >= self._needed
+
+    def commit(self):
+        """Save the current position for `rewind()`
+
+        The data before it is dropped once more data is needed.
+        """
+        self._start = self._index
+        self._needed = 0
+        self._mark = (self.lineno, self.offset, self.next_offset,
+                      list(self._pushback))
+
+    def rewind(self):
+        """Return to the position saved by the last `commit()`"""
+        self.lineno, self.offset, self.next_offset, pushback = self._mark
+        self._pushback = deque(pushback)
+        self._index = self._start
+
+    def read_line(self):
+        """Split the next line out of the data fed so far
+
+        :raises: `NeedData` if the data fed so far ends before the line
+                 does, or StopIteration at the end of the input
+        """
+        buf = self._buffer
+        start = self._index
+        end = buf.find('\n', start)
+        if end == -1 and self._pending:
+            # drop the data before the saved position
+            kept = self._start
+            searched = len(buf) - kept
+            buf = self._buffer = buf[kept:] + ''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self._start = 0
+            start -= kept
+            self._index = start
+            end = buf.find('\n', searched)
+        if end != -1:
+            self._index = end + 1
+            return buf[start:end + 1]
+        if self._eof:
+            if start == len(buf):
+                raise StopIteration()
+            self._index = len(buf)
+            return buf[start:]
+        self._needed = max(len(buf) - self._start, 1)
+        raise NeedData()
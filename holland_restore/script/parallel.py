@@ -0,0 +1,277 @@
+"""Parse a dump in sections across a pool of processes
+
+A memory-mapped dump is cut just before the comment block that starts each
+table's section (``-- Table structure for table``), so every section begins
+with a new node.  Sections are tokenized and filtered in parallel by
+forked worker processes, each spooling its output, and the output is then
+written in the original order.
+
+Views are finalized after all tables, depending on verdicts reached on
+their temporary tables in earlier sections, so the tail of the dump from
+the first view finalization onwards is filtered by the parent once every
+section before it is done.
+"""
+
+import os
+import mmap
+import tempfile
+from collections import namedtuple, deque
+from cStringIO import StringIO
+from multiprocessing import Pool
+from holland_restore.scanner import MmapScanner, Span
+from holland_restore.node import NodeStream
+from holland_restore.node.base import SkipNode
+from holland_restore.index import read_range
+
+#: Minimum number of bytes in a section handed to a worker
+DEFAULT_SECTION_SIZE = 4*1024*1024
+
+#: Output of a section up to this size is returned to the parent in memory
+#: rather than through a temporary file
+DEFAULT_INLINE_SIZE = 1024*1024
+
+TABLE_MARKER = '\n--\n-- Table structure for table `'
+DATABASE_MARKER = '\n--\n-- Current Database: `'
+VIEW_MARKER = '\n--\n-- Final view structure for view `'
+
+class Section(namedtuple('Section', ['start', 'end', 'database', 'header'])):
+    """Byte range of a dump parsed as a unit
+
+    ``database`` is the database the section starts in and ``header`` is
+    True for the first section, which starts with the dump header.
+    """
+    __slots__ = ()
+
+class ParsedNode(object):
+    """Stand-in for a node parsed by a worker process"""
+    __slots__ = ('type', 'database', 'table', 'location')
+
+    def __init__(self, node_type, database, table, location):
+        self.type = node_type
+        self.database = database
+        self.table = table
+        self.location = location
+
+    def __repr__(self):
+        return "ParsedNode(type=%r)" % self.type
+
+def current_database(source, offset, default=None):
+    """Find the database a dump is in at ``offset``
+
+    :returns: the database named by the last ``-- Current Database``
+              comment before ``offset``, or ``default`` if there is none
+    """
+    start = source.rfind(DATABASE_MARKER, 0, offset)
+    if start == -1:
+        return default
+    start += len(DATABASE_MARKER)
+    end = source.find('`\n', start)
+    return source[start:end].replace('``', '`')
+
+def find_sections(source, default_database=None,
+                  section_size=DEFAULT_SECTION_SIZE):
+    """Cut a dump into sections that can be parsed independently
+
+    :param source: mapped dump
+    :param default_database: database named in the dump header
+    :param section_size: minimum size of a section; consecutive tables are
+                         grouped until a section is at least this big
+    :returns: tuple of (list of `Section`, tail `Section` or None)
+    """
+    size = len(source)
+    cuts = [0]
+    last_table = 0
+    offset = source.find(TABLE_MARKER)
+    while offset != -1:
+        if offset + 1 - cuts[-1] >= section_size:
+            cuts.append(offset + 1)
+        last_table = offset + 1
+        offset = source.find(TABLE_MARKER, offset + 1)
+    tail_start = None
+    for marker in (DATABASE_MARKER, VIEW_MARKER):
+        found = source.find(marker, last_table)
+        if found != -1 and (tail_start is None or found + 1 < tail_start):
+            tail_start = found + 1
+    cuts.append(tail_start or size)
+
+    sections = []
+    for start, end in zip(cuts, cuts[1:]):
+        if start == 0:
+            sections.append(Section(start, end, None, True))
+        else:
+            database = current_database(source, start, default_database)
+            sections.append(Section(start, end, database, False))
+    tail = None
+    if tail_start is not None:
+        tail = Section(tail_start, size,
+                       current_database(source, tail_start, default_database),
+                       False)
+    return sections, tail
+
+def header_database(fileobj):
+    """Read the database named in a dump's header, if any"""
+    scanner = MmapScanner(fileobj)
+    try:
+        return iter(NodeStream(scanner)).next().database
+    finally:
+        scanner.close()
+
+def filter_section(path, section, node_filter,
+                   inline_size=DEFAULT_INLINE_SIZE):
+    """Tokenize and filter a section of a dump
+
+    :returns: tuple of (nodes, number of lines, rejected tables, text,
+              spool path).  Each node is a tuple of (type, database, table,
+              location, start, end) where start and end locate the node's
+              output, or are None if the node was skipped.  The output is
+              either returned as text or left in a temporary file at the
+              spool path, which the caller removes.
+    """
+    fileobj = open(path, 'rb')
+    scanner = MmapScanner(fileobj, start=section.start, end=section.end)
+    node_filter.database = section.database
+    spool = tempfile.NamedTemporaryFile(prefix='holland_restore-',
+                                        delete=False)
+    nodes = []
+    try:
+        try:
+            for node in NodeStream(scanner, section.database,
+                                   section.header):
+                start = end = None
+                try:
+                    chunks = node_filter(node)
+                    start = spool.tell()
+                    for chunk in chunks:
+                        if isinstance(chunk, Span):
+                            chunk = chunk.view()
+                        spool.write(chunk)
+                    end = spool.tell()
+                except SkipNode:
+                    # recorded without output below
+                    pass
+                nodes.append((node.type,
+                              getattr(node, 'database', None),
+                              getattr(node, 'table', None),
+                              node.location, start, end))
+            text = None
+            if spool.tell() <= inline_size:
+                spool.seek(0)
+                text = spool.read()
+            spool.close()
+        except:
+            spool.close()
+            os.unlink(spool.name)
+            raise
+    finally:
+        scanner.close()
+        fileobj.close()
+    if text is None:
+        return nodes, scanner.lineno, node_filter.rejected, None, spool.name
+    os.unlink(spool.name)
+    return nodes, scanner.lineno, node_filter.rejected, text, None
+
+# set before the pool is created so forked workers inherit it
+_worker_args = None
+
+def _filter_section(section):
+    path, node_filter = _worker_args
+    # only report the tables rejected in this section
+    node_filter.rejected = set()
+    return filter_section(path, section, node_filter)
+
+def write_section(result, node_filter, sink, index=None, first_line=0):
+    """Write the output of a filtered section
+
+    :param result: value returned by `filter_section`
+    :param first_line: number of lines in the dump before the section
+    :returns: number of lines in the section
+    """
+    nodes, lines, rejected, text, spool_path = result
+    node_filter.rejected.update(rejected)
+    if spool_path is None:
+        spool = StringIO(text)
+    else:
+        spool = open(spool_path, 'rb')
+    try:
+        for node_type, database, table, location, start, end in nodes:
+            if location is not None:
+                location = (location[0] + first_line, location[1])
+            node = ParsedNode(node_type, database, table, location)
+            if index:
+                index.add(node)
+            if start is not None:
+                sink.write_node(node, read_range(spool, start, end))
+    finally:
+        spool.close()
+        if spool_path is not None:
+            os.unlink(spool_path)
+    return lines
+
+def parallel_filter(node_filter, path, jobs, sink, index=None,
+                    section_size=DEFAULT_SECTION_SIZE):
+    """Filter an uncompressed dump with a pool of ``jobs`` processes
+
+    The output is written to ``sink`` in the order of the dump, as
+    `stream_filter` would write it.
+
+    :param node_filter: `NodeFilter` to apply to every node
+    :param path: path of the dump
+    :param jobs: number of worker processes
+    :param sink: sink to write the filtered output to
+    :param index: optional `IndexWriter` to add every node to
+    :param section_size: minimum number of bytes parsed by a worker at once
+    """
+    fileobj = open(path, 'rb')
+    try:
+        default_database = header_database(fileobj)
+        source = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(source)
+            sections, tail = find_sections(source, default_database,
+                                           section_size)
+        finally:
+            source.close()
+    finally:
+        fileobj.close()
+
+    try:
+        lines = _write_sections(node_filter, path, jobs, sink, index,
+                                sections, tail)
+    except:
+        if index:
+            index.abort()
+        raise
+    if index:
+        index.finish((lines, size))
+
+def _write_sections(node_filter, path, jobs, sink, index, sections, tail):
+    """Filter the sections of a dump and the tail after them, writing the
+    results in order
+
+    :returns: number of lines in the dump
+    """
+    global _worker_args
+    _worker_args = (path, node_filter)
+    pool = Pool(jobs)
+    try:
+        lines = 0
+        pending = deque()
+        for section in sections:
+            pending.append(pool.apply_async(_filter_section, (section,)))
+            # bound the output spooled ahead of the sink
+            if len(pending) >= jobs*2:
+                result = pending.popleft().get()
+                lines += write_section(result, node_filter, sink, index,
+                                       lines)
+        while pending:
+            result = pending.popleft().get()
+            lines += write_section(result, node_filter, sink, index, lines)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _worker_args = None
+    if tail is not None:
+        result = filter_section(path, tail, node_filter)
+        lines += write_section(result, node_filter, sink, index, lines)
+    return lines
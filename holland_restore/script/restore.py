@@ -1,12 +1,29 @@
 """Command-line front-end to mysqldump output parsing"""
+import os
 import sys
+import mmap
 import time
+from functools import partial
 from optparse import OptionParser
+from holland_restore.scanner import BlockScanner, MmapScanner, MappedFile
 from holland_restore.node import NodeStream, NodeFilter
+from holland_restore.util import read_patterns, is_glob
+from holland_restore import zran
+from holland_restore.compress import open_input, detect_compression, \
+                                     PrefetchReader, MAGIC_SIZE
+from holland_restore.index import IndexBuilder, IndexWriter, IndexedNode, \
+                                  IndexFormatError, open_index, index_path, \
+                                  read_index, read_range, map_range
+from holland_restore.script.sink import StreamSink, ParallelSink, \
+                                       SinkProcess, ThreadedSink, open_output, \
+                                       DEFAULT_SYNC_TIMEOUT
+from holland_restore.script.parallel import parallel_filter
+from holland_restore.script.stats import RestoreStats
 from holland_restore.node.util import skip_databases, skip_tables, \
                                       skip_engines, skip_node, \
                                       skip_triggers, skip_binlog, \
-                                      SkipNode
+                                      split_inserts, restore_session, \
+                                      final_node, rename_databases, SkipNode
 
 def build_opt_parser():
     """Build an OptionParser"""
@@ -24,6 +41,15 @@ def build_opt_parser():
                                 "This option may be specified multiple times."
                                 ),
                           default=[])
+    opt_parser.add_option('--table-file',
+                          metavar="file",
+                          dest='table_files',
+                          action='append',
+                          help=("Include the tables listed in the specified "
+                                "file, one db.tbl name or pattern per line. "
+                                "This option may be specified multiple "
+                                "times."),
+                          default=[])
     opt_parser.add_option('--exclude-table', '-T', 
                           metavar="db.tbl",
                           dest='exclude_tables',
@@ -39,11 +65,29 @@ def build_opt_parser():
                           help=("Only include the specified database. This "
                                 "option may be specified multiple times."),
                           default=[])
+    opt_parser.add_option('--database-file',
+                          metavar="file",
+                          dest='database_files',
+                          action='append',
+                          help=("Include the databases listed in the "
+                                "specified file, one name or pattern per "
+                                "line. This option may be specified multiple "
+                                "times."),
+                          default=[])
     opt_parser.add_option('--exclude-database', '-D', 
                           metavar="database",
                           action='append',
                           dest='exclude_databases',
                           default=[])
+    opt_parser.add_option('--rename-database',
+                          metavar="old:new",
+                          action='append',
+                          dest='rename_databases',
+                          help=("Restore database old as new.  Table data is "
+                                "passed through unchanged.  Filters still "
+                                "match the original names.  This option may "
+                                "be specified multiple times."),
+                          default=[])
     opt_parser.add_option('--engine', '-e',
                           metavar="engine",
                           action='append', 
@@ -59,6 +103,71 @@ def build_opt_parser():
                           help=("Exclude the specified engine. This option "
                                 "may be specified multiple times"),
                           default=[])
+    opt_parser.add_option('--write-index',
+                          action='store_true',
+                          help=("Write an index of the byte and line ranges "
+                                "of every section of the dump to "
+                                "<dumpfile>%s while reading it.  Works with "
+                                "--toc or a normal restore." % '.idx'),
+                          default=False)
+    opt_parser.add_option('--no-index',
+                          action='store_true',
+                          help=("Always parse the whole dump, even when an "
+                                "up to date index is available."),
+                          default=False)
+    opt_parser.add_option('--mmap',
+                          action='store_true',
+                          help=("Memory-map regular file input.  Tokens then "
+                                "reference the mapped file and text is only "
+                                "copied when a filter needs it."),
+                          default=False)
+    opt_parser.add_option('--parallel',
+                          metavar="N",
+                          type='int',
+                          help=("Load table data through N sink processes "
+                                "at once.  Requires --sink-command, which "
+                                "must print the result of each SELECT as "
+                                "soon as it runs, e.g. 'mysql --unbuffered'."),
+                          default=0)
+    opt_parser.add_option('--sync-timeout',
+                          metavar="seconds",
+                          type='float',
+                          help=("With --parallel, fail if the sink command "
+                                "has not printed the result of a SELECT "
+                                "within this many seconds (default: "
+                                "%default)."),
+                          default=DEFAULT_SYNC_TIMEOUT)
+    opt_parser.add_option('--parse-jobs',
+                          metavar="N",
+                          type='int',
+                          help=("Tokenize and filter an uncompressed dump "
+                                "file in sections across N processes."),
+                          default=0)
+    opt_parser.add_option('--pipeline',
+                          action='store_true',
+                          help=("Read ahead in the input and write the "
+                                "output from separate threads, so slow "
+                                "reads or a slow sink overlap with parsing. "
+                                "With --stats, writing time then only "
+                                "counts the time spent queueing output."),
+                          default=False)
+    opt_parser.add_option('--stats',
+                          action='store_true',
+                          help=("Report the nodes, tokens, bytes and time "
+                                "spent reading, filtering and writing each "
+                                "node type and table to stderr when done."),
+                          default=False)
+    opt_parser.add_option('--stats-file',
+                          metavar="file",
+                          help=("Write the --stats report to the specified "
+                                "file as JSON instead."),
+                          default=None)
+    opt_parser.add_option('--sink-command',
+                          metavar="command",
+                          help=("Pipe output into the specified shell "
+                                "command, e.g. 'mysql -u root', instead of "
+                                "writing it to stdout."),
+                          default=None)
     opt_parser.add_option('--no-data', 
                           action='store_true', 
                           help=("Only output database schema, not data."),
@@ -73,6 +182,21 @@ def build_opt_parser():
                           action='store_true',
                           help=("Remove CREATE TRIGGER blocks from the output"),
                           default=False)
+    opt_parser.add_option('--max-statement-bytes',
+                          metavar="bytes",
+                          type='int',
+                          help=("Split extended INSERT statements so that no "
+                                "statement is larger than the specified "
+                                "number of bytes.  A single row larger than "
+                                "this is still output as one statement."),
+                          default=None)
+    opt_parser.add_option('--max-rows-per-insert',
+                          metavar="rows",
+                          type='int',
+                          help=("Split extended INSERT statements so that no "
+                                "statement has more than the specified "
+                                "number of rows."),
+                          default=None)
     opt_parser.add_option('--skip-routines',
                           action='store_true',
                           help=("Remove functions/stored procedures from the output"),
@@ -89,6 +213,10 @@ def setup_misc_filters(opts, node_filter):
         node_filter.register('database-routines', skip_node)
     if opts.skip_triggers:
         node_filter.register('table-dml', skip_triggers)
+    if opts.max_statement_bytes or opts.max_rows_per_insert:
+        node_filter.register('table-dml',
+                             split_inserts(max_bytes=opts.max_statement_bytes,
+                                           max_rows=opts.max_rows_per_insert))
 
 def setup_database_filters(opts, node_filter):
     """Add database filters to the node_filter based on requested options"""
@@ -98,24 +226,16 @@ def setup_database_filters(opts, node_filter):
                 db, name = tbl.split('.')
                 if db not in opts.databases:
                     print >>sys.stderr, "Note: Adding implicit database inclusion '%s' from --table %s" % (db, tbl)
-                    opts.databases.remove('*')
+                    if '*' in opts.databases:
+                        opts.databases.remove('*')
                     opts.databases.append(db)
-        for tbl in opts.exclude_tables:
-            if '.' in tbl:
-                db, name = tbl.split('.')
-                if db not in opts.exclude_databases:
-                    print >>sys.stderr, "Note: Adding implicit database exclusion '%s' from --exclude-table %s" % (db, tbl)
-                    opts.databases.remove('*')
-                    opts.exclude_databases.append(db)
     if opts.databases != ['*'] or opts.exclude_databases:
         skip_handler = skip_databases(include=opts.databases,
                                       exclude=opts.exclude_databases)
         node_filter.register('database-ddl', skip_handler)
         node_filter.register('view-finalize-db', skip_handler)
         node_filter.register('table-ddl', skip_handler)
-        node_filter.register('table-dml', skip_handler)
         node_filter.register('view-temp-ddl', skip_handler)
-        node_filter.register('view-ddl', skip_handler)
         node_filter.register('database-routines', skip_handler)
         node_filter.register('database-events', skip_handler)
 
@@ -126,8 +246,6 @@ def setup_table_filters(opts, node_filter):
                                    exclude=opts.exclude_tables)
         node_filter.register('table-ddl', skip_handler)
         node_filter.register('view-temp-ddl', skip_handler)
-        node_filter.register('view-ddl', skip_handler)
-        node_filter.register('table-dml', skip_handler)
 
 def setup_engine_filters(opts, node_filter):
     """Add engine filters to the node_filter based on requested options"""
@@ -136,7 +254,33 @@ def setup_engine_filters(opts, node_filter):
                                     exclude=opts.exclude_engines)
         node_filter.register('table-ddl', skip_handler)
         node_filter.register('view-temp-ddl', skip_handler)
-       
+
+def setup_rename_filters(renames, node_filter):
+    """Add database renaming to the node_filter, after the filters that
+    match the original names
+    """
+    if not renames:
+        return
+    rename_handler = rename_databases(renames)
+    for node_type in ('dump-header', 'database-ddl', 'view-finalize-db',
+                      'table-ddl', 'table-dml', 'view-temp-ddl', 'view-ddl',
+                      'database-routines', 'database-events'):
+        node_filter.register(node_type, rename_handler)
+
+def setup_tracking(opts, node_filter):
+    """Stop reading a dump once the databases the output is restricted to
+    have been written, if they are all named exactly
+
+    Nothing is tracked unless databases were explicitly included, by
+    --database or implied by --table db.tbl.
+    """
+    if not opts.databases or opts.databases == ['*']:
+        return
+    for database in opts.databases:
+        if is_glob(database):
+            return
+    node_filter.track(opts.databases)
+
 import signal
 
 def main(args=None):
@@ -144,6 +288,22 @@ def main(args=None):
     opt_parser = build_opt_parser()
     opts, args = opt_parser.parse_args(args)
 
+    if opts.parallel and not opts.sink_command:
+        opt_parser.error("--parallel requires --sink-command")
+    if opts.write_index and (not args or '-' in args):
+        opt_parser.error("--write-index cannot index standard input")
+    renames = {}
+    for rename in opts.rename_databases:
+        old, sep, new = rename.partition(':')
+        if not (old and sep and new):
+            opt_parser.error("--rename-database expects old:new, not %r" %
+                             rename)
+        renames[old] = new
+
+    for path in opts.table_files:
+        opts.tables.extend(read_patterns(path))
+    for path in opts.database_files:
+        opts.databases.extend(read_patterns(path))
 
     if not opts.tables:
         opts.tables = ['*']
@@ -158,98 +318,257 @@ def main(args=None):
     setup_database_filters(opts, node_filter)
     setup_table_filters(opts, node_filter)
     setup_engine_filters(opts, node_filter)
+    setup_rename_filters(renames, node_filter)
+    setup_tracking(opts, node_filter)
 
     if opts.toc:
-        return cmd_toc(args)
-
-    process(node_filter, args)
+        return cmd_toc(args, opts)
+
+    stats = None
+    if opts.stats or opts.stats_file:
+        stats = RestoreStats()
+    process(node_filter, args, opts, stats)
+    if stats is not None:
+        if opts.stats_file:
+            stats.write_json(opts.stats_file)
+        else:
+            print >>sys.stderr, stats.format()
     return 0
 
-from threading import Thread
-import time
-
-class SimpleWrapper(object):
-    def __init__(self, stream):
-        self.stream = stream
-        self.count = 0
-
-    def next(self):
-        line = self.stream.next()
-        self.count += len(line)
-        return line
-
-    def __iter__(self):
-        return self
+def open_scanner(fileobj, opts):
+    """Create the scanner used to read lines from ``fileobj``"""
+    if opts.mmap and file_size(fileobj):
+        return MmapScanner(fileobj)
+    if opts.pipeline and not getattr(fileobj, 'compression', None):
+        # decompressed input is already read by a thread of its own
+        fileobj = PrefetchReader(fileobj)
+    return BlockScanner(fileobj)
 
-    def __getattr__(self, key):
-        return getattr(self.stream, key)
-
-def process(node_filter, args):
+def process(node_filter, args, opts, stats=None):
     if not args:
         args = '-'
 
     for arg in args:
-        if arg == '-':
-            fileobj = sys.stdin
-        else:
-            fileobj = open(arg, 'r')
+        index = None
+        read = None
+        if arg != '-':
+            index = find_index(arg, opts)
+        if index is not None:
+            read = open_indexed(arg, index)
+        if read is not None:
+            sink = open_sink(opts)
+            extract_indexed(node_filter, index, read, sink, stats)
+            sink.close()
+            continue
+        checkpoint_span = None
+        if opts.write_index:
+            checkpoint_span = zran.DEFAULT_SPAN
+        fileobj = open_input(arg, checkpoint_span)
+        if opts.parse_jobs > 1:
+            if arg != '-' and not getattr(fileobj, 'compression', None) \
+               and file_size(fileobj):
+                fileobj.close()
+                if stats is not None:
+                    print >>sys.stderr, ("Note: --stats does not cover "
+                                         "dumps parsed with --parse-jobs")
+                sink = open_sink(opts)
+                index = None
+                if opts.write_index:
+                    index = open_index(index_path(arg), arg)
+                parallel_filter(node_filter, arg, opts.parse_jobs, sink,
+                                index)
+                sink.close()
+                continue
+            print >>sys.stderr, ("Note: --parse-jobs requires an "
+                                 "uncompressed regular file; parsing %s "
+                                 "serially" % arg)
+        scanner = open_scanner(fileobj, opts)
+        monitor = ProgressMonitor(ProgressBar('green', width=40),
+                                  input_progress(fileobj, scanner))
+        sink = open_sink(opts)
+        index = None
+        if opts.write_index:
+            index = open_index(index_path(arg), arg,
+                               getattr(fileobj, 'checkpoints', None))
+        stream_filter(node_filter, scanner, monitor, sink, index, stats)
+        sink.close()
+
+def input_progress(fileobj, scanner):
+    """Measure how much of the input ``scanner`` reads from ``fileobj``
+    has been read
+
+    Compressed input is measured by the compressed bytes read, against the
+    size of the compressed file.
+    """
+    if getattr(fileobj, 'compression', None):
+        return InputProgress(scanner, file_size(fileobj.fileobj),
+                             lambda: fileobj.compressed_offset)
+    return InputProgress(scanner, file_size(fileobj))
+
+def index_usable(opts):
+    """Check whether the requested filters can be decided from the node
+    types and names in an index alone
+    """
+    return not (opts.no_index or
+                opts.write_index or
+                opts.engines != ['*'] or
+                opts.exclude_engines or
+                opts.rename_databases or
+                opts.skip_binlog or
+                opts.skip_triggers or
+                opts.max_statement_bytes or
+                opts.max_rows_per_insert)
+
+def find_index(path, opts):
+    """Find an up to date index for the dump at ``path``
+
+    :returns: `Index` or None if the dump has to be parsed
+    """
+    if not index_usable(opts) or not os.path.exists(index_path(path)):
+        return None
+    try:
+        index = read_index(index_path(path))
+    except IndexFormatError, exc:
+        print >>sys.stderr, "Ignoring index: %s" % exc
+        return None
+    if not index.matches(path):
+        print >>sys.stderr, "Ignoring out of date index %s" % index_path(path)
+        return None
+    if not index.complete() or not index_covers(path, index):
+        print >>sys.stderr, ("Ignoring incomplete index %s" %
+                             index_path(path))
+        return None
+    return index
+
+def index_covers(path, index):
+    """Check that the entries of ``index`` reach the end of the dump at
+    ``path``
+
+    The offsets of a compressed dump's index refer to the decompressed
+    data, whose size is only known from the index itself.
+    """
+    fileobj = open(path, 'rb')
+    try:
+        compression, _ = detect_compression(fileobj.read(MAGIC_SIZE))
+    finally:
+        fileobj.close()
+    return compression is not None or index.end == index.source_size
+
+def open_indexed(path, index):
+    """Open the dump at ``path`` for reading the byte ranges in ``index``
+
+    Ranges of an uncompressed dump are referenced in a memory map of it, so
+    a `StreamSink` can copy them with sendfile.  Ranges of a gzip
+    compressed dump are inflated from the nearest checkpoint.
+
+    :returns: callable reading the blocks from a start to an end offset, or
+              None if the dump has to be read sequentially
+    """
+    fileobj = open(path, 'rb')
+    compression, _ = detect_compression(fileobj.read(MAGIC_SIZE))
+    if compression is None:
         try:
-            fileobj = SimpleWrapper(fileobj)
-            fancy_bar = ProgressBar('green', width=40)
-            start = time.time()
-            data = Data()
-            monitor = ProgressMonitor(fancy_bar, data=data)
-            stream_filter(node_filter, fileobj, monitor)
-        finally:
-            monitor.stop()
+            return partial(map_range, MappedFile(fileobj))
+        except (mmap.error, ValueError):
+            # empty or unmappable file
+            return partial(read_range, fileobj)
+    if compression == 'gzip' and zran.available:
+        return zran.ZranReader(fileobj, index.checkpoints).read_range
+    fileobj.close()
+    return None
+
+def extract_indexed(node_filter, index, read, sink, stats=None):
+    """Copy the byte ranges of the nodes accepted by ``node_filter`` out of
+    a dump without parsing it
+
+    :param read: callable returning the blocks of data between a start and
+                 an end offset, as returned by `open_indexed`
+    :param stats: optional `RestoreStats` to count the nodes in
+    """
+    if stats is not None:
+        node_filter = stats.wrap_filter(node_filter)
+        sink = stats.wrap_sink(sink)
+    setup_entry = None
+    for entry in index:
+        node = IndexedNode(entry)
+        if node_filter.finished(node):
+            setup = None
+            if setup_entry is not None:
+                setup = indexed_setup(read, setup_entry)
+            skip_rest(node_filter, setup, sink)
+            break
+        if node.type == 'setup-session':
+            setup_entry = entry
+        if stats is not None:
+            stats.count_input(node, entry.end - entry.start)
+        try:
+            node_filter(node)
+        except SkipNode:
+            continue
+        sink.write_node(node, read(entry.start, entry.end))
+
+def indexed_setup(read, entry):
+    """Parse the setup-session node described by an index entry
+
+    :param read: callable returning the blocks of data between a start and
+                 an end offset, as returned by `open_indexed`
+    :param entry: `IndexEntry` of the setup-session node
+    :returns: `SetupSessionNode` or None if it could not be parsed
+    """
+    text = ''.join([str(block) for block in read(0, entry.end)])
+    for node in NodeStream(text.splitlines(True)):
+        if node.type == 'setup-session':
+            return node
+    return None
+
+def open_sink(opts):
+    """Create the sink filtered output is written to"""
+    if opts.parallel:
+        sink = ParallelSink(opts.sink_command, opts.parallel,
+                            sync_timeout=opts.sync_timeout)
+    elif opts.sink_command:
+        sink = StreamSink(SinkProcess(opts.sink_command), close_stream=True)
+    else:
+        sink = StreamSink(open_output(sys.stdout))
+    if opts.pipeline:
+        sink = ThreadedSink(sink)
+    return sink
 
-from util import ProgressMonitor
+from util import ProgressMonitor, InputProgress
 from progress import ProgressBar
-from threading import Lock
-import itertools
-
-class Data(object):
-    def __init__(self):
-        self.state = 'Initializing'
-        self.position = (0, 0)
-        self.start = time.time()
-        self.percent = itertools.cycle(xrange(101))
-        self.lock = Lock()
-
-    def update(self, state, position):
-        self.lock.acquire()
-        self.state = state
-        self.lock.release()
-
-    def poll(self):
-        self.lock.acquire()
-        line, offset = self.position.position
-        percent = self.percent.next()
-        total = (offset / 1024.0**2)
-        rate = total / (time.time() - self.start)
-        message = "\n".join([
-            "",
-            "Processing: %s" % self.state,
-            "Line: %d" % line,
-            "%.2f MB (%.2f MB per second)" % (total, rate),
-            "Elapsed: %.2f seconds" % (time.time() - self.start),
-        ])
-        self.lock.release()
-        return percent, message
-
-def stream_filter(node_filter, fileobj, monitor, stream=sys.stdout):
+
+def stream_filter(node_filter, scanner, monitor, sink=None, index=None,
+                  stats=None):
+    if sink is None:
+        sink = StreamSink(sys.stdout)
     state = 'initializing'
-    node_stream = NodeStream(fileobj)
-    if monitor:
-        monitor.data.position = node_stream._tokenizer.scanner
+    node_stream = NodeStream(scanner)
+    if stats is not None:
+        node_filter = stats.wrap_filter(node_filter)
+        sink = stats.wrap_sink(sink)
+        node_stream = stats.read(node_stream, scanner)
+    setup = None
     try:
         if monitor:
             monitor.start()
         for node in node_stream:
+            if index is None and node_filter.finished(node):
+                skip_rest(node_filter, setup, sink)
+                break
+            if node.type == 'setup-session':
+                setup = node
             state = format_node(node)
             if monitor:
-                monitor.data.update(state, node_stream._tokenizer.scanner.position)
-            stream_node(node_filter, node, stream)
+                monitor.data.update(state)
+            if index:
+                index.add(node)
+            stream_node(node_filter, node, sink)
+        if index:
+            index.finish((scanner.lineno, scanner.next_offset))
+    except:
+        if index:
+            index.abort()
+        raise
     finally:
         state = 'Interrupted'
         if monitor:
@@ -259,60 +578,67 @@ def stream_filter(node_filter, fileobj, monitor, stream=sys.stdout):
     if sys.exc_info() != (None, None, None):
         raise
 
-def stream_node(node_filter, node, stream):
+def skip_rest(node_filter, setup, sink):
+    """Write the end of a dump whose remaining nodes are not read
+
+    :param setup: setup-session node of the dump, or None
+    """
+    print >>sys.stderr, ("Note: all requested databases were written; "
+                         "skipping the rest of the dump")
+    if setup is not None:
+        stream_node(node_filter, restore_session(setup), sink)
+    stream_node(node_filter, final_node(), sink)
+
+def stream_node(node_filter, node, sink):
     try:
-        for chunk in node_filter(node):
-            stream.write(str(chunk))
+        sink.write_node(node, node_filter(node))
     except SkipNode:
         print >>sys.stderr, "skipping node %r" % node
         pass
 
-def progress_info(input, position, state, start):
-    return int(input.count / (250.0*1024**2)), "\n".join([
-        'Processing: %s' % state,
-        'Line: %d' % position[0],
-        'Data Read: %.2f MB' % (input.count / 1024.0**2),
-        'Read rate: %.2f MB per second' % ((input.count / (time.time() - start)) / 1024.0**2),
-        'Data Written: %.2f MB' % (position[1] / 1024.0**2),
-        'Time Elapsed: %.2f seconds' % (time.time() - start),
-    ])
-
-def cmd_toc(args):
+def cmd_toc(args, opts):
     if not args:
         args = '-'
 
     for arg in args:
-        if arg == '-':
-            fileobj = sys.stdin
-        else:
-            fileobj = open(arg, 'r')
-        table_of_contents(fileobj)
+        checkpoint_span = None
+        if opts.write_index:
+            checkpoint_span = zran.DEFAULT_SPAN
+        fileobj = open_input(arg, checkpoint_span)
+        index = None
+        if opts.write_index:
+            index = open_index(index_path(arg), arg,
+                               getattr(fileobj, 'checkpoints', None))
+        table_of_contents(fileobj, open_scanner(fileobj, opts), index)
 
     return 0
 
-def table_of_contents(fileobj):
-    node_stream = NodeStream(fileobj)
+def table_of_contents(fileobj, scanner, index=None):
+    node_stream = NodeStream(scanner)
     print fileobj.name
     print "="*len(fileobj.name)
-    database = ''
-    table = ''
-    for node in node_stream:
-        try:
-            database = node.database
-        except AttributeError:
-            node.database = database
-
-        first_token = iter(node.tokens).next()
-        for last_token in node.tokens:
-            pass
-        start_byte = first_token.offset
-        end_byte = last_token.offset + len(last_token.text)
-        start_line = first_token.line_range[0]
-        end_line = last_token.line_range[1]
-        print "%-20s %-40s bytes:%-20s lines:%-10s" % \
-            (node.type, format_node(node),
-             "%d-%d" % (start_byte, end_byte), 
-             "%d-%d" % (start_line, end_line))
+    if index is None:
+        index = IndexBuilder()
+    try:
+        for node in node_stream:
+            print_toc_entry(index.add(node))
+            # read through the node so the next one starts where this one
+            # ends
+            for token in node.tokens:
+                pass
+        print_toc_entry(index.finish((scanner.lineno, scanner.next_offset)))
+    except:
+        if isinstance(index, IndexWriter):
+            index.abort()
+        raise
+
+def print_toc_entry(entry):
+    if entry is None:
+        return
+    print "%-20s %-40s bytes:%-20s lines:%-10s" % \
+        (entry.type, format_node(entry),
+         "%d-%d" % (entry.start, entry.end),
+         "%d-%d" % (entry.start_line, entry.end_line))
 
 def format_node(node):
     if node.type == 'database-ddl':
@@ -334,7 +660,11 @@ def format_node(node):
 def file_size(fileobj):
     import os
     import stat
-    st = os.fstat(fileobj.fileno())
+    try:
+        st = os.fstat(fileobj.fileno())
+    except AttributeError:
+        # decompressed input has no file descriptor of its own
+        return None
     if stat.S_ISREG(st.st_mode):
         return st.st_size
     else:
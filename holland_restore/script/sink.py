@@ -0,0 +1,587 @@
+"""Destinations for the filtered output of a dump"""
+
+import os
+import re
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import subprocess
+from itertools import chain
+from threading import Thread, Condition
+from Queue import Queue
+from holland_restore.scanner import Span
+from holland_restore.util import binary_mode
+
+#: Size of the buffer of the output stream opened by `open_output`
+DEFAULT_BUFFER_SIZE = 1024*1024
+
+#: Unmodified ranges of a mapped file at least this big are copied to the
+#: output by the kernel
+DEFAULT_PASSTHROUGH_SIZE = 64*1024
+
+#: Number of bytes of chunks a `ThreadedSink` hands to its thread at once
+DEFAULT_BATCH_SIZE = 256*1024
+
+#: Number of batches of chunks buffered between the parser and the thread
+#: of a `ThreadedSink`, or a worker of a `ParallelSink`
+DEFAULT_BATCH_QUEUE_SIZE = 64
+
+#: Number of seconds a `ParallelSink` waits for its serial process to
+#: print the result of a sync statement
+DEFAULT_SYNC_TIMEOUT = 60
+
+# largest count passed to a single sendfile call
+_MAX_SENDFILE = 1024*1024*1024
+
+class SinkError(Exception):
+    """Raised when a sink command fails"""
+
+def _load_sendfile():
+    path = ctypes.util.find_library('c')
+    if not path:
+        return None
+    try:
+        sendfile = ctypes.CDLL(path, use_errno=True).sendfile
+    except (OSError, AttributeError):
+        return None
+    sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                         ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    sendfile.restype = ctypes.c_ssize_t
+    return sendfile
+
+_sendfile = _load_sendfile()
+
+def copy_range(in_fd, out_fd, start, end):
+    """Copy a byte range of a file to a file descriptor with sendfile(2)
+
+    The data is copied by the kernel without passing through python.
+
+    :returns: False, without copying anything, if sendfile is unavailable
+              or does not support these descriptors
+    :raises: OSError if copying fails part way
+    """
+    if _sendfile is None:
+        return False
+    offset = ctypes.c_int64(start)
+    while offset.value < end:
+        count = min(end - offset.value, _MAX_SENDFILE)
+        copied = _sendfile(out_fd, in_fd, ctypes.byref(offset), count)
+        if copied < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if offset.value == start and \
+               err in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                return False
+            raise OSError(err, os.strerror(err))
+        if copied == 0:
+            raise IOError("Unexpected end of file copying bytes %d-%d" %
+                          (start, end))
+    return True
+
+class StreamSink(object):
+    """Write every node, in order, to a single file-like object
+
+    Chunks that are adjacent `Span` ranges of the same mapped file, as the
+    tokens of an unmodified node are, are merged into a single range, and
+    large ranges are copied to the output file descriptor by the kernel
+    when both the input and the output are real files or pipes.  Other
+    chunks are written to the stream, which should be opened with a large
+    buffer (see `open_output`) to batch them into few system calls.
+    """
+
+    def __init__(self, stream, passthrough_size=DEFAULT_PASSTHROUGH_SIZE,
+                 close_stream=False):
+        """Create a sink writing to ``stream``
+
+        :param stream: file-like object to write to
+        :param passthrough_size: minimum size of a range of a mapped file
+                                 to copy with sendfile
+        :param close_stream: close ``stream`` when the sink is closed
+        """
+        self.stream = stream
+        self.passthrough_size = passthrough_size
+        self.close_stream = close_stream
+        #: number of bytes written, including a range still pending
+        self.bytes_written = 0
+        try:
+            self._fd = stream.fileno()
+        except (AttributeError, IOError, ValueError):
+            self._fd = None
+        self._range = None
+
+    def write_node(self, node, chunks):
+        """Write the filtered text of a node
+
+        :param node: `Node` the text belongs to
+        :param chunks: iterable of str or `Span` chunks
+        """
+        write = self.stream.write
+        span = self._range
+        written = 0
+        for chunk in chunks:
+            if chunk.__class__ is Span:
+                written += chunk.end - chunk.start
+                if span is not None and span.end == chunk.start and \
+                   span.source is chunk.source:
+                    span.end = chunk.end
+                    continue
+                if span is not None:
+                    self._write_range(span)
+                span = Span(chunk.source, chunk.start, chunk.end)
+            else:
+                if span is not None:
+                    self._write_range(span)
+                    span = None
+                written += len(chunk)
+                write(chunk)
+        self._range = span
+        self.bytes_written += written
+
+    def _write_range(self, span):
+        in_fd = getattr(span.source, 'fd', None)
+        if len(span) >= self.passthrough_size and \
+           in_fd is not None and self._fd is not None:
+            self.stream.flush()
+            if copy_range(in_fd, self._fd, span.start, span.end):
+                return
+            # the output does not support sendfile
+            self._fd = None
+        self.stream.write(span.view())
+
+    def flush(self):
+        """Write any pending range and flush the underlying stream"""
+        if self._range is not None:
+            span, self._range = self._range, None
+            self._write_range(span)
+        self.stream.flush()
+
+    def close(self):
+        """Flush the sink, and close the underlying stream if the sink owns
+        it
+        """
+        try:
+            self.flush()
+        finally:
+            if self.close_stream:
+                self.stream.close()
+
+def open_output(stream, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Open a new file object writing to the same descriptor as ``stream``
+    with a larger buffer
+
+    :returns: the new file object, or ``stream`` if it has no descriptor
+    """
+    try:
+        fd = stream.fileno()
+    except (AttributeError, IOError, ValueError):
+        return stream
+    stream.flush()
+    binary_mode(stream)
+    return os.fdopen(os.dup(fd), 'wb', buffer_size)
+
+# queued after the last batch of a node's chunks
+_END_NODE = object()
+
+def queue_chunks(put, chunks, batch_size, check_error):
+    """Queue the chunks of a node in lists of about ``batch_size`` bytes,
+    followed by an end marker
+
+    :param put: callable queuing an item
+    :param chunks: iterable of str or `Span` chunks
+    :param batch_size: number of bytes of chunks to queue at once
+    :param check_error: callable raising the error of the consumer, if it
+                        failed, before each batch is queued
+    :returns: number of bytes queued
+    """
+    batch = []
+    size = 0
+    total = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        if chunk.__class__ is Span:
+            size += chunk.end - chunk.start
+        else:
+            size += len(chunk)
+        if size >= batch_size:
+            check_error()
+            put(batch)
+            total += size
+            batch = []
+            size = 0
+    if batch:
+        put(batch)
+        total += size
+    put(_END_NODE)
+    return total
+
+def queued_chunks(get):
+    """Iterate over the chunks of a node queued by `queue_chunks`"""
+    return chain.from_iterable(iter(get, _END_NODE))
+
+class ThreadedSink(object):
+    """Write nodes to another sink from a background thread
+
+    The chunks of each node are handed over in batches through a bounded
+    queue, so a slow output stalls the parser only once the queue is full,
+    and the ``write()`` system calls, which release the GIL, overlap with
+    tokenizing.  Chunks must not change once written, as str chunks and
+    `Span` ranges of a mapped file do not.
+    """
+
+    def __init__(self, sink, batch_size=DEFAULT_BATCH_SIZE,
+                 queue_size=DEFAULT_BATCH_QUEUE_SIZE):
+        """Start writing to ``sink``
+
+        :param sink: sink the nodes are written to
+        :param batch_size: number of bytes of chunks to queue at once
+        :param queue_size: number of batches to buffer
+        """
+        self.sink = sink
+        self.batch_size = batch_size
+        #: number of bytes of filtered output queued
+        self.bytes_written = 0
+        self._error = None
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def write_node(self, node, chunks):
+        """Queue the filtered text of a node
+
+        :param node: `Node` the text belongs to
+        :param chunks: iterable of str or `Span` chunks
+        :raises: the exception the sink raised writing an earlier node
+        """
+        self._check_error()
+        self._queue.put(node)
+        self.bytes_written += queue_chunks(self._queue.put, chunks,
+                                           self.batch_size, self._check_error)
+
+    def _run(self):
+        get = self._queue.get
+        try:
+            while True:
+                node = get()
+                if node is None:
+                    return
+                chunks = queued_chunks(get)
+                self.sink.write_node(node, chunks)
+                # the sink may stop reading chunks early
+                for _ in chunks:
+                    pass
+        except Exception:
+            self._error = sys.exc_info()
+        # keep the parser from blocking on a full queue until it sees the
+        # error
+        while get() is not None:
+            pass
+
+    def _check_error(self):
+        if self._error is not None:
+            exc_type, exc_value, exc_tb = self._error
+            raise exc_type, exc_value, exc_tb
+
+    def close(self):
+        """Wait for every queued node to be written and close the sink
+
+        :raises: the exception the sink raised writing a node
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+        self.sink.close()
+
+#: Statement a `SinkProcess` writes to learn when the statements before it
+#: have been executed
+SYNC_STATEMENT = "SELECT 'holland_restore sync %d' AS sync;\n"
+
+_SYNC_RESULT = re.compile(r"holland_restore sync (\d+)")
+
+class SinkProcess(object):
+    """A subprocess reading SQL from its standard input
+
+    A SinkProcess is a file-like object writing to the process' standard
+    input.  A process started with ``sync`` has its standard output read by
+    a thread, so `sync()` can wait for the result of a statement; the rest
+    of its output is copied to our standard output.
+    """
+
+    def __init__(self, command, sync=False, buffer_size=DEFAULT_BUFFER_SIZE):
+        """Start a sink process
+
+        :param command: shell command to run, for instance 'mysql -u root'
+        :param sync: read the process' output so `sync()` can be used
+        :param buffer_size: size of the buffer of the process' input
+        """
+        self.command = command
+        stdout = None
+        if sync:
+            stdout = subprocess.PIPE
+        self.process = subprocess.Popen(command,
+                                        shell=True,
+                                        stdin=subprocess.PIPE,
+                                        stdout=stdout,
+                                        bufsize=buffer_size,
+                                        close_fds=True)
+        self.stdin = self.process.stdin
+        self._syncs = 0
+        self._synced = 0
+        self._exited = False
+        self._condition = Condition()
+        self._reader = None
+        if sync:
+            self._reader = Thread(target=self._read_output)
+            self._reader.setDaemon(True)
+            self._reader.start()
+
+    def write(self, data):
+        """Write data to the process"""
+        try:
+            self.stdin.write(data)
+        except IOError, exc:
+            self._stopped(exc)
+
+    def flush(self):
+        """Flush the buffered input to the process"""
+        try:
+            self.stdin.flush()
+        except IOError, exc:
+            self._stopped(exc)
+
+    def fileno(self):
+        """File descriptor of the process' input"""
+        return self.stdin.fileno()
+
+    def _stopped(self, exc):
+        if exc.errno == errno.EPIPE:
+            raise SinkError("Sink command %r stopped reading its input" %
+                            self.command)
+        raise
+
+    def _read_output(self):
+        stdout = self.process.stdout
+        for line in iter(stdout.readline, ''):
+            match = _SYNC_RESULT.search(line)
+            if match is None:
+                sys.stdout.write(line)
+                continue
+            self._condition.acquire()
+            try:
+                self._synced = max(self._synced, int(match.group(1)))
+                self._condition.notifyAll()
+            finally:
+                self._condition.release()
+        self._condition.acquire()
+        try:
+            self._exited = True
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def sync(self, timeout=None):
+        """Wait until the process has executed every statement written so
+        far
+
+        The process must print the result of a SELECT statement as soon as
+        it executes it, as ``mysql --unbuffered`` does.
+
+        :param timeout: number of seconds to wait, or None to wait until
+                        the process answers or exits
+        :raises: `SinkError` if the process exits first, or does not answer
+                 within ``timeout`` seconds
+        """
+        self._syncs += 1
+        self.write(SYNC_STATEMENT % self._syncs)
+        self.flush()
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._condition.acquire()
+        try:
+            while self._synced < self._syncs:
+                if self._exited:
+                    raise SinkError("Sink command %r exited before executing "
+                                    "every statement" % self.command)
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise SinkError("Sink command %r did not print the result "
+                                    "of a SELECT statement within %s seconds; "
+                                    "it must print each result as soon as it "
+                                    "runs, as 'mysql --unbuffered' does" %
+                                    (self.command, timeout))
+                self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+
+    def close(self):
+        """Close the process' input and wait for it to exit
+
+        :raises: `SinkError` if the process exits with a non-zero status
+        """
+        try:
+            self.stdin.close()
+        finally:
+            status = self.process.wait()
+            if self._reader is not None:
+                self._reader.join()
+        if status != 0:
+            raise SinkError("Sink command %r exited with status %d" %
+                            (self.command, status))
+
+def quote_identifier(name):
+    """Quote a MySQL identifier with backticks"""
+    return '`%s`' % name.replace('`', '``')
+
+class ParallelSink(object):
+    """Restore table data through a pool of sink processes
+
+    Each table-dml node is handed to the next free worker, a long-lived
+    sink process of its own, prefixed by the dump's session setup and a USE
+    statement for the table's database.  Its chunks are streamed to the
+    worker through a bounded queue, so a table's data is never held in
+    memory or spooled to disk at once.
+
+    All other nodes are written in order to a single serial sink process.
+    Before a table's data is queued, the serial process is synced with a
+    SELECT statement whose result it must print, so the table exists before
+    any worker loads it.  A process that does not print the result within
+    ``sync_timeout`` seconds, such as ``cat > file``, fails the restore
+    with a `SinkError` instead of blocking it forever.  Views, routines and the session restore that
+    follow the last table are applied once the serial process is closed.
+    """
+
+    def __init__(self, command, workers, batch_size=DEFAULT_BATCH_SIZE,
+                 queue_size=DEFAULT_BATCH_QUEUE_SIZE,
+                 sync_timeout=DEFAULT_SYNC_TIMEOUT):
+        """Create a new parallel sink
+
+        :param command: shell command to start for each sink process
+        :param workers: number of processes loading table data at once
+        :param batch_size: number of bytes of chunks to queue at once
+        :param queue_size: number of batches of a table's data to buffer
+                           for its worker
+        :param sync_timeout: number of seconds to wait for the serial
+                             process to execute the statements before a
+                             table's data
+        """
+        self.command = command
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.sync_timeout = sync_timeout
+        self.prelude = ''
+        self.errors = []
+        self._serial = None
+        self._unsynced = False
+        self._queued = 0
+        self._jobs = Queue(maxsize=workers)
+        self._workers = []
+        for _ in xrange(workers):
+            worker = Thread(target=self._work)
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+
+    def bytes_written(self):
+        """Number of bytes of filtered output written or queued"""
+        written = self._queued
+        if self._serial is not None:
+            written += self._serial.bytes_written
+        return written
+    bytes_written = property(bytes_written)
+
+    def write_node(self, node, chunks):
+        """Write the filtered text of a node
+
+        :param node: `Node` the text belongs to
+        :param chunks: iterable of str or `Span` chunks
+        """
+        if node.type == 'table-dml':
+            self._queue_data(node, chunks)
+        else:
+            self._write_serial(node, chunks)
+
+    def _use_database(self, database):
+        if database:
+            return 'USE %s;\n' % quote_identifier(database)
+        return ''
+
+    def _write_serial(self, node, chunks):
+        if self._serial is None:
+            self._serial = StreamSink(SinkProcess(self.command, sync=True),
+                                      close_stream=True)
+        if node.type == 'setup-session':
+            chunks = [''.join([str(chunk) for chunk in chunks])]
+            self.prelude = chunks[0]
+        self._serial.write_node(node, chunks)
+        self._unsynced = True
+
+    def _queue_data(self, node, chunks):
+        chunks = iter(chunks)
+        for first in chunks:
+            if len(first):
+                break
+        else:
+            # no data to load
+            return
+        self._check_errors()
+        if self._unsynced:
+            self._serial.flush()
+            self._serial.stream.sync(self.sync_timeout)
+            self._unsynced = False
+        batches = Queue(maxsize=self.queue_size)
+        self._jobs.put((node, self.prelude + self._use_database(node.database),
+                        batches))
+        self._queued += queue_chunks(batches.put, chain([first], chunks),
+                                     self.batch_size, self._check_errors)
+
+    def _work(self):
+        sink = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            node, prelude, batches = job
+            chunks = queued_chunks(batches.get)
+            try:
+                if not self.errors:
+                    if sink is None:
+                        sink = StreamSink(SinkProcess(self.command),
+                                          close_stream=True)
+                    sink.write_node(node, chain([prelude], chunks))
+            except Exception, exc:
+                self.errors.append(exc)
+            # keep the parser from blocking on a full queue after an error
+            for _ in chunks:
+                pass
+        if sink is not None:
+            try:
+                sink.close()
+            except Exception, exc:
+                self.errors.append(exc)
+
+    def _check_errors(self):
+        if self.errors:
+            raise SinkError("Failed to load table data: %s" % self.errors[0])
+
+    def close(self):
+        """Wait for all table data to load and for the serial process to
+        apply the rest of the dump
+
+        :raises: `SinkError` if any sink process failed
+        """
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self._serial is not None:
+            serial, self._serial = self._serial, None
+            serial.close()
+            self._queued += serial.bytes_written
+        self._check_errors()
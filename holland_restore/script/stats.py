@@ -0,0 +1,294 @@
+"""Counters and timings collected while restoring a dump
+
+`RestoreStats` measures, per node, the time spent reading the node from the
+`NodeStream`, running the `NodeFilter` callbacks on it and writing its
+filtered text to the sink.  The tokens of table data are read lazily, so
+tokenizing table data, and the filter callbacks that rewrite it, count as
+writing time.  Only a few clock readings are taken per node, so the cost
+does not grow with the size of the data.
+"""
+
+import time
+import json
+import itertools
+from operator import itemgetter
+from holland_restore.node.base import SkipNode
+
+__all__ = [
+    'NodeStats',
+    'RestoreStats',
+]
+
+#: Node types counted per table as well as per type
+TABLE_TYPES = frozenset(['table-ddl', 'table-dml', 'view-temp-ddl',
+                         'view-ddl'])
+
+#: Number of tables listed in a text report, slowest first
+DEFAULT_REPORT_TABLES = 10
+
+class NodeStats(object):
+    """Totals for a group of nodes"""
+    __slots__ = ('nodes', 'skipped', 'tokens', 'bytes_in', 'bytes_out',
+                 'read_time', 'read_cpu', 'filter_time', 'filter_cpu',
+                 'write_time', 'write_cpu')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    @property
+    def total_time(self):
+        """Wall clock time spent on the nodes"""
+        return self.read_time + self.filter_time + self.write_time
+
+    def as_dict(self):
+        """Return the totals as a dict"""
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+class RestoreStats(object):
+    """Collect `NodeStats` per node type and per table
+
+    Wall clock times are measured with ``clock`` and CPU times, which
+    include every thread of the process, with ``cpu_clock``.
+    """
+
+    def __init__(self, clock=time.time, cpu_clock=time.clock):
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.types = {}
+        self.tables = {}
+        self.lines = 0
+        self.bytes_in = 0
+        self.start = clock()
+        self.start_cpu = cpu_clock()
+        self._node = None
+        self._records = None
+
+    def records(self, node):
+        """Return the `NodeStats` that ``node`` is counted in
+
+        The records of a node are found once, so a node is still counted
+        under its original table after a filter renames its database.
+        """
+        if node is self._node:
+            return self._records
+        try:
+            by_type = self.types[node.type]
+        except KeyError:
+            by_type = self.types[node.type] = NodeStats()
+        if node.type not in TABLE_TYPES:
+            records = (by_type,)
+        else:
+            name = '%s.%s' % (node.database, node.table)
+            try:
+                by_table = self.tables[name]
+            except KeyError:
+                by_table = self.tables[name] = NodeStats()
+            records = (by_type, by_table)
+        self._node = node
+        self._records = records
+        return records
+
+    def read(self, nodes, scanner):
+        """Time reading each node from ``nodes``
+
+        The bytes of input of a node, and the tokens of table data, are
+        counted once the next node starts.
+
+        :param nodes: iterable of nodes, such as a `NodeStream`
+        :param scanner: scanner the nodes are read from
+        """
+        clock = self.clock
+        cpu_clock = self.cpu_clock
+        nodes = iter(nodes)
+        previous = None
+        start = None
+        counter = None
+        while True:
+            wall = clock()
+            cpu = cpu_clock()
+            try:
+                node = nodes.next()
+            except StopIteration:
+                break
+            records = self.records(node)
+            wall = clock() - wall
+            cpu = cpu_clock() - cpu
+            if previous is not None and counter is not None:
+                self._add(previous, 'tokens', counter.next())
+            counter = None
+            if isinstance(node.tokens, list):
+                self._add(records, 'tokens', len(node.tokens))
+            else:
+                node.tokens, counter = _counted(node.tokens)
+            for record in records:
+                record.nodes += 1
+                record.read_time += wall
+                record.read_cpu += cpu
+            if node.location is not None:
+                if start is not None:
+                    self._add(previous, 'bytes_in',
+                              node.location[1] - start)
+                start = node.location[1]
+            previous = records
+            yield node
+        if previous is not None:
+            if counter is not None:
+                self._add(previous, 'tokens', counter.next())
+            if start is not None:
+                self._add(previous, 'bytes_in', scanner.next_offset - start)
+        self.lines += scanner.lineno
+        self.bytes_in += scanner.next_offset
+
+    def count_input(self, node, size):
+        """Count a node read without a `NodeStream`, such as one extracted
+        through an index
+
+        :param size: number of bytes of input of the node
+        """
+        for record in self.records(node):
+            record.nodes += 1
+            record.bytes_in += size
+        self.bytes_in += size
+
+    def _add(self, records, name, value):
+        for record in records:
+            setattr(record, name, getattr(record, name) + value)
+
+    def wrap_filter(self, node_filter):
+        """Time the callbacks of ``node_filter``
+
+        :returns: `StatsFilter`
+        """
+        return StatsFilter(node_filter, self)
+
+    def wrap_sink(self, sink):
+        """Time writing to ``sink`` and count the bytes written
+
+        :returns: `StatsSink`
+        """
+        return StatsSink(sink, self)
+
+    def as_dict(self):
+        """Return the report as a dict that can be serialized as JSON"""
+        return {
+            'elapsed': self.clock() - self.start,
+            'cpu': self.cpu_clock() - self.start_cpu,
+            'lines': self.lines,
+            'bytes_in': self.bytes_in,
+            'node_types': dict([(name, record.as_dict())
+                                for name, record in self.types.items()]),
+            'tables': dict([(name, record.as_dict())
+                            for name, record in self.tables.items()]),
+        }
+
+    def write_json(self, path):
+        """Write the report to ``path`` as JSON"""
+        fileobj = open(path, 'w')
+        try:
+            json.dump(self.as_dict(), fileobj, indent=2, sort_keys=True)
+            fileobj.write('\n')
+        finally:
+            fileobj.close()
+
+    def format(self, max_tables=DEFAULT_REPORT_TABLES):
+        """Format the report as text
+
+        :param max_tables: number of tables to list, slowest first
+        """
+        header = "%-30s %7s %7s %9s %12s %12s %8s %8s %8s %8s" % (
+            '', 'nodes', 'skipped', 'tokens', 'bytes in', 'bytes out',
+            'read', 'filter', 'write', 'cpu')
+        lines = [
+            "Restored %d lines, %d bytes in %.2f seconds "
+            "(%.2f seconds CPU)" % (self.lines, self.bytes_in,
+                                   self.clock() - self.start,
+                                   self.cpu_clock() - self.start_cpu),
+            "",
+            header,
+        ]
+        for name in sorted(self.types):
+            lines.append(self._format_record(name, self.types[name]))
+        if self.tables:
+            tables = sorted(self.tables.items(),
+                            key=lambda item: item[1].total_time,
+                            reverse=True)
+            lines.extend(["", "Slowest tables:", header])
+            for name, record in tables[:max_tables]:
+                lines.append(self._format_record(name, record))
+        return "\n".join(lines)
+
+    def _format_record(self, name, record):
+        return "%-30s %7d %7d %9d %12d %12d %8.2f %8.2f %8.2f %8.2f" % (
+            name[:30], record.nodes, record.skipped, record.tokens,
+            record.bytes_in, record.bytes_out, record.read_time,
+            record.filter_time, record.write_time,
+            record.read_cpu + record.filter_cpu + record.write_cpu)
+
+def _counted(iterable):
+    """Count the items taken from an iterable without a python call per
+    item
+
+    :returns: tuple of (iterator, counter); ``counter.next()`` is the number
+              of items taken so far
+    """
+    counter = itertools.count()
+    items = itertools.imap(itemgetter(0), itertools.izip(iterable, counter))
+    return items, counter
+
+class StatsFilter(object):
+    """`NodeFilter` wrapper timing the filter callbacks of each node"""
+
+    def __init__(self, node_filter, stats):
+        self.node_filter = node_filter
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.node_filter, name)
+
+    def __call__(self, node):
+        stats = self.stats
+        records = stats.records(node)
+        wall = stats.clock()
+        cpu = stats.cpu_clock()
+        try:
+            try:
+                chunks = self.node_filter(node)
+            except SkipNode:
+                for record in records:
+                    record.skipped += 1
+                raise
+        finally:
+            wall = stats.clock() - wall
+            cpu = stats.cpu_clock() - cpu
+            for record in records:
+                record.filter_time += wall
+                record.filter_cpu += cpu
+        return chunks
+
+class StatsSink(object):
+    """Sink wrapper timing the writing of each node"""
+
+    def __init__(self, sink, stats):
+        self.sink = sink
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+    def write_node(self, node, chunks):
+        """Write a node to the wrapped sink, timing it"""
+        stats = self.stats
+        sink = self.sink
+        written = sink.bytes_written
+        wall = stats.clock()
+        cpu = stats.cpu_clock()
+        try:
+            sink.write_node(node, chunks)
+        finally:
+            wall = stats.clock() - wall
+            cpu = stats.cpu_clock() - cpu
+            for record in stats.records(node):
+                record.write_time += wall
+                record.write_cpu += cpu
+                record.bytes_out += sink.bytes_written - written
@@ -42,3 +42,62 @@ class ProgressMonitor(Thread):
             progress, message = self.data.poll()
             self.progressbar.render(progress, message)
             self.event.wait(0.2)
+
+class InputProgress(object):
+    """Progress of a restore through its input, polled by a
+    `ProgressMonitor`
+
+    The position is sampled from the monitor thread, so reading the input
+    does no extra work to report progress.
+    """
+
+    def __init__(self, scanner, size=None, position=None, clock=time.time):
+        """Measure the progress of ``scanner`` through its input
+
+        :param scanner: scanner reading the input
+        :param size: size of the input in bytes, or None if unknown
+        :param position: callable returning the number of bytes of the
+                         input read so far; defaults to the scanner's
+                         offset
+        :param clock: callable returning the current time in seconds
+        """
+        self.scanner = scanner
+        self.size = size
+        if position is None:
+            position = lambda: scanner.next_offset
+        self.position = position
+        self.clock = clock
+        self.start = clock()
+        self.state = 'Initializing'
+
+    def update(self, state):
+        """Set the description of what is being processed"""
+        self.state = state
+
+    def poll(self):
+        """Sample the progress
+
+        :returns: tuple of (percent done, message)
+        """
+        position = self.position()
+        elapsed = max(self.clock() - self.start, 1e-6)
+        rate = position / elapsed
+        lines = [
+            "",
+            "Processing: %s" % self.state,
+            "Line: %d" % self.scanner.lineno,
+        ]
+        if self.size:
+            percent = min(100, position*100 // self.size)
+            lines.append("%s of %s (%s per second)" %
+                         (format_bytes(position), format_bytes(self.size),
+                          format_bytes(int(rate))))
+        else:
+            percent = 0
+            lines.append("%s (%s per second)" %
+                         (format_bytes(position), format_bytes(int(rate))))
+        lines.append("Elapsed: %.2f seconds" % elapsed)
+        if self.size and rate:
+            remaining = max(self.size - position, 0) / rate
+            lines.append("Remaining: %.2f seconds" % remaining)
+        return percent, "\n".join(lines)
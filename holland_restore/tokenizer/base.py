@@ -1,12 +1,14 @@
 """Tokenizer base classes"""
 
 import re
-from holland_restore.scanner import Scanner
+from collections import deque
+from holland_restore.scanner import Scanner, ChunkedLine
 
 __all__ = [
     'Token',
     'TokenizationError',
     'Tokenizer',
+    'compile_rules',
 ]
 
 class Token(object):
@@ -19,7 +21,11 @@ class Token(object):
         :param symbol: The token symbol
         :type symbol: str
         :param text: The token text
-        :type text: str
+        :type text: str, `holland_restore.scanner.Span` or
+                    `holland_restore.scanner.ChunkedLine`.  Spans reference
+                    the text in a memory-mapped file and are only copied out
+                    when converted with ``str()``.  Chunked lines are read
+                    in pieces with `chunks()`.
         :param line_range: start and end lines of the token in the source data
         :type line_range: tuple
         :param offset: byte offset of the token text within the source data
@@ -49,20 +55,37 @@ class Token(object):
         :returns: bool. True if this token's text matches the regular 
                         expression and False otherwise.
         """
-        return re.match(regex, self.text) is not None
+        return re.match(regex, str(self.text)) is not None
 
     def extract(self, regex):
         """Search this token for the specific regex
         
         :param regex: regular expression to search for in this token's text
-        :type regex: str
+                      or an extractor callable, such as those registered in
+                      `holland_restore.tokenizer.extract.EXTRACTORS`
+        :type regex: str or callable
         :returns: iterable of the matching groups
         """
-        match = re.search(regex, self.text, re.M|re.U)
+        if callable(regex):
+            return regex(str(self.text))
+        match = re.search(regex, str(self.text), re.M|re.U)
         if not match:
             return None
         return match.groups()
 
+    def chunks(self):
+        """Iterate over the text of this token in bounded-size pieces
+
+        Text that is held in memory, or memory-mapped, is returned as a
+        single piece.
+
+        :returns: iterator over str or `holland_restore.scanner.Span` pieces
+        """
+        try:
+            return self.text.chunks()
+        except AttributeError:
+            return iter((self.text,))
+
     def __str__(self): 
         return "Token(symbol=%r)" % (self.symbol)
 
@@ -81,6 +104,34 @@ class TokenizationError(Exception):
         return self.message
 
 
+def compile_rules(rules):
+    """Compile a sequence of tokenization rules into a dispatch table keyed
+    on the first character of a line.
+
+    Rules that match a fixed prefix advertise it through a ``prefix``
+    attribute (see `holland_restore.tokenizer.rules.tokenize_prefix`).  Rules
+    without a prefix may match any line and are included in every bucket.
+    Within a bucket rules keep their original relative order, so the first
+    matching rule is the same one a linear scan of ``rules`` would find.
+
+    :param rules: iterable of rule callables
+    :returns: tuple of (dispatch, generic) where dispatch maps a first
+              character to a list of rules and generic is the list of rules
+              to try for lines whose first character has no bucket
+    """
+    dispatch = {}
+    generic = []
+    for rule in rules:
+        prefix = getattr(rule, 'prefix', None)
+        if prefix:
+            bucket = dispatch.setdefault(prefix[0], list(generic))
+            bucket.append(rule)
+        else:
+            for bucket in dispatch.values():
+                bucket.append(rule)
+            generic.append(rule)
+    return dispatch, generic
+
 class Tokenizer(object):
     """A simple line-based tokenizer"""
 
@@ -88,7 +139,9 @@ class Tokenizer(object):
         """Create a new Tokenizer
 
         :param stream: stream to read tokens from
-        :type stream: iterable
+        :type stream: iterable or `Scanner`. If a `Scanner` instance is
+                      given it is used directly, otherwise the iterable is
+                      wrapped in a plain line `Scanner`.
         :param rules: tokenization rules that takes data from the
                       stream and produces tokens
         :type rules: iterable of callables. 
@@ -96,49 +149,98 @@ class Tokenizer(object):
                         * line - current text being considered
                         * scanner - the internal tokenizer scanner. A subclass
                                     of `Scanner`
+                     Rules are compiled with `compile_rules` so each line is
+                     only offered to the rules that can match its first
+                     character.
         """
-        self.scanner = Scanner(stream)
+        if isinstance(stream, Scanner):
+            self.scanner = stream
+        else:
+            self.scanner = Scanner(stream)
         self.rules = list(rules)
-        self.token_queue = []
+        self._dispatch, self._generic = compile_rules(self.rules)
+        self.token_queue = deque()
 
     def push_back(self, token):
         """Place the given token at the front of the Tokenizer's queue
 
         :param token: token to push back
         :type token: `Token`
-        """       
-        self.token_queue.append(token)
+        """
+        self.token_queue.appendleft(token)
 
-    def peek(self):
-        """Peek at the next token in the tokenizer but don't move 
+    def peek(self, n=1):
+        """Peek at an upcoming token in the tokenizer but don't move
         past it.
 
-        This is equivalent to calling next() and pushing the token
-        back on the tokenizer stack.
+        Tokens are read into the lookahead buffer as needed, so peeking
+        never requires pushing tokens back onto the tokenizer.
 
+        :param n: how far ahead to look. 1 is the next token.
         :returns: `Token`
+        :raises: StopIteration if fewer than n tokens remain
         """
-        token = self.next()
-        self.push_back(token)
-        return token
+        queue = self.token_queue
+        while len(queue) < n:
+            queue.append(self.tokenize())
+        return queue[n - 1]
+
+    def lookahead(self, symbols):
+        """Check whether the upcoming tokens match a sequence of symbols
+
+        No tokens are consumed.
+
+        :param symbols: sequence of token symbols expected in order
+        :returns: bool. True if the next len(symbols) tokens have exactly
+                        these symbols and False otherwise, including when
+                        the stream ends first
+        """
+        for depth, symbol in enumerate(symbols):
+            try:
+                token = self.peek(depth + 1)
+            except StopIteration:
+                return False
+            if token.symbol != symbol:
+                return False
+        return True
 
     def next(self):
         """Return the next available token.
 
-        If tokens have been pushed back on the stream
+        If tokens have been peeked at or pushed back on the stream
         those are returned before we pull more input from
         the scanner.
         """
         if self.token_queue:
-            return self.token_queue.pop(0)
+            return self.token_queue.popleft()
         else:
             return self.tokenize()
 
+    def skip_until(self, prefixes):
+        """Discard input up to the next line starting with one of
+        ``prefixes`` without tokenizing it
+
+        Tokens already read ahead are dropped until one whose text starts
+        with a prefix; the scanner then searches its raw input for the next
+        matching line.  The matching line is tokenized by the next call to
+        `next()` or `peek()`.
+
+        :param prefixes: tuple of line prefixes to stop at
+        """
+        queue = self.token_queue
+        while queue:
+            if queue[0].text.startswith(prefixes):
+                return
+            token = queue.popleft()
+            if isinstance(token.text, ChunkedLine):
+                token.text.discard()
+        self.scanner.skip_until(prefixes)
+
     def tokenize(self):
         """Generate a token based on the next line in the scanner"""
         scanner = self.scanner
         line = scanner.next()
-        for rule in self.rules:
+        for rule in self._dispatch.get(line[:1], self._generic):
             token = rule(line, self.scanner)
             if token is not None:
                 return token
@@ -0,0 +1,88 @@
+"""Precompiled extractors for pulling names out of token text
+
+An extractor is a callable that accepts a token's text and returns a tuple
+of the extracted groups, or None if nothing matched - the same contract as
+`Token.extract`.  Extractors are compiled once at import time and looked up
+by name in `EXTRACTORS`.
+"""
+
+import re
+
+__all__ = [
+    'EXTRACTORS',
+    'register_extractor',
+    'regex_extractor',
+    'backtick_identifier',
+]
+
+#: Registry of extractors by name
+EXTRACTORS = {}
+
+def register_extractor(name, extractor):
+    """Add an extractor to the registry
+
+    :param name: name the extractor is looked up by
+    :param extractor: callable accepting text and returning a tuple of
+                      groups or None
+    :returns: the extractor, so this may be used at module level
+    """
+    EXTRACTORS[name] = extractor
+    return extractor
+
+def regex_extractor(pattern, flags=re.M|re.U):
+    """Create an extractor from a regular expression
+
+    The expression is compiled once and searched for in the text.
+
+    :param pattern: regular expression string
+    :param flags: flags to compile the expression with
+    :returns: extractor callable
+    """
+    search = re.compile(pattern, flags).search
+    def extract(text):
+        """Search text for the precompiled pattern"""
+        match = search(text)
+        if not match:
+            return None
+        return match.groups()
+    extract.pattern = pattern
+    return extract
+
+_search_identifier = regex_extractor('`((?:``|[^`])+)`')
+
+def backtick_identifier(text):
+    """Extract the first backtick quoted identifier from text
+
+    This is equivalent to searching for the regular expression
+    '`((?:``|[^`])+)`' but only uses str.find in the common case.  As with
+    the regular expression, doubled backticks in the name are returned
+    as-is.
+
+    :param text: text to search
+    :returns: tuple of (name,) or None if text has no quoted identifier
+    """
+    start = text.find('`')
+    if start == -1:
+        return None
+    end = start
+    while True:
+        end = text.find('`', end + 1)
+        if end == -1:
+            break
+        if text[end + 1:end + 2] != '`':
+            if end > start + 1:
+                return (text[start + 1:end],)
+            break
+        # skip over an escaped backtick
+        end += 1
+    # unterminated or empty identifiers need the regex backtracking rules
+    return _search_identifier(text)
+
+register_extractor('identifier', backtick_identifier)
+register_extractor('header-database', regex_extractor('Database: (.*)$'))
+register_extractor('engine', regex_extractor('^[)] ENGINE=([a-zA-Z]+)'))
+register_extractor('routines-database', regex_extractor("'((?:``|[^`])+)'"))
+register_extractor('function', regex_extractor('FUNCTION `((?:``|[^`])+)`'))
+register_extractor('procedure',
+                   regex_extractor('PROCEDURE `((?:``|[^`])+)`'))
+register_extractor('binlog-position', regex_extractor("'([^']+).*(\d+)'"))
@@ -1,6 +1,7 @@
 """Set of rules for tokenizing mysqldump output"""
 
 from cStringIO import StringIO
+from holland_restore.scanner import Span
 from holland_restore.tokenizer.base import Token
 
 __all__ = [
@@ -17,6 +18,8 @@ def tokenize_prefix(prefix, dispatch, *args, **kwargs):
         """
         if line.startswith(prefix):
             return dispatch(line=line, scanner=scanner, *args, **kwargs)
+    # advertised for Tokenizer's first-character dispatch table
+    match.prefix = prefix
     return match
 
 def make_token(symbol, line, scanner):
@@ -41,14 +44,24 @@ def tokenize_multi_line(symbol, until, line, scanner):
     """
     lineno = scanner.lineno
     offset = scanner.offset
-    text = StringIO()
-    text.write(line)
-    for line in scanner:
-        text.write(line)
-        if line.rstrip().endswith(until):
-            break
-    data = text.getvalue()
-    del text
+    if isinstance(line, Span):
+        # lines of a mapped file are contiguous, so the token is just a
+        # wider span of the same map
+        first = line
+        for line in scanner:
+            if line.rstrip().endswith(until):
+                break
+        data = Span(first.source, first.start, line.end)
+    else:
+        # str() reads the whole of a `ChunkedLine`
+        text = StringIO()
+        text.write(str(line))
+        for line in scanner:
+            text.write(str(line))
+            if line.rstrip().endswith(until):
+                break
+        data = text.getvalue()
+        del text
     return Token(symbol, 
                  text=data, 
                  line_range=(lineno,scanner.lineno), 
@@ -66,7 +79,11 @@ def tokenize_delimiter(symbol, until, line, scanner):
 
 def distinguish_conditional(line, scanner):
     """Tokenize and classify a MySQL comment line"""
-    if line.startswith('/*!40000 ALTER'):
+    # SET lines are by far the most common conditional comment and cannot
+    # match any of the prefixes below, so check them first
+    if line.lstrip('/*!0123456789 ').startswith('SET '):
+        token = make_token(symbol='SetVariable', line=line, scanner=scanner)
+    elif line.startswith('/*!40000 ALTER'):
         token = make_token(symbol='AlterTable', line=line, scanner=scanner)
     elif line.startswith('/*!50001 DROP TABLE'):
         token = make_token(symbol='DropTmpView', line=line, scanner=scanner)
@@ -82,8 +99,6 @@ def distinguish_conditional(line, scanner):
                                     until=';', 
                                     line=line, 
                                     scanner=scanner)
-    elif line.lstrip('/*!0123456789 ').startswith('SET '):
-        token = make_token(symbol='SetVariable', line=line, scanner=scanner)
     else:
         token = make_token(symbol='ConditionalComment',
                            line=line,
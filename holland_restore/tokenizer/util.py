@@ -55,33 +55,34 @@ def yield_until_preserving(stop_symbols,
     """Yield tokens from the tokenizer until a symbol in `symbols` is
     encountered.
     
-    While scanning the tokenizer, this method will queue up any tokens in 
-    `wsymbols`.  If a token is encountered that is not in `wsymbols` and is
-    also not in `symbols` the queue is flushed.
+    While scanning the tokenizer, this method will hold back any tokens in
+    `preserve_symbols`.  If a token is encountered that is not in
+    `preserve_symbols` and is also not in `stop_symbols` the held tokens are
+    yielded.  Held tokens that directly precede the stop token are left in
+    the tokenizer, ahead of the stop token.
  
     This is largely used to scan through the tokenizer but not skip over some
     preceding tokens such as a comment block.
     """
-    queue = []
-    for token in yield_until(stop_symbols, tokenizer, inclusive):
+    # preserved tokens stay in the tokenizer's lookahead buffer until we
+    # know whether they precede a stop token or ordinary output
+    depth = 1
+    while True:
+        try:
+            token = tokenizer.peek(depth)
+        except StopIteration:
+            break
+        if token.symbol in stop_symbols:
+            if inclusive:
+                for _ in xrange(depth):
+                    yield tokenizer.next()
+            break
         if token.symbol in preserve_symbols:
-            queue.append(token)
-        else:
-            while queue:
-                yield queue.pop(0)
-            yield token
-    # ensure proper ordering of tokenizer symbols
-    # if inclusive and we hit a stop symbol ``symbols``
-    # then it was pushed on the stack - it should come after
-    # anything we have in 'queue' as those token precede this
-    # token
-    if not inclusive:
-        token = tokenizer.next()
-        if token:
-            queue.append(token)
-    while queue:
-        token = queue.pop(0)
-        tokenizer.push_back(token)
+            depth += 1
+            continue
+        for _ in xrange(depth):
+            yield tokenizer.next()
+        depth = 1
 
 
 def scan_until_preserving(stop_symbols, tokenizer, preserve_symbols=()):
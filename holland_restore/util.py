@@ -1,43 +1,189 @@
 """General utilities for holland_restore"""
 
+import os
 import re
+import sys
 import fnmatch
+from collections import OrderedDict
 
 __all__ = [
     'Filter',
+    'PatternSet',
+    'LRUCache',
+    'read_patterns',
+    'binary_mode',
 ]
 
+#: Default number of names whose filter verdict is remembered
+DEFAULT_CACHE_SIZE = 65536
+
+_MISSING = object()
+
 class FilteredItem(Exception):
     """Raised when text is filtered"""
 
+class LRUCache(object):
+    """Mapping that holds at most ``maxsize`` items, discarding the least
+    recently used item when it is full
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used"""
+        data = self._data
+        try:
+            value = data.pop(key)
+        except KeyError:
+            return default
+        data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data.pop(key, None)
+        data[key] = value
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Remove all items from the cache"""
+        self._data.clear()
+
+def is_glob(pattern):
+    """Check whether a pattern uses any glob wildcards"""
+    for char in '*?[':
+        if char in pattern:
+            return True
+    return False
+
+class PatternSet(object):
+    """A set of glob patterns
+
+    Patterns without wildcards are matched with a single hash lookup and
+    all remaining globs are compiled into one alternation, so the cost of
+    a match does not grow with the number of exact names.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self.exact = set()
+        self.globs = []
+        for pattern in self.patterns:
+            if is_glob(pattern):
+                self.globs.append(pattern)
+            else:
+                self.exact.add(pattern)
+        if self.globs:
+            self._match = re.compile('|'.join(['(?:%s)' % fnmatch.translate(p)
+                                               for p in self.globs])).match
+        else:
+            self._match = None
+
+    def __contains__(self, text):
+        if text in self.exact:
+            return True
+        return self._match is not None and self._match(text) is not None
+
+    def find(self, text):
+        """Find the pattern matching text
+
+        :returns: the matching pattern or None
+        """
+        if text in self.exact:
+            return text
+        if self._match is not None and self._match(text):
+            for pattern in self.globs:
+                if fnmatch.fnmatchcase(text, pattern):
+                    return pattern
+        return None
+
+    def __nonzero__(self):
+        return bool(self.patterns)
+
 class Filter(object):
-    """General inclusion/exclusion filter"""
+    """General inclusion/exclusion filter
+
+    The verdict for each name is computed once and kept in an LRU cache.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self._include = PatternSet()
+        self._exclude = PatternSet()
+        self._verdicts = LRUCache(cache_size)
 
-    def __init__(self):
-        self._include = []
-        self._exclude = []
-    
     def include(self, patterns):
         """Filter names not included in the list of glob patterns
 
         :param patterns: list of globs
         """
-        self._include = [fnmatch.translate(p) for p in patterns]
+        self._include = PatternSet(patterns)
+        self._verdicts.clear()
 
     def exclude(self, patterns):
         """Filter names matched by any glob in the patterns list
 
         :param pattern: list of globs
         """
-        self._exclude = [fnmatch.translate(p) for p in patterns]
-    
+        self._exclude = PatternSet(patterns)
+        self._verdicts.clear()
+
+    def check(self, text):
+        """Evaluate text against the include and exclude patterns
+
+        :returns: None if text passes the filter, otherwise the reason it
+                  was filtered
+        """
+        if self._include and text not in self._include:
+            return 'No matching include pattern'
+        if text in self._exclude:
+            return self._exclude.find(text)
+        return None
+
     def __call__(self, text):
-        for pat in self._include:
-            if re.match(pat, text):
-                break
-        else:
-            if self._include:
-                raise FilteredItem(text, 'No matching include pattern')
-        for pat in self._exclude:
-            if re.match(pat, text):
-                raise FilteredItem(text, pat)
+        verdicts = self._verdicts
+        reason = verdicts.get(text, _MISSING)
+        if reason is _MISSING:
+            reason = self.check(text)
+            verdicts[text] = reason
+        if reason is not None:
+            raise FilteredItem(text, reason)
+
+def read_patterns(path):
+    """Read a list of names or glob patterns from a file
+
+    One pattern is read per line.  Blank lines and lines starting with '#'
+    are ignored.
+
+    :param path: path of the file to read
+    :returns: list of patterns
+    """
+    fileobj = open(path, 'r')
+    try:
+        patterns = []
+        for line in fileobj:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                patterns.append(line)
+        return patterns
+    finally:
+        fileobj.close()
+
+def binary_mode(stream):
+    """Switch a standard stream to binary mode
+
+    Dumps are read and written as bytes, so that offsets are file
+    positions.  Standard streams translate line endings on Windows unless
+    their descriptor is set to binary mode.
+
+    :returns: ``stream``
+    """
+    if sys.platform == 'win32':
+        import msvcrt
+        msvcrt.setmode(stream.fileno(), os.O_BINARY)
+    return stream
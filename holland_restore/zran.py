@@ -0,0 +1,382 @@
+"""Random access into gzip compressed dumps
+
+This follows the approach of zlib's ``zran.c`` example.  While a gzip file
+is decompressed, a checkpoint is recorded at a deflate block boundary every
+`DEFAULT_SPAN` bytes of output: the compressed and uncompressed offsets,
+the number of bits of the last compressed byte already consumed and the
+32K of output preceding the boundary, which deflate may refer back to.
+Inflation can later resume at any checkpoint instead of at the start of
+the file.
+
+The python zlib module cannot stop at block boundaries or prime a stream
+with a partial byte, so libz is used through ctypes.  If libz cannot be
+loaded `available` is False and compressed dumps are read sequentially.
+"""
+
+import ctypes
+import ctypes.util
+import zlib
+import base64
+from collections import namedtuple
+
+__all__ = [
+    'available',
+    'Checkpoint',
+    'Inflater',
+    'ZranReader',
+    'format_checkpoint',
+    'parse_checkpoint',
+]
+
+#: Number of uncompressed bytes between checkpoints
+DEFAULT_SPAN = 16*1024*1024
+
+#: Size of the deflate history window
+WINDOW_SIZE = 32768
+
+#: Number of bytes inflated per call into libz
+CHUNK_SIZE = 256*1024
+
+#: Number of compressed bytes read from the file at a time
+READ_SIZE = 256*1024
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+# window bits selecting the stream format
+RAW = -15
+GZIP = 31
+GZIP_OR_ZLIB = 47
+
+# size of the gzip trailer: crc32 and uncompressed size
+GZIP_TRAILER_SIZE = 8
+
+class z_stream(ctypes.Structure):
+    """zlib's z_stream structure"""
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+    ]
+
+def _load_libz():
+    path = ctypes.util.find_library('z')
+    if not path:
+        return None
+    try:
+        libz = ctypes.CDLL(path)
+        libz.zlibVersion.restype = ctypes.c_char_p
+        for name in ('inflateInit2_', 'inflate', 'inflateEnd',
+                     'inflateReset', 'inflateReset2', 'inflatePrime',
+                     'inflateSetDictionary'):
+            getattr(libz, name).restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libz
+
+_libz = _load_libz()
+
+#: True if checkpoints can be created and used
+available = _libz is not None
+
+class Checkpoint(namedtuple('Checkpoint', ['out_offset', 'in_offset',
+                                           'bits', 'window'])):
+    """Point at which inflation of a gzip file can be resumed
+
+    ``in_offset`` is the offset of the first compressed byte not yet fully
+    consumed and ``bits`` the number of bits of the byte before it that
+    still have to be fed to the inflater.
+    """
+    __slots__ = ()
+
+def format_checkpoint(checkpoint):
+    """Format a checkpoint as tab separated fields"""
+    return '\t'.join([str(checkpoint.out_offset),
+                      str(checkpoint.in_offset),
+                      str(checkpoint.bits),
+                      base64.b64encode(zlib.compress(checkpoint.window))])
+
+def parse_checkpoint(fields):
+    """Parse the fields written by `format_checkpoint`
+
+    :raises: ValueError if the fields are invalid
+    """
+    out_offset, in_offset, bits, window = fields
+    try:
+        window = zlib.decompress(base64.b64decode(window))
+    except (TypeError, zlib.error), exc:
+        raise ValueError("Invalid checkpoint window: %s" % exc)
+    return Checkpoint(int(out_offset), int(in_offset), int(bits), window)
+
+class Inflater(object):
+    """Incremental gzip inflater that can record and resume at checkpoints
+
+    Multiple gzip members are decompressed in turn, and zero bytes padding
+    the input after the end of a member are skipped.
+    """
+
+    def __init__(self, window_bits=GZIP_OR_ZLIB, span=None, in_offset=0,
+                 out_offset=0):
+        """Create a new inflater
+
+        :param window_bits: stream format, as for zlib's inflateInit2
+        :param span: record a checkpoint every ``span`` bytes of output, or
+                     never if None
+        :param in_offset: compressed offset of the first byte to be fed
+        :param out_offset: uncompressed offset of the first byte produced
+        """
+        if not available:
+            raise RuntimeError("libz is not available")
+        self.span = span
+        self.raw = window_bits < 0
+        self.checkpoints = []
+        self.in_offset = in_offset
+        self.out_offset = out_offset
+        self._window = ''
+        self._skip = 0
+        # True once a member has ended and no data of another one was read
+        self._ended = False
+        self._last = None
+        self._stream = z_stream()
+        self._output = ctypes.create_string_buffer(CHUNK_SIZE)
+        self._check(_libz.inflateInit2_(ctypes.byref(self._stream),
+                                        window_bits,
+                                        _libz.zlibVersion(),
+                                        ctypes.sizeof(self._stream)))
+
+    def _check(self, status):
+        if status not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            msg = self._stream.msg or 'error %d' % status
+            raise zlib.error("inflate failed: %s" % msg)
+        return status
+
+    def prime(self, bits, value):
+        """Feed the remaining bits of a partially consumed byte"""
+        self._check(_libz.inflatePrime(ctypes.byref(self._stream),
+                                       bits, value))
+
+    def set_dictionary(self, window):
+        """Set the history preceding the resume point"""
+        self._window = window
+        if window:
+            self._check(_libz.inflateSetDictionary(ctypes.byref(self._stream),
+                                                   window, len(window)))
+
+    def _end_of_member(self):
+        self._window = ''
+        self._ended = True
+        if self.raw:
+            # a raw stream resumed from a checkpoint is followed by the gzip
+            # trailer and the next member's header
+            self._skip = GZIP_TRAILER_SIZE
+            self.raw = False
+            self._check(_libz.inflateReset2(ctypes.byref(self._stream),
+                                            GZIP))
+        else:
+            self._check(_libz.inflateReset(ctypes.byref(self._stream)))
+
+    def _update_window(self, chunk):
+        if len(chunk) >= WINDOW_SIZE:
+            self._window = chunk[-WINDOW_SIZE:]
+        else:
+            self._window = (self._window + chunk)[-WINDOW_SIZE:]
+
+    def _skip_input(self, data):
+        """Drop the rest of a skipped gzip trailer, and the padding after
+        the end of a member, from the start of ``data``
+        """
+        skip = min(self._skip, len(data))
+        self._skip -= skip
+        if self._ended:
+            skip = len(data) - len(data[skip:].lstrip('\x00'))
+            if skip < len(data):
+                self._ended = False
+        if skip:
+            self.in_offset += skip
+            data = data[skip:]
+        return data
+
+    def decompress(self, data):
+        """Decompress the next piece of compressed input
+
+        :returns: decompressed data, which may be empty
+        """
+        data = self._skip_input(data)
+        if not data:
+            return ''
+        stream = self._stream
+        result = []
+        # zlib only reads the input, so point it at the str's own buffer
+        address = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        stream.next_in = address
+        stream.avail_in = len(data)
+        output = self._output
+        while True:
+            stream.next_out = ctypes.addressof(output)
+            stream.avail_out = CHUNK_SIZE
+            avail_in = stream.avail_in
+            status = self._check(_libz.inflate(ctypes.byref(stream),
+                                               Z_BLOCK))
+            consumed = avail_in - stream.avail_in
+            produced = CHUNK_SIZE - stream.avail_out
+            self.in_offset += consumed
+            self.out_offset += produced
+            if produced:
+                chunk = ctypes.string_at(ctypes.addressof(output), produced)
+                result.append(chunk)
+                self._update_window(chunk)
+            if status == Z_STREAM_END:
+                self._end_of_member()
+                remaining = stream.avail_in
+                if not remaining:
+                    break
+                data = self._skip_input(data[len(data) - remaining:])
+                if not data:
+                    break
+                address = ctypes.cast(ctypes.c_char_p(data),
+                                      ctypes.c_void_p).value
+                stream.next_in = address
+                stream.avail_in = len(data)
+                continue
+            if self.span is not None:
+                self._maybe_checkpoint()
+            if not stream.avail_in and stream.avail_out:
+                break
+            if not consumed and not produced:
+                break
+        return ''.join(result)
+
+    def finish(self):
+        """Check that the input ended with the end of a member
+
+        :raises: zlib.error if the input was truncated
+        """
+        if not self._ended:
+            raise zlib.error("unexpected end of file")
+
+    def _maybe_checkpoint(self):
+        data_type = self._stream.data_type
+        # bit 7: at a block boundary, bit 6: the last block has been read
+        if not data_type & 128 or data_type & 64:
+            return
+        if self._last is not None and \
+           self.out_offset - self._last < self.span:
+            return
+        self._last = self.out_offset
+        self.checkpoints.append(Checkpoint(self.out_offset, self.in_offset,
+                                           data_type & 7, self._window))
+
+    def close(self):
+        """Release the inflater's memory"""
+        if self._stream is not None:
+            _libz.inflateEnd(ctypes.byref(self._stream))
+            self._stream = None
+
+    def __del__(self):
+        self.close()
+
+class ZranReader(object):
+    """Read ranges of uncompressed data from a gzip file using checkpoints
+    """
+
+    def __init__(self, fileobj, checkpoints, read_size=READ_SIZE):
+        """Create a new reader
+
+        :param fileobj: seekable gzip file
+        :param checkpoints: list of `Checkpoint` in increasing order
+        :param read_size: number of compressed bytes to read at a time
+        """
+        self.fileobj = fileobj
+        self.checkpoints = sorted(checkpoints)
+        self.read_size = read_size
+        self._inflater = None
+        self._pending = ''
+
+    def _find_checkpoint(self, offset):
+        found = None
+        for checkpoint in self.checkpoints:
+            if checkpoint.out_offset > offset:
+                break
+            found = checkpoint
+        return found
+
+    def _resume(self, offset):
+        checkpoint = self._find_checkpoint(offset)
+        if self._inflater is not None:
+            self._inflater.close()
+        self._pending = ''
+        if checkpoint is None:
+            self.fileobj.seek(0)
+            self._inflater = Inflater(GZIP_OR_ZLIB)
+            return
+        in_offset = checkpoint.in_offset
+        if checkpoint.bits:
+            in_offset -= 1
+        self.fileobj.seek(in_offset)
+        inflater = Inflater(RAW, in_offset=in_offset,
+                            out_offset=checkpoint.out_offset)
+        if checkpoint.bits:
+            value = ord(self.fileobj.read(1))
+            inflater.in_offset += 1
+            inflater.prime(checkpoint.bits, value >> (8 - checkpoint.bits))
+        inflater.set_dictionary(checkpoint.window)
+        self._inflater = inflater
+
+    def _read(self):
+        if self._pending:
+            data, self._pending = self._pending, ''
+            return data
+        while True:
+            block = self.fileobj.read(self.read_size)
+            if not block:
+                return ''
+            data = self._inflater.decompress(block)
+            if data:
+                return data
+
+    def read_range(self, start, end):
+        """Read a range of uncompressed data
+
+        Reading resumes where the last range ended when that is closer than
+        the nearest checkpoint.
+
+        :returns: iterator over blocks of data
+        :raises: IOError if the file ends before ``end``
+        """
+        position = None
+        if self._inflater is not None:
+            position = self._inflater.out_offset - len(self._pending)
+        checkpoint = self._find_checkpoint(start)
+        if position is None or position > start or \
+           (checkpoint is not None and checkpoint.out_offset > position):
+            self._resume(start)
+            position = self._inflater.out_offset
+        while position < end:
+            data = self._read()
+            if not data:
+                raise IOError("Unexpected end of file reading bytes %d-%d" %
+                              (start, end))
+            data_end = position + len(data)
+            if data_end > end:
+                self._pending = data[end - position:]
+                data = data[:end - position]
+                data_end = end
+            if data_end > start:
+                if position < start:
+                    data = data[start - position:]
+                yield data
+            position = data_end
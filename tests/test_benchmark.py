@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from holland_restore.node import NodeStream
+from holland_restore.benchmark.generate import DumpShape, generate_dump
+from holland_restore.benchmark.run import run_benchmark, compare
+from nose.tools import *
+
+SHAPE = DumpShape(databases=2, tables=3, rows=50, insert_size=300, views=2,
+                  routines=1, triggers=1, seed=1)
+
+def test_generate_dump():
+    """Test a generated dump parses into the expected nodes"""
+    result = StringIO()
+    generate_dump(result, SHAPE)
+    text = result.getvalue()
+    types = {}
+    output = []
+    for node in NodeStream(text.splitlines(True)):
+        types[node.type] = types.get(node.type, 0) + 1
+        output.extend([str(token.text) for token in node.tokens])
+    assert_equals("".join(output), text)
+    assert_equals(types['database-ddl'], 2)
+    assert_equals(types['table-ddl'], 6)
+    assert_equals(types['table-dml'], 6)
+    assert_equals(types['view-temp-ddl'], 4)
+    assert_equals(types['view-ddl'], 4)
+    assert_equals(types['database-routines'], 2)
+    assert_equals(text.count('TRIGGER `'), 2)
+    for line in text.splitlines():
+        if line.startswith('INSERT'):
+            ok_(len(line) <= 300)
+    # the same shape always generates the same dump
+    again = StringIO()
+    generate_dump(again, SHAPE)
+    assert_equals(again.getvalue(), text)
+
+def test_run_benchmark():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        fileobj = open(path, 'w')
+        generate_dump(fileobj, SHAPE)
+        fileobj.close()
+        results = run_benchmark(path, ['scanner', 'nodefilter'], repeat=1)
+        assert_equals(sorted(results['stages']), ['nodefilter', 'scanner'])
+        assert_equals(results['dump']['bytes'], os.path.getsize(path))
+        assert_equals(results['dump']['lines'],
+                      len(open(path).read().splitlines()))
+        for result in results['stages'].values():
+            ok_(result['mb_per_second'] > 0)
+            ok_(result['lines_per_second'] > 0)
+        lines = compare(results, results)
+        assert_equals(len(lines), 2)
+        ok_(lines[0].startswith('scanner'))
+        ok_(lines[0].endswith('+0.0%'))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,115 @@
+import os
+import bz2
+import gzip
+import shutil
+import tempfile
+from StringIO import StringIO
+from holland_restore.compress import open_input, detect_compression, \
+                                     DecompressingReader, PrefetchReader, \
+                                     CompressionError, lzma
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+
+TEXT = ''.join(['INSERT INTO `t` VALUES (%d);\n' % i for i in xrange(5000)])
+
+def gzip_data(text):
+    buf = StringIO()
+    fileobj = gzip.GzipFile(fileobj=buf, mode='wb')
+    fileobj.write(text)
+    fileobj.close()
+    return buf.getvalue()
+
+def read_all(fileobj, size=4096):
+    parts = []
+    while True:
+        data = fileobj.read(size)
+        if not data:
+            break
+        parts.append(data)
+    return ''.join(parts)
+
+def check_input(data):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump')
+        open(path, 'wb').write(data)
+        fileobj = open_input(path)
+        try:
+            assert_equals(read_all(fileobj), TEXT)
+        finally:
+            fileobj.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_detect_compression():
+    assert_equals(detect_compression(gzip_data('x'))[0], 'gzip')
+    assert_equals(detect_compression(bz2.compress('x'))[0], 'bzip2')
+    assert_equals(detect_compression('\xfd7zXZ\x00\x00')[0], 'xz')
+    assert_equals(detect_compression('-- MySQL dump'), (None, None))
+
+def test_plain_input():
+    check_input(TEXT)
+
+def test_gzip_members():
+    half = len(TEXT) // 2
+    check_input(gzip_data(TEXT[:half]) + gzip_data(TEXT[half:]))
+
+def test_bzip2_streams():
+    half = len(TEXT) // 2
+    check_input(bz2.compress(TEXT[:half]) + bz2.compress(TEXT[half:]))
+
+def test_xz_input():
+    if lzma is None:
+        raise SkipTest("lzma is not available")
+    check_input(lzma.compress(TEXT))
+
+def test_small_reads():
+    data = bz2.compress(TEXT)
+    fileobj = StringIO(data[6:])
+    reader = DecompressingReader(fileobj, bz2.BZ2Decompressor, head=data[:6],
+                                 read_size=100, queue_size=2)
+    assert_equals(read_all(reader, 7), TEXT)
+    assert_equals(reader.compressed_offset, len(data))
+
+def test_corrupt_input():
+    data = gzip_data(TEXT)
+    data = data[:20] + 'x'*20 + data[40:]
+    reader = DecompressingReader(StringIO(data[6:]), 
+                                 detect_compression(data)[1],
+                                 head=data[:6])
+    assert_raises(CompressionError, read_all, reader)
+
+def test_truncated_input():
+    half = len(TEXT) // 2
+    for data in [gzip_data(TEXT), bz2.compress(TEXT),
+                 gzip_data(TEXT[:half]) + gzip_data(TEXT[half:])]:
+        for size in (10, len(data) // 2, len(data) - 1):
+            reader = DecompressingReader(StringIO(data[6:size]),
+                                         detect_compression(data)[1],
+                                         head=data[:6], read_size=100)
+            assert_raises(CompressionError, read_all, reader)
+
+def test_zero_padding():
+    for data in [gzip_data(TEXT), bz2.compress(TEXT)]:
+        # the padding starts within a read, or at the start of one
+        for read_size in (100, len(data) - 6):
+            reader = DecompressingReader(StringIO(data[6:] + '\0'*1000),
+                                         detect_compression(data)[1],
+                                         head=data[:6], read_size=read_size)
+            assert_equals(read_all(reader), TEXT)
+
+def test_prefetch_reader():
+    for head in ('', TEXT[:6]):
+        fileobj = StringIO(TEXT[len(head):])
+        reader = PrefetchReader(fileobj, head=head, read_size=100,
+                                queue_size=2)
+        assert_equals(read_all(reader, 7), TEXT)
+        assert_equals(reader.input_offset, len(TEXT))
+        reader.close()
+
+def test_prefetch_reader_error():
+    class BrokenFile(object):
+        def read(self, size):
+            raise IOError("disk on fire")
+    reader = PrefetchReader(BrokenFile())
+    assert_raises(IOError, reader.read, 10)
@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import textwrap
+from functools import partial
+from holland_restore.scanner import Scanner, BlockScanner, MmapScanner
+from holland_restore.node import NodeStream
+from holland_restore.index import IndexBuilder, IndexEntry, \
+                                  IndexFormatError, open_index, read_index, \
+                                  index_path, read_range
+from nose.tools import *
+
+TEXT = textwrap.dedent("""
+-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: sakila
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET NAMES utf8 */;
+
+--
+-- Table structure for table `actor`
+--
+
+DROP TABLE IF EXISTS `actor`;
+CREATE TABLE `actor` (
+    `actor_id` smallint(5) unsigned NOT NULL AUTO_INCREMENT,
+    PRIMARY KEY (`actor_id`)
+) ENGINE=InnoDB AUTO_INCREMENT=201 DEFAULT CHARSET=utf8;
+
+--
+-- Dumping data for table `actor`
+--
+
+LOCK TABLES `actor` WRITE;
+INSERT INTO `actor` VALUES (1,'PENELOPE','GUINESS','2006-02-15 10:34:33');
+UNLOCK TABLES;
+
+-- Dump completed on 2010-04-22 14:44:42
+""").lstrip()
+
+def build_index(index, text=TEXT, scanner=None):
+    if scanner is None:
+        scanner = Scanner(text.splitlines(True))
+    entries = []
+    for node in NodeStream(scanner):
+        entries.append(index.add(node))
+        for token in node.tokens:
+            pass
+    entries.append(index.finish((scanner.lineno, scanner.next_offset)))
+    return [entry for entry in entries if entry is not None]
+
+def test_index_builder():
+    entries = build_index(IndexBuilder())
+    assert_equals([(e.type, e.database, e.table) for e in entries], [
+        ('dump-header', 'sakila', None),
+        ('setup-session', 'sakila', None),
+        ('table-ddl', 'sakila', 'actor'),
+        ('table-dml', 'sakila', 'actor'),
+        ('final', 'sakila', None),
+    ])
+    # nodes cover the whole dump without gaps
+    assert_equals(entries[0].start, 0)
+    assert_equals(entries[-1].end, len(TEXT))
+    lines = TEXT.splitlines(True)
+    assert_equals(entries[-1].end_line, len(lines))
+    for previous, entry in zip(entries, entries[1:]):
+        assert_equals(previous.end, entry.start)
+        assert_equals(previous.end_line + 1, entry.start_line)
+    ddl = entries[2]
+    assert_equals(TEXT[ddl.start:ddl.end],
+                  ''.join(lines[ddl.start_line - 1:ddl.end_line]))
+    ok_(TEXT[ddl.start:ddl.end].startswith('--\n-- Table structure'))
+    assert_equals(ddl.size, ddl.end - ddl.start)
+
+def test_index_round_trip():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(TEXT)
+        entries = build_index(open_index(index_path(path), path))
+        index = read_index(index_path(path))
+        assert_equals(list(index), entries)
+        ok_(index.matches(path))
+        open(path, 'a').write('\n')
+        ok_(not index.matches(path))
+        open(index_path(path), 'w').write('not an index\n')
+        assert_raises(IndexFormatError, read_index, index_path(path))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_index_interrupted():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(TEXT)
+        writer = open_index(index_path(path), path)
+        for node in NodeStream(Scanner(TEXT.splitlines(True))):
+            writer.add(node)
+            for token in node.tokens:
+                pass
+            # nothing is written at the index's path until it is finished
+            ok_(not os.path.exists(index_path(path)))
+        writer.abort()
+        assert_equals(os.listdir(tmpdir), ['dump.sql'])
+        # an index cut off before its end record is not read
+        build_index(open_index(index_path(path), path))
+        lines = open(index_path(path)).readlines()
+        assert_equals(len(read_index(index_path(path))), len(lines) - 2)
+        for count in xrange(1, len(lines)):
+            open(index_path(path), 'w').writelines(lines[:count])
+            assert_raises(IndexFormatError, read_index, index_path(path))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_find_index():
+    from holland_restore.script.restore import build_opt_parser, find_index
+    opts, _ = build_opt_parser().parse_args([])
+    opts.engines = ['*']
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(TEXT)
+        entries = build_index(open_index(index_path(path), path))
+        assert_equals(list(find_index(path, opts)), entries)
+        # an index whose entries stop short of the end of the dump
+        writer = open_index(index_path(path), path)
+        for node in NodeStream(Scanner(TEXT.splitlines(True))):
+            writer.add(node)
+            for token in node.tokens:
+                pass
+        writer.finish((10, len(TEXT) - 1))
+        ok_(read_index(index_path(path)))
+        assert_equals(find_index(path, opts), None)
+        # an index with a gap between its entries
+        build_index(open_index(index_path(path), path))
+        lines = open(index_path(path)).readlines()
+        del lines[2]
+        lines[-1] = '#end\t%d\t%d\n' % (len(entries) - 1, len(TEXT))
+        open(index_path(path), 'w').writelines(lines)
+        assert_equals(len(read_index(index_path(path))), len(entries) - 1)
+        assert_equals(find_index(path, opts), None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_extract_indexed():
+    from StringIO import StringIO
+    from holland_restore.node import NodeFilter
+    from holland_restore.node.util import skip_tables
+    from holland_restore.script.sink import StreamSink
+    from holland_restore.script.restore import extract_indexed, stream_filter
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(TEXT)
+        build_index(open_index(index_path(path), path))
+        index = read_index(index_path(path))
+        for pattern in ['sakila.actor', 'sakila.film']:
+            expected = StringIO()
+            node_filter = NodeFilter()
+            node_filter.register('table-ddl', skip_tables([pattern]))
+            stream_filter(node_filter, Scanner(TEXT.splitlines(True)), None,
+                          StreamSink(expected))
+            result = StringIO()
+            node_filter = NodeFilter()
+            node_filter.register('table-ddl', skip_tables([pattern]))
+            extract_indexed(node_filter, index,
+                            partial(read_range, open(path, 'rb')),
+                            StreamSink(result))
+            assert_equals(result.getvalue(), expected.getvalue())
+    finally:
+        shutil.rmtree(tmpdir)
+
+# identifiers and data with multibyte UTF-8 characters, and binary data
+MULTIBYTE_TEXT = TEXT.replace('`actor`', '`acteur_\xc3\xa9t\xc3\xa9`') \
+                     .replace("'PENELOPE'", "'\xe6\x97\xa5\xe6\x9c\xac'") \
+                     .replace("'GUINESS'", "_binary '\\0\xff\xfe\x80'")
+
+def test_multibyte_offsets():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'wb').write(MULTIBYTE_TEXT)
+        factories = [
+            lambda fileobj: Scanner(MULTIBYTE_TEXT.splitlines(True)),
+            lambda fileobj: BlockScanner(fileobj, block_size=7),
+            MmapScanner,
+        ]
+        for factory in factories:
+            fileobj = open(path, 'rb')
+            scanner = factory(fileobj)
+            entries = build_index(IndexBuilder(), scanner=scanner)
+            assert_equals(entries[2].table, 'acteur_\xc3\xa9t\xc3\xa9')
+            assert_equals(entries[-1].end, os.path.getsize(path))
+            # offsets are file positions, whatever the characters in between
+            for entry in entries:
+                data = ''.join(read_range(fileobj, entry.start, entry.end))
+                assert_equals(data, MULTIBYTE_TEXT[entry.start:entry.end])
+            ok_('\\0\xff\xfe\x80' in
+                MULTIBYTE_TEXT[entries[3].start:entries[3].end])
+            fileobj.close()
+    finally:
+        shutil.rmtree(tmpdir)
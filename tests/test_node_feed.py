@@ -0,0 +1,146 @@
+import textwrap
+from holland_restore.scanner import Scanner
+from holland_restore.node import NodeStream, NodeParser
+from nose.tools import *
+
+TEXT = textwrap.dedent("""
+-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: 
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET NAMES utf8 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+
+--
+-- Current Database: `sakila`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `sakila`;
+
+USE `sakila`;
+
+--
+-- Table structure for table `actor`
+--
+
+DROP TABLE IF EXISTS `actor`;
+CREATE TABLE `actor` (
+    `actor_id` smallint(5) unsigned NOT NULL AUTO_INCREMENT,
+    PRIMARY KEY (`actor_id`)
+) ENGINE=InnoDB AUTO_INCREMENT=201 DEFAULT CHARSET=utf8;
+
+--
+-- Dumping data for table `actor`
+--
+
+LOCK TABLES `actor` WRITE;
+/*!40000 ALTER TABLE `actor` DISABLE KEYS */;
+INSERT INTO `actor` VALUES (1,'PENELOPE','GUINESS','2006-02-15 10:34:33');
+INSERT INTO `actor` VALUES (2,'NICK','WAHLBERG','2006-02-15 10:34:33');
+INSERT INTO `actor` VALUES (3,'ED','CHASE','2006-02-15 10:34:33');
+/*!40000 ALTER TABLE `actor` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Temporary table structure for view `actor_info`
+--
+
+DROP TABLE IF EXISTS `actor_info`;
+/*!50001 DROP VIEW IF EXISTS `actor_info`*/;
+/*!50001 CREATE TABLE `actor_info` (
+  `actor_id` smallint(5) unsigned
+) ENGINE=MyISAM */;
+
+--
+-- Current Database: `sakila`
+--
+
+USE `sakila`;
+
+--
+-- Final view structure for view `actor_info`
+--
+
+/*!50001 DROP TABLE IF EXISTS `actor_info`*/;
+/*!50001 DROP VIEW IF EXISTS `actor_info`*/;
+/*!50001 VIEW `actor_info` AS select 1 AS `actor_id` */;
+/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+
+-- Dump completed on 2010-04-22 14:44:42
+""").lstrip()
+
+def describe(nodes):
+    """Describe nodes, merging the parts of a table's data"""
+    result = []
+    for node in nodes:
+        text = ''.join([str(token.text) for token in node.tokens])
+        if node.type == 'table-dml':
+            key = (node.type, node.database, node.table)
+            if result and tuple(result[-1][:3]) == key:
+                result[-1][3] += text
+                continue
+        else:
+            key = (node.type, None, None)
+        result.append(list(key) + [text, node.location])
+    return result
+
+def parse(text, size, **kwargs):
+    parser = NodeParser(**kwargs)
+    nodes = []
+    for start in xrange(0, len(text), size):
+        parser.feed(text[start:start + size])
+        nodes.extend(parser)
+    parser.feed_eof()
+    nodes.extend(parser)
+    return nodes
+
+def test_node_parser():
+    expected = describe(NodeStream(Scanner(TEXT.splitlines(True))))
+    assert_equals([item[0] for item in expected], [
+        'dump-header', 'setup-session', 'database-ddl', 'table-ddl',
+        'table-dml', 'view-temp-ddl', 'view-finalize-db', 'view-ddl',
+        'final',
+    ])
+    for size in (1, 7, 100, len(TEXT)):
+        assert_equals(describe(parse(TEXT, size)), expected)
+
+def test_node_parser_table_parts():
+    nodes = parse(TEXT, len(TEXT), part_size=100)
+    parts = [node for node in nodes if node.type == 'table-dml']
+    assert_equals(len(parts), 3)
+    for node in parts:
+        assert_equals((node.database, node.table), ('sakila', 'actor'))
+    # each part starts where the previous one ended
+    for previous, node in zip(parts, parts[1:]):
+        end = previous.location[1] + sum([len(token.text)
+                                          for token in previous.tokens])
+        assert_equals(node.location[1], end)
+
+def test_node_parser_waits_for_data():
+    parser = NodeParser()
+    parser.feed(TEXT[:TEXT.index('DROP TABLE')])
+    assert_equals([node.type for node in parser],
+                  ['dump-header', 'setup-session', 'database-ddl'])
+    # the table structure is incomplete until the next comment is seen
+    parser.feed(TEXT[TEXT.index('DROP TABLE'):TEXT.index('--\n-- Dumping')])
+    assert_equals([node.type for node in parser], [])
+    assert_raises(StopIteration, iter(parser).next)
+    # rows are returned as soon as they have been fed
+    parser.feed(TEXT[TEXT.index('--\n-- Dumping'):TEXT.index('INSERT')])
+    parser.feed(TEXT[TEXT.index('INSERT'):TEXT.index('(3,')])
+    nodes = list(parser)
+    assert_equals([node.type for node in nodes], ['table-ddl', 'table-dml'])
+    assert_equals([token.symbol for token in nodes[1].tokens][-3:],
+                  ['AlterTable', 'InsertRow', 'InsertRow'])
+    parser.feed(TEXT[TEXT.index('(3,'):])
+    parser.feed_eof()
+    nodes = list(parser)
+    assert_equals(nodes[0].type, 'table-dml')
+    assert_equals(nodes[0].table, 'actor')
+    assert_equals(nodes[-1].type, 'final')
@@ -0,0 +1,164 @@
+from holland_restore.tokenizer import Token
+from holland_restore.node import NodeFilter
+from holland_restore.node.base import SkipNode
+from holland_restore.node.node_types import DatabaseDDL, TableDDL, TableDML
+from holland_restore.node.util import skip_engines
+from nose.tools import *
+
+def make_nodes(database, table, engine):
+    ddl = TableDDL([
+        Token('CreateTable',
+              'CREATE TABLE `%s` (\n  `id` int\n) ENGINE=%s;\n' %
+              (table, engine), (1, 3), 0)
+    ])
+    dml = TableDML(iter([Token('InsertRow', 'INSERT INTO `%s` VALUES (1);\n'
+                                % table, (4, 4), 0)]))
+    return ddl, dml
+
+def run(node_filter, node):
+    try:
+        return ''.join([str(chunk) for chunk in node_filter(node)])
+    except SkipNode:
+        return None
+
+def test_engine_rejection_skips_dml():
+    node_filter = NodeFilter()
+    node_filter.register('table-ddl', skip_engines(include=['innodb']))
+    run(node_filter, DatabaseDDL([Token('UseDatabase', 'USE `db`;\n',
+                                        (1, 1), 0)]))
+
+    for idx in xrange(100):
+        ddl, dml = make_nodes('db', 't%d' % idx, 'MyISAM')
+        ok_(run(node_filter, ddl) is None)
+        ok_(run(node_filter, dml) is None)
+    ok_(node_filter.is_rejected('db', 't99'))
+    # no handlers are added per rejected table
+    assert_equals(len(node_filter._rewriters['table-dml']), 1)
+
+    ddl, dml = make_nodes('db', 'kept', 'InnoDB')
+    ok_(run(node_filter, ddl) is not None)
+    assert_equals(run(node_filter, dml), 'INSERT INTO `kept` VALUES (1);\n')
+    ok_(not node_filter.is_rejected('db', 'kept'))
+
+def test_table_verdict_skips_dml():
+    """Test a name filter on table-ddl decides the table's data"""
+    from holland_restore.node.util import skip_tables
+    node_filter = NodeFilter()
+    node_filter.register('table-ddl', skip_tables(exclude=['db.t1']))
+    run(node_filter, DatabaseDDL([Token('UseDatabase', 'USE `db`;\n',
+                                        (1, 1), 0)]))
+    for table in ['t0', 't1', 't2']:
+        ddl, dml = make_nodes('db', table, 'InnoDB')
+        run(node_filter, ddl)
+        if table == 't1':
+            ok_(run(node_filter, dml) is None)
+        else:
+            assert_equals(run(node_filter, dml),
+                          'INSERT INTO `%s` VALUES (1);\n' % table)
+    ok_(node_filter.is_rejected('db', 't1'))
+    ok_(node_filter.is_accepted('db', 't2'))
+    assert_equals(len(node_filter._rewriters['table-dml']), 1)
+
+DUMP = """-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: 
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET NAMES utf8 */;
+
+"""
+
+DATABASE = """--
+-- Current Database: `%(db)s`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `%(db)s`;
+
+USE `%(db)s`;
+
+--
+-- Table structure for table `t`
+--
+
+DROP TABLE IF EXISTS `t`;
+CREATE TABLE `t` (
+    `id` int NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+--
+-- Temporary table structure for view `v`
+--
+
+DROP TABLE IF EXISTS `v`;
+/*!50001 DROP VIEW IF EXISTS `v`*/;
+/*!50001 CREATE TABLE `v` (
+    `id` int
+) ENGINE=MyISAM */;
+
+"""
+
+FINAL_VIEW = """--
+-- Current Database: `%(db)s`
+--
+
+USE `%(db)s`;
+
+--
+-- Final view structure for view `v`
+--
+
+/*!50001 DROP TABLE IF EXISTS `v`*/;
+/*!50001 DROP VIEW IF EXISTS `v`*/;
+/*!50001 VIEW `v` AS select 1 AS `id` */;
+
+"""
+
+def first_finished(node_filter, text):
+    """Filter the nodes of a dump until the filter is finished
+
+    :returns: (type, database) of the first node that was not needed
+    """
+    from holland_restore.node import NodeStream
+    for node in NodeStream(text.splitlines(True)):
+        if node_filter.finished(node):
+            return node.type, node.database
+        run(node_filter, node)
+    return None
+
+def test_finished():
+    from holland_restore.node.util import skip_databases, skip_tables
+    text = DUMP + ''.join([DATABASE % dict(db=db)
+                           for db in ('db1', 'db2', 'db3')])
+    text += ''.join([FINAL_VIEW % dict(db=db)
+                     for db in ('db1', 'db2', 'db3')])
+    text += "-- Dump completed on 2010-04-22 14:44:42\n"
+
+    node_filter = NodeFilter()
+    ok_(first_finished(node_filter, text) is None)
+
+    # the final ddl of the view accepted in db1 is still needed
+    node_filter = NodeFilter()
+    node_filter.register('database-ddl', skip_databases(include=['db1']))
+    node_filter.register('view-finalize-db', skip_databases(include=['db1']))
+    node_filter.track(['db1'])
+    assert_equals(first_finished(node_filter, text),
+                  ('view-finalize-db', 'db2'))
+    # the same filter restarts with each dump
+    assert_equals(first_finished(node_filter, text),
+                  ('view-finalize-db', 'db2'))
+
+    # no views are accepted, so db1 ends with its section
+    node_filter = NodeFilter()
+    node_filter.register('view-temp-ddl', skip_tables(include=['db1.t']))
+    node_filter.track(['db1'])
+    assert_equals(first_finished(node_filter, text), ('database-ddl', 'db2'))
+
+    node_filter = NodeFilter()
+    node_filter.track(['db2', 'db3'])
+    assert_equals(first_finished(node_filter, text), None)
+
+    # a missing database is never finished
+    node_filter = NodeFilter()
+    node_filter.track(['db1', 'missing'])
+    assert_equals(first_finished(node_filter, text), None)
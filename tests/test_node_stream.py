@@ -186,3 +186,168 @@ def test_invalid_node_steram():
     assert_equals(i.next().type, 'dump-header')
     assert_equals(i.next().type, 'setup-session')
     assert_raises(ValueError, i.next)
+
+DROPPED_TOKENS_DUMP = textwrap.dedent("""
+-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: sakila
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET NAMES utf8 */;
+
+--
+-- Position to start replication or point-in-time recovery from
+--
+
+-- CHANGE MASTER TO MASTER_LOG_FILE='bin-log.000007', MASTER_LOG_POS=296;
+
+--
+-- Dumping routines for database 'sakila'
+--
+/*!50003 DROP PROCEDURE IF EXISTS `p` */;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50020 DEFINER=`root`@`localhost`*/ /*!50003 PROCEDURE `p`()
+BEGIN
+SELECT 1;
+END */;;
+DELIMITER ;
+
+-- Dump completed on 2010-04-22 14:44:42
+""").lstrip()
+
+def node_texts(text):
+    return [(node.type, ''.join([str(token.text) for token in node.tokens]))
+            for node in NodeStream(text.splitlines(True))]
+
+def test_comment_block_without_blank_line():
+    """Test the leading '--' of a comment block followed by a statement is
+    kept
+    """
+    texts = dict(node_texts(DROPPED_TOKENS_DUMP))
+    ok_(texts['database-routines'].startswith(
+        "--\n-- Dumping routines for database 'sakila'\n--\n"))
+
+def test_change_master_kept():
+    """Test the CHANGE MASTER line is kept in the replication node"""
+    texts = dict(node_texts(DROPPED_TOKENS_DUMP))
+    ok_("-- CHANGE MASTER TO MASTER_LOG_FILE='bin-log.000007', "
+        "MASTER_LOG_POS=296;\n\n" in texts['replication'])
+
+def test_first_routine_kept():
+    """Test the statement starting a routines section is kept"""
+    texts = dict(node_texts(DROPPED_TOKENS_DUMP))
+    ok_("--\n/*!50003 DROP PROCEDURE IF EXISTS `p` */;\nDELIMITER ;;\n" in
+        texts['database-routines'])
+    assert_equals(''.join([text for _, text in
+                           node_texts(DROPPED_TOKENS_DUMP)]),
+                  DROPPED_TOKENS_DUMP)
+
+def test_mmap_node_stream():
+    """Test nodes parsed from a memory-mapped file match the source text"""
+    import tempfile
+    from holland_restore.scanner import MmapScanner
+    text = textwrap.dedent("""
+    -- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+    --
+    -- Host: localhost    Database: sakila
+    -- ------------------------------------------------------
+    -- Server version       5.1.42-rs-log
+
+    /*!40101 SET NAMES utf8 */;
+
+    --
+    -- Table structure for table `actor`
+    --
+
+    DROP TABLE IF EXISTS `actor`;
+    CREATE TABLE `actor` (
+        `actor_id` smallint(5) unsigned NOT NULL AUTO_INCREMENT,
+        PRIMARY KEY (`actor_id`)
+    ) ENGINE=InnoDB AUTO_INCREMENT=201 DEFAULT CHARSET=utf8;
+
+    --
+    -- Dumping data for table `actor`
+    --
+
+    LOCK TABLES `actor` WRITE;
+    INSERT INTO `actor` VALUES (1,'PENELOPE','GUINESS','2006-02-15 10:34:33');
+    UNLOCK TABLES;
+
+    -- Dump completed on 2010-04-22 14:44:42
+    """).lstrip()
+    fileobj = tempfile.TemporaryFile()
+    fileobj.write(text)
+    fileobj.flush()
+
+    result = []
+    types = []
+    for node in NodeStream(MmapScanner(fileobj)):
+        types.append(node.type)
+        result.extend([str(token.text) for token in node.tokens])
+    assert_equals(types, ['dump-header', 'setup-session', 'table-ddl',
+                          'table-dml', 'final'])
+    assert_equals("".join(result), text)
+
+def test_node_metadata_cached():
+    """Test node names are parsed once and may be assigned"""
+    from holland_restore.tokenizer import Token
+    from holland_restore.node.node_types import TableDDL, SetupSessionNode
+    node = TableDDL([Token('SqlComment',
+                           '-- Table structure for table `actor`\n',
+                           (1, 1), 0)])
+    assert_equals(node.table, 'actor')
+    node.tokens = []
+    assert_equals(node.table, 'actor')
+    node.database = 'sakila'
+    assert_equals(node.database, 'sakila')
+    assert_raises(AttributeError, getattr, SetupSessionNode([]), 'database')
+    assert_raises(AttributeError, setattr, node, 'engine', 'innodb')
+
+def test_unread_table_data():
+    """Test unread table data is skipped up to the next node"""
+    from holland_restore.node.node_types import TableDML
+    text = textwrap.dedent("""
+    --
+    -- Dumping data for table `actor`
+    --
+
+    LOCK TABLES `actor` WRITE;
+    INSERT INTO `actor` VALUES (1,'PENELOPE','GUINESS','2006-02-15 10:34:33');
+    INSERT INTO `actor` VALUES (2,'NICK','WAHLBERG','2006-02-15 04:34:33');
+    UNLOCK TABLES;
+    /*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+    DELIMITER ;;
+    /*!50003 CREATE*/ /*!50003 TRIGGER `trg` AFTER INSERT ON `actor` FOR EACH ROW BEGIN
+    --
+    -- a comment inside the trigger
+    --
+        INSERT INTO x VALUES (1);
+    END */;;
+    DELIMITER ;
+    /*!50003 SET character_set_client  = @saved_cs_client */ ;
+
+    --
+    -- Table structure for table `film`
+    --
+
+    DROP TABLE IF EXISTS `film`;
+    CREATE TABLE `film` (
+        `film_id` smallint(5) unsigned NOT NULL AUTO_INCREMENT,
+        PRIMARY KEY (`film_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+    -- Dump completed on 2010-04-22 14:44:42
+    """).lstrip()
+    lines = text.splitlines(True)
+    for read in (0, 2, 4):
+        stream = iter(NodeStream(lines, 'sakila', header=False))
+        node = stream.next()
+        ok_(isinstance(node, TableDML))
+        for _ in xrange(read):
+            node.tokens.next()
+        node = stream.next()
+        assert_equals(node.type, 'table-ddl')
+        assert_equals(node.table, 'film')
+        assert_equals(node.location,
+                      (20, len("".join(lines[:19]))))
@@ -0,0 +1,197 @@
+from holland_restore.tokenizer import Token
+from holland_restore.node.util import iter_insert_rows, split_insert
+from nose.tools import *
+
+INSERT = ("INSERT INTO `t` VALUES (1,'a(b)c',NULL),(2,'it\\'s, ok\\\\',0x41),"
+          "(3,'x''y','))'),(4,'',''),(5,'\\\\\\'',1.5);\n")
+
+ROWS = [
+    "(1,'a(b)c',NULL)",
+    "(2,'it\\'s, ok\\\\',0x41)",
+    "(3,'x''y','))')",
+    "(4,'','')",
+    "(5,'\\\\\\'',1.5)",
+]
+
+def test_insert_rows():
+    values = INSERT[len('INSERT INTO `t` VALUES '):]
+    assert_equals(list(iter_insert_rows([values])), ROWS)
+
+def test_insert_rows_chunked():
+    values = INSERT[len('INSERT INTO `t` VALUES '):]
+    for size in xrange(1, len(values)):
+        chunks = [values[idx:idx + size]
+                  for idx in xrange(0, len(values), size)]
+        assert_equals(list(iter_insert_rows(chunks)), ROWS)
+
+def test_split_max_rows():
+    token = Token('InsertRow', INSERT, (1, 1), 0)
+    tokens = list(split_insert(token, max_rows=2))
+    assert_equals([t.text for t in tokens], [
+        'INSERT INTO `t` VALUES %s;\n' % ','.join(ROWS[0:2]),
+        'INSERT INTO `t` VALUES %s;\n' % ','.join(ROWS[2:4]),
+        'INSERT INTO `t` VALUES %s;\n' % ','.join(ROWS[4:]),
+    ])
+    assert_equals([t.offset for t in tokens], [-1, -1, -1])
+
+def test_split_max_bytes():
+    token = Token('InsertRow', INSERT, (1, 1), 0)
+    tokens = list(split_insert(token, max_bytes=50))
+    assert_equals(len(tokens), 4)
+    rows = []
+    for token in tokens:
+        ok_(len(token.text) <= 50)
+        ok_(token.text.startswith('INSERT INTO `t` VALUES ('))
+        rows.extend(iter_insert_rows([token.text[23:]]))
+    assert_equals(rows, ROWS)
+
+TRIGGER_DML = """LOCK TABLES `t` WRITE;
+INSERT INTO `t` VALUES (1),(2);
+UNLOCK TABLES;
+/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET sql_mode              = '' */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`localhost`*/ /*!50003 TRIGGER `trg` AFTER INSERT ON `t` FOR EACH ROW BEGIN
+--
+-- a comment
+--
+    INSERT INTO x VALUES (1);
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+
+"""
+
+def test_skip_triggers():
+    """Test skip_triggers drops triggers but keeps the table data"""
+    from holland_restore.tokenizer import Tokenizer, RULES
+    from holland_restore.node.util import skip_triggers
+    from holland_restore.node.node_types import TableDML
+    tokens = list(Tokenizer(TRIGGER_DML.splitlines(True), RULES))
+    node = skip_triggers(None, TableDML(tokens))
+    result = "".join([str(token.text) for token in node.tokens])
+    assert_equals(result, "LOCK TABLES `t` WRITE;\n"
+                          "INSERT INTO `t` VALUES (1),(2);\n"
+                          "UNLOCK TABLES;\n"
+                          "\n")
+
+def test_restore_session():
+    """Test the saved session variables are restored, time zone first"""
+    from holland_restore.node.util import restore_session
+    from holland_restore.node.node_types import SetupSessionNode
+    setup = SetupSessionNode([
+        Token('SetVariable', text, (), 0) for text in [
+            "/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;\n",
+            "/*!40101 SET NAMES utf8 */;\n",
+            "/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;\n",
+            "/*!40103 SET TIME_ZONE='+00:00' */;\n",
+            "/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;\n",
+        ]
+    ])
+    node = restore_session(setup)
+    assert_equals(node.type, 'restore-session')
+    assert_equals(str(node),
+                  "/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;\n"
+                  "\n"
+                  "/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;\n"
+                  "/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;\n"
+                  "\n")
+
+RENAME_DUMP = """-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: sakila
+-- ------------------------------------------------------
+-- Server version       5.1.42-rs-log
+
+/*!40101 SET NAMES utf8 */;
+
+--
+-- Current Database: `sakila`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `sakila` /*!40100 DEFAULT CHARACTER SET latin1 */;
+
+USE `sakila`;
+
+--
+-- Table structure for table `sakila`
+--
+
+DROP TABLE IF EXISTS `sakila`;
+CREATE TABLE `sakila` (
+  `id` int NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+--
+-- Dumping data for table `sakila`
+--
+
+LOCK TABLES `sakila` WRITE;
+INSERT INTO `sakila` VALUES (1,'USE `sakila`;','`sakila`.`t`');
+UNLOCK TABLES;
+
+--
+-- Temporary table structure for view `v`
+--
+
+DROP TABLE IF EXISTS `v`;
+/*!50001 DROP VIEW IF EXISTS `v`*/;
+/*!50001 CREATE TABLE `v` (
+  `id` int
+) ENGINE=MyISAM */;
+
+--
+-- Dumping routines for database 'sakila'
+--
+
+--
+-- Current Database: `sakila`
+--
+
+USE `sakila`;
+
+--
+-- Final view structure for view `v`
+--
+
+/*!50001 DROP TABLE IF EXISTS `v`*/;
+/*!50001 DROP VIEW IF EXISTS `v`*/;
+/*!50001 VIEW `v` AS select `sakila`.`id` AS `id` from `sakila` join `other`.`t` */;
+
+-- Dump completed on 2010-04-22 14:44:42
+"""
+
+def test_rename_databases():
+    """Test database names are rewritten everywhere but in table data"""
+    from holland_restore.node import NodeStream, NodeFilter
+    from holland_restore.node.util import rename_databases
+    node_filter = NodeFilter()
+    handler = rename_databases({'sakila': 'copy', 'other': 'other2'})
+    for node_type in ('dump-header', 'database-ddl', 'view-finalize-db',
+                      'table-ddl', 'table-dml', 'view-temp-ddl', 'view-ddl',
+                      'database-routines'):
+        node_filter.register(node_type, handler)
+    result = []
+    databases = []
+    for node in NodeStream(RENAME_DUMP.splitlines(True)):
+        result.extend([str(chunk) for chunk in node_filter(node)])
+        if node.type in ('table-ddl', 'table-dml', 'view-ddl'):
+            databases.append((node.type, node.database))
+    expected = RENAME_DUMP
+    for old, new in [
+        ('Database: sakila', 'Database: copy'),
+        ('Current Database: `sakila`', 'Current Database: `copy`'),
+        ('EXISTS*/ `sakila`', 'EXISTS*/ `copy`'),
+        ('USE `sakila`;\n', 'USE `copy`;\n'),
+        ("database 'sakila'", "database 'copy'"),
+        ('join `other`.`t`', 'join `other2`.`t`'),
+    ]:
+        expected = expected.replace(old, new)
+    # a column qualified by the table named like the database, and the
+    # same names in the table data, are left alone
+    ok_('select `sakila`.`id`' in expected)
+    ok_("VALUES (1,'USE `sakila`;','`sakila`.`t`');" in expected)
+    assert_equals(''.join(result), expected)
+    assert_equals(databases, [('table-ddl', 'copy'), ('table-dml', 'copy'),
+                              ('view-ddl', 'copy')])
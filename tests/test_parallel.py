@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import textwrap
+from StringIO import StringIO
+from holland_restore.scanner import Scanner
+from holland_restore.node import NodeFilter
+from holland_restore.node.util import skip_tables, skip_engines
+from holland_restore.index import IndexWriter
+from holland_restore.script.sink import StreamSink
+from holland_restore.script.restore import stream_filter
+from holland_restore.script.parallel import parallel_filter
+from nose.tools import *
+
+HEADER = ("-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)\n"
+          "--\n"
+          "-- Host: localhost    Database: \n"
+          "-- ------------------------------------------------------\n"
+          "-- Server version       5.1.42-rs-log\n"
+          "\n"
+          "/*!40101 SET NAMES utf8 */;\n"
+          "\n")
+
+DATABASE = textwrap.dedent("""
+--
+-- Current Database: `%(db)s`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `%(db)s`;
+
+USE `%(db)s`;
+
+""").lstrip()
+
+TABLE = textwrap.dedent("""
+--
+-- Table structure for table `%(table)s`
+--
+
+DROP TABLE IF EXISTS `%(table)s`;
+CREATE TABLE `%(table)s` (
+    `id` int NOT NULL
+) ENGINE=%(engine)s DEFAULT CHARSET=utf8;
+
+--
+-- Dumping data for table `%(table)s`
+--
+
+LOCK TABLES `%(table)s` WRITE;
+INSERT INTO `%(table)s` VALUES (1),(2);
+INSERT INTO `%(table)s` VALUES (3);
+UNLOCK TABLES;
+
+""").lstrip()
+
+TEMP_VIEW = textwrap.dedent("""
+--
+-- Temporary table structure for view `%(view)s`
+--
+
+DROP TABLE IF EXISTS `%(view)s`;
+/*!50001 DROP VIEW IF EXISTS `%(view)s`*/;
+/*!50001 CREATE TABLE `%(view)s` (
+    `id` int
+) ENGINE=%(engine)s */;
+
+""").lstrip()
+
+FINAL_VIEW = textwrap.dedent("""
+--
+-- Current Database: `%(db)s`
+--
+
+USE `%(db)s`;
+
+--
+-- Final view structure for view `%(view)s`
+--
+
+/*!50001 DROP TABLE IF EXISTS `%(view)s`*/;
+/*!50001 DROP VIEW IF EXISTS `%(view)s`*/;
+/*!50001 VIEW `%(view)s` AS select 1 AS `id` */;
+
+""").lstrip()
+
+FOOTER = "-- Dump completed on 2010-04-22 14:44:42\n"
+
+def make_dump():
+    parts = [HEADER]
+    for db in ('db1', 'db2'):
+        parts.append(DATABASE % dict(db=db))
+        for idx in xrange(10):
+            engine = ('InnoDB', 'MyISAM')[idx % 2]
+            parts.append(TABLE % dict(table='t%d' % idx, engine=engine))
+            if idx % 3 == 0:
+                parts.append(TEMP_VIEW % dict(view='v%d' % idx,
+                                              engine=engine))
+    for db in ('db1', 'db2'):
+        parts.append(FINAL_VIEW % dict(db=db, view='v0'))
+    parts.append(FOOTER)
+    return ''.join(parts)
+
+FILTERS = [
+    ('table-ddl', None),
+    ('table-ddl', skip_tables(include=['db1.*'])),
+    ('table-ddl', skip_tables(exclude=['db2.t3', 'db1.v0'])),
+    ('view-temp-ddl', skip_tables(exclude=['db2.v0'])),
+    ('table-ddl', skip_engines(include=['innodb'])),
+    ('view-temp-ddl', skip_engines(exclude=['innodb'])),
+]
+
+def make_filter(node_type, handler):
+    node_filter = NodeFilter()
+    if handler is not None:
+        node_filter.register(node_type, handler)
+    return node_filter
+
+def test_parallel_filter():
+    text = make_dump()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(text)
+        for node_type, handler in FILTERS:
+            expected = StringIO()
+            expected_index = StringIO()
+            expected_index.close = lambda: None
+            stream_filter(make_filter(node_type, handler),
+                          Scanner(text.splitlines(True)), None,
+                          StreamSink(expected),
+                          IndexWriter(expected_index, 0, 0))
+            for section_size in (1, 2000, len(text)):
+                result = StringIO()
+                result_index = StringIO()
+                result_index.close = lambda: None
+                parallel_filter(make_filter(node_type, handler), path, 3,
+                                StreamSink(result),
+                                IndexWriter(result_index, 0, 0),
+                                section_size=section_size)
+                assert_equals(result.getvalue(), expected.getvalue())
+                assert_equals(result_index.getvalue(),
+                              expected_index.getvalue())
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,82 @@
+import os
+import re
+import gzip
+import shutil
+import tempfile
+from holland_restore.benchmark.generate import DumpShape, generate_dump
+from holland_restore.script.restore import main
+from nose.tools import *
+
+SHAPE = DumpShape(databases=2, tables=3, rows=20, insert_size=300, views=1,
+                  routines=1, triggers=1, seed=1)
+
+def write_dump(tmpdir, name='dump.sql'):
+    """Generate a dump in tmpdir, gzipped if name ends with .gz"""
+    path = os.path.join(tmpdir, name)
+    if name.endswith('.gz'):
+        fileobj = gzip.open(path, 'wb')
+    else:
+        fileobj = open(path, 'wb')
+    try:
+        generate_dump(fileobj, SHAPE)
+    finally:
+        fileobj.close()
+    return path
+
+def restore(args, tmpdir, dump=None):
+    """Run mysqlrestore on a dump and return its output"""
+    if dump is None:
+        dump = write_dump(tmpdir)
+    output = os.path.join(tmpdir, 'output.sql')
+    assert_equals(main(args + ['--sink-command', 'cat > "%s"' % output,
+                               dump]), 0)
+    return open(output).read()
+
+def created_tables(text):
+    """List the db.tbl names of the tables created in text"""
+    tables = []
+    database = None
+    for line in text.splitlines():
+        match = re.match(r'USE `(\w+)`;', line)
+        if match:
+            database = match.group(1)
+        match = re.match(r'CREATE TABLE `(\w+)`', line)
+        if match:
+            tables.append('%s.%s' % (database, match.group(1)))
+    return tables
+
+def test_exclude_table():
+    """Test --exclude-table keeps every other table"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        text = restore(['--exclude-table', 'db0.t1'], tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+    assert_equals(created_tables(text),
+                  ['db0.t0', 'db0.t2', 'db1.t0', 'db1.t1', 'db1.t2'])
+    ok_("Dumping routines for database 'db1'" in text)
+
+def test_table_tracking():
+    """Test --table stops after the requested database"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        text = restore(['--table', 'db0.t1'], tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+    assert_equals(created_tables(text), ['db0.t1'])
+    ok_("SET TIME_ZONE=@OLD_TIME_ZONE" in text)
+
+def test_indexed_output():
+    """Test extracting through an index writes what parsing writes"""
+    for name in ['dump.sql', 'dump.sql.gz']:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dump = write_dump(tmpdir, name)
+            restore(['--write-index'], tmpdir, dump)
+            for args in [['--table', 'db0.t1'], ['--database', 'db0'],
+                         ['--database', 'db1'], ['--exclude-table', 'db0.t1']]:
+                parsed = restore(args + ['--no-index'], tmpdir, dump)
+                indexed = restore(args, tmpdir, dump)
+                assert_equals(indexed, parsed)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -1,7 +1,7 @@
 """Unit tests for holland_restore.scanner"""
 
 from holland_restore.scanner import Scanner
-from nose.tools import assert_equals, assert_raises
+from nose.tools import assert_equals, assert_raises, ok_
 
 def test_scanner_pushback():
     """Test scanner push_back"""
@@ -68,3 +68,213 @@ def test_seekable_source():
         sought_atom = data.read(len(atom))
         assert_equals(sought_atom, atom)
         assert_equals(linenum, i + 1)
+
+def test_scanner_pushback_limit():
+    """Test that pushback is bounded"""
+    scanner = Scanner(["foo\n", "bar\n"], pushback_limit=1)
+    line = scanner.next()
+    scanner.push_back(line)
+    assert_raises(ValueError, scanner.push_back, line)
+
+def test_block_scanner():
+    """Test that BlockScanner splits lines across block boundaries"""
+    from StringIO import StringIO
+    from holland_restore.scanner import BlockScanner
+    lines = [
+        "foo\n",
+        "a much longer line than the block size\n",
+        "\n",
+        "bar\n",
+        "no trailing newline",
+    ]
+    scanner = BlockScanner(StringIO("".join(lines)), block_size=8)
+    results = []
+    for atom in scanner:
+        results.append((atom, scanner.position))
+    assert_equals([atom for atom, _ in results], lines)
+    offset = 0
+    for i, (atom, position) in enumerate(results):
+        assert_equals(position, (i + 1, offset))
+        offset += len(atom)
+
+def test_block_scanner_pushback():
+    """Test BlockScanner push_back keeps the position contract"""
+    from StringIO import StringIO
+    from holland_restore.scanner import BlockScanner
+    scanner = BlockScanner(StringIO("foo\nbar\nbaz\n"), block_size=5)
+    scanner.next()
+    line = scanner.next()
+    assert_equals(scanner.position, (2, 4))
+    scanner.push_back(line)
+    assert_equals(scanner.position, (1, 0))
+    assert_equals(scanner.next(), "bar\n")
+    assert_equals(scanner.next(), "baz\n")
+    assert_equals(scanner.position, (3, 8))
+    assert_raises(StopIteration, scanner.next)
+
+def test_block_scanner_chunked_line():
+    """Test BlockScanner returns oversized lines in chunks"""
+    from StringIO import StringIO
+    from holland_restore.scanner import BlockScanner, ChunkedLine
+    long_line = "INSERT " + "x"*100 + "\n"
+    data = "foo\n" + long_line + "bar\n" + long_line + "baz\n"
+    scanner = BlockScanner(StringIO(data), block_size=8, max_line_size=32)
+    assert_equals(scanner.next(), "foo\n")
+    line = scanner.next()
+    ok_(isinstance(line, ChunkedLine))
+    ok_(line.startswith("INSERT"))
+    assert_equals(line[:1], "I")
+    chunks = list(line.chunks())
+    ok_(max([len(chunk) for chunk in chunks]) <= 40)
+    assert_equals("".join(chunks), long_line)
+    assert_raises(ValueError, list, line.chunks())
+    assert_equals(len(line), len(long_line))
+    assert_equals(scanner.next(), "bar\n")
+    assert_equals(scanner.position, (3, 4 + len(long_line)))
+    # an unread chunked line is kept when the scanner moves on
+    line = scanner.next()
+    ok_(isinstance(line, ChunkedLine))
+    assert_equals(scanner.next(), "baz\n")
+    assert_equals(str(line), long_line)
+    assert_equals(scanner.position, (5, len(data) - 4))
+    assert_raises(StopIteration, scanner.next)
+
+def test_mmap_scanner():
+    """Test MmapScanner returns spans with the same positions as Scanner"""
+    import tempfile
+    from holland_restore.scanner import MmapScanner, Span
+    lines = [
+        "foo\n",
+        "\n",
+        "bar baz\n",
+        "no trailing newline",
+    ]
+    fileobj = tempfile.TemporaryFile()
+    fileobj.write("".join(lines))
+    fileobj.flush()
+    scanner = MmapScanner(fileobj)
+    offset = 0
+    for i, atom in enumerate(scanner):
+        ok_(isinstance(atom, Span))
+        assert_equals(str(atom), lines[i])
+        assert_equals(len(atom), len(lines[i]))
+        assert_equals(scanner.position, (i + 1, offset))
+        offset += len(atom)
+    assert_equals(i, len(lines) - 1)
+    scanner.close()
+
+def test_span():
+    """Test the string operations supported by Span"""
+    from holland_restore.scanner import Span
+    data = "xxCREATE TABLE `foo` (\nyy"
+    span = Span(data, 2, 23)
+    assert_equals(str(span), "CREATE TABLE `foo` (\n")
+    ok_(span.startswith("CREATE TABLE"))
+    ok_(not span.startswith("DROP"))
+    ok_(span.endswith("(\n"))
+    ok_(not span.endswith("yy"))
+    ok_("`foo`" in span)
+    ok_("xx" not in span)
+    assert_equals(span[:1], "C")
+    assert_equals(span[-2], "(")
+    # stripping narrows the span instead of copying its text
+    for method in ('strip', 'lstrip', 'rstrip'):
+        for text, chars in [(" \t/*!40101 SET x */;\r\n", None),
+                            ("/*!40101 SET x */;\n", '/*!0123456789 '),
+                            ("  \n", None), ("", None)]:
+            stripped = getattr(Span("xx" + text + "yy", 2, 2 + len(text)),
+                               method)(chars)
+            ok_(isinstance(stripped, Span))
+            assert_equals(str(stripped), getattr(text, method)(chars))
+    ok_(span.rstrip().endswith("("))
+    assert_equals(str(bytearray(span.view())), str(span))
+
+SKIP_LINES = [
+    "INSERT INTO `t` VALUES (1);\n",
+    "INSERT INTO `t` VALUES (2),(3);\n",
+    "x--not a comment\n",
+    "\n",
+    "-- a comment\n",
+    "INSERT INTO `t` VALUES (4);\n",
+    "DELIMITER ;;\n",
+    "INSERT INTO `t` VALUES (5);\n",
+    "no trailing newline",
+]
+
+def check_skip_until(make_scanner, lines):
+    """Skip to each line in turn and compare with reading line by line"""
+    prefixes = ('--', 'DELIMITER ;;')
+    for first in xrange(len(lines)):
+        scanner = make_scanner(lines)
+        for _ in xrange(first):
+            scanner.next()
+        scanner.skip_until(prefixes)
+        expected = first
+        while expected < len(lines) and \
+              not lines[expected].startswith(prefixes):
+            expected += 1
+        offset = len("".join(lines[:expected]))
+        assert_equals(scanner.lineno, expected)
+        assert_equals(scanner.next_offset, offset)
+        if expected == len(lines):
+            assert_raises(StopIteration, scanner.next)
+        else:
+            assert_equals(str(scanner.next()), lines[expected])
+            assert_equals(scanner.position, (expected + 1, offset))
+
+def test_scanner_skip_until():
+    """Test skip_until leaves the next matching line to be read"""
+    check_skip_until(Scanner, SKIP_LINES)
+    check_skip_until(Scanner, SKIP_LINES[:-1])
+
+def test_scanner_skip_until_pushback():
+    """Test skip_until checks lines pushed back first"""
+    scanner = Scanner(["foo\n", "-- bar\n", "baz\n"])
+    scanner.push_back(scanner.next())
+    scanner.skip_until(('--',))
+    assert_equals(scanner.next(), "-- bar\n")
+    assert_equals(scanner.position, (2, 4))
+
+def test_block_scanner_skip_until():
+    """Test BlockScanner skip_until across block boundaries"""
+    from StringIO import StringIO
+    from holland_restore.scanner import BlockScanner
+    for block_size in (1, 3, 8, 13, 1024):
+        def make_scanner(lines):
+            return BlockScanner(StringIO("".join(lines)),
+                                block_size=block_size, max_line_size=16)
+        check_skip_until(make_scanner, SKIP_LINES)
+        check_skip_until(make_scanner, SKIP_LINES[:-1])
+
+def test_mmap_scanner_skip_until():
+    """Test MmapScanner skip_until counts the lines it skips"""
+    import tempfile
+    from holland_restore.scanner import MmapScanner
+    def make_scanner(lines):
+        fileobj = tempfile.TemporaryFile()
+        fileobj.write("".join(lines))
+        fileobj.flush()
+        return MmapScanner(fileobj)
+    check_skip_until(make_scanner, SKIP_LINES)
+    check_skip_until(make_scanner, SKIP_LINES[:-1])
+
+def test_feed_scanner():
+    from holland_restore.scanner import FeedScanner, NeedData
+    scanner = FeedScanner()
+    assert_raises(NeedData, scanner.next)
+    scanner.feed("foo\nba")
+    assert_equals(scanner.next(), "foo\n")
+    scanner.commit()
+    assert_raises(NeedData, scanner.next)
+    ok_(not scanner.ready())
+    scanner.feed("r\nbaz")
+    ok_(scanner.ready())
+    assert_equals(scanner.next(), "bar\n")
+    assert_raises(NeedData, scanner.next)
+    scanner.rewind()
+    assert_equals(scanner.position, (1, 0))
+    assert_equals(scanner.next(), "bar\n")
+    scanner.feed_eof()
+    assert_equals(scanner.next(), "baz")
+    assert_equals((scanner.lineno, scanner.next_offset), (3, 11))
+    assert_raises(StopIteration, scanner.next)
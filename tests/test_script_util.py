@@ -0,0 +1,40 @@
+from holland_restore.script.util import InputProgress
+from nose.tools import *
+
+class FakeScanner(object):
+    lineno = 0
+    next_offset = 0
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_input_progress():
+    """Test progress is measured against the size of the input"""
+    scanner = FakeScanner()
+    clock = FakeClock()
+    progress = InputProgress(scanner, 4096, clock=clock)
+    progress.update('`db`.`t` (data)')
+    scanner.lineno = 10
+    scanner.next_offset = 1024
+    clock.now += 2
+    percent, message = progress.poll()
+    assert_equals(percent, 25)
+    ok_('Processing: `db`.`t` (data)' in message)
+    ok_('Line: 10' in message)
+    ok_('1.00KB of 4.00KB (512.00B per second)' in message)
+    ok_('Remaining: 6.00 seconds' in message)
+
+def test_input_progress_position():
+    """Test progress of input of unknown size read through a callable"""
+    clock = FakeClock()
+    progress = InputProgress(FakeScanner(), position=lambda: 2048,
+                             clock=clock)
+    clock.now += 1
+    percent, message = progress.poll()
+    assert_equals(percent, 0)
+    ok_('2.00KB (2.00KB per second)' in message)
+    ok_('Remaining' not in message)
@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from holland_restore.script.sink import StreamSink, ParallelSink, \
+                                       SinkProcess, ThreadedSink, SinkError
+from nose.tools import *
+
+class FakeNode(object):
+    def __init__(self, type, database=None):
+        self.type = type
+        self.database = database
+
+NODES = [
+    (FakeNode('setup-session'), 'SET NAMES utf8;\n'),
+    (FakeNode('database-ddl', 'db'), 'CREATE DATABASE `db`;\nUSE `db`;\n'),
+    (FakeNode('table-ddl', 'db'), 'CREATE TABLE `a` (id int);\n'),
+    (FakeNode('table-dml', 'db'), 'INSERT INTO `a` VALUES (1);\n'),
+    (FakeNode('table-ddl', 'db'), 'CREATE TABLE `b` (id int);\n'),
+    (FakeNode('table-dml', 'db'), 'INSERT INTO `b` VALUES (2);\n'),
+    (FakeNode('table-dml', 'db'), ''),
+    (FakeNode('view-ddl', 'db'), 'CREATE VIEW `c` AS SELECT 1;\n'),
+]
+
+def test_stream_sink():
+    stream = StringIO()
+    sink = StreamSink(stream)
+    for node, text in NODES:
+        sink.write_node(node, [text])
+    sink.close()
+    assert_equals(stream.getvalue(), ''.join([text for _, text in NODES]))
+
+# echo the sync statements of the serial process, as mysql prints the
+# result of a SELECT
+COMMAND = ('tee "$(mktemp %s/sink.XXXXXX)" | '
+           'sed -un "/holland_restore sync/p"')
+
+def test_parallel_sink():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sink = ParallelSink(COMMAND % tmpdir, workers=2, batch_size=10,
+                            queue_size=1)
+        for node, text in NODES:
+            sink.write_node(node, iter(text.splitlines(True)))
+        sink.close()
+        outputs = [open(os.path.join(tmpdir, name)).read()
+                   for name in os.listdir(tmpdir)]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    data = [text for text in outputs if 'INSERT' in text]
+    serial = [text for text in outputs if 'INSERT' not in text]
+    # a single serial process, synced before each table's data is queued
+    assert_equals(serial, [
+        'SET NAMES utf8;\nCREATE DATABASE `db`;\nUSE `db`;\n'
+        'CREATE TABLE `a` (id int);\n'
+        "SELECT 'holland_restore sync 1' AS sync;\n"
+        'CREATE TABLE `b` (id int);\n'
+        "SELECT 'holland_restore sync 2' AS sync;\n"
+        'CREATE VIEW `c` AS SELECT 1;\n',
+    ])
+    loaded = ''.join(data)
+    for insert in ['INSERT INTO `a` VALUES (1);\n',
+                   'INSERT INTO `b` VALUES (2);\n']:
+        ok_('SET NAMES utf8;\nUSE `db`;\n' + insert in loaded)
+
+def test_parallel_sink_failure():
+    for command in ['sed -un "/holland_restore sync/p"; exit 1', 'exit 1']:
+        def restore():
+            sink = ParallelSink(command, workers=1)
+            for node, text in NODES:
+                sink.write_node(node, iter([text]))
+            sink.close()
+        assert_raises(SinkError, restore)
+
+def test_parallel_sink_no_sync():
+    """Test a sink command that never prints sync results fails instead
+    of blocking the restore
+    """
+    def restore():
+        sink = ParallelSink('cat > /dev/null', workers=2, sync_timeout=0.5)
+        for node, text in NODES:
+            sink.write_node(node, iter([text]))
+        sink.close()
+    assert_raises(SinkError, restore)
+
+def test_sink_process():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sink = StreamSink(SinkProcess(COMMAND % tmpdir), close_stream=True)
+        for node, text in NODES:
+            sink.write_node(node, [text])
+        sink.close()
+        outputs = [open(os.path.join(tmpdir, name)).read()
+                   for name in os.listdir(tmpdir)]
+    finally:
+        shutil.rmtree(tmpdir)
+    assert_equals(outputs, [''.join([text for _, text in NODES])])
+    sink = StreamSink(SinkProcess('exit 3'), close_stream=True)
+    assert_raises(SinkError, sink.close)
+
+def test_stream_sink_ranges():
+    from holland_restore.scanner import MappedFile, Span
+    from holland_restore.script.sink import open_output
+    tmpdir = tempfile.mkdtemp()
+    try:
+        text = ''.join(['INSERT INTO `a` VALUES (%d);\n' % idx
+                        for idx in xrange(10000)])
+        path = os.path.join(tmpdir, 'dump.sql')
+        open(path, 'w').write(text)
+        source = MappedFile(open(path, 'rb'))
+        lines = []
+        offset = 0
+        for line in text.splitlines(True):
+            lines.append(Span(source, offset, offset + len(line)))
+            offset += len(line)
+        node = FakeNode('table-dml', 'db')
+        chunks = ['-- start\n'] + lines[:5000] + ['-- middle\n'] + lines[5000:]
+        expected = ''.join(['-- start\n'] +
+                           [str(span) for span in lines[:5000]] +
+                           ['-- middle\n'] +
+                           [str(span) for span in lines[5000:]])
+        for passthrough_size in (1, 1024*1024):
+            # copied with sendfile to a file and written to a StringIO
+            output = os.path.join(tmpdir, 'out.sql')
+            stream = open(output, 'wb')
+            sink = StreamSink(open_output(stream),
+                              passthrough_size=passthrough_size)
+            sink.write_node(node, chunks)
+            sink.close()
+            stream.close()
+            assert_equals(open(output).read(), expected)
+
+            stream = StringIO()
+            sink = StreamSink(stream, passthrough_size=passthrough_size)
+            sink.write_node(node, chunks)
+            sink.close()
+            assert_equals(stream.getvalue(), expected)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_threaded_sink():
+    stream = StringIO()
+    sink = ThreadedSink(StreamSink(stream), batch_size=10, queue_size=2)
+    for node, text in NODES:
+        sink.write_node(node, iter(text.splitlines(True)))
+    sink.close()
+    expected = ''.join([text for _, text in NODES])
+    assert_equals(stream.getvalue(), expected)
+    assert_equals(sink.bytes_written, len(expected))
+
+def test_threaded_sink_failure():
+    class BrokenSink(object):
+        def write_node(self, node, chunks):
+            raise IOError("broken pipe")
+        def close(self):
+            pass
+    sink = ThreadedSink(BrokenSink(), queue_size=1)
+    def restore():
+        for _ in xrange(100):
+            for node, text in NODES:
+                sink.write_node(node, [text])
+        sink.close()
+    assert_raises(IOError, restore)
@@ -0,0 +1,80 @@
+import json
+import tempfile
+from StringIO import StringIO
+from holland_restore.scanner import Scanner
+from holland_restore.node import NodeFilter
+from holland_restore.node.util import skip_tables
+from holland_restore.script.sink import StreamSink
+from holland_restore.script.restore import stream_filter
+from holland_restore.script.stats import RestoreStats
+from nose.tools import *
+
+TABLE = """--
+-- Table structure for table `%(table)s`
+--
+
+DROP TABLE IF EXISTS `%(table)s`;
+CREATE TABLE `%(table)s` (
+    `id` int NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+--
+-- Dumping data for table `%(table)s`
+--
+
+LOCK TABLES `%(table)s` WRITE;
+INSERT INTO `%(table)s` VALUES (1),(2);
+INSERT INTO `%(table)s` VALUES (3);
+UNLOCK TABLES;
+
+"""
+
+TEXT = ("-- MySQL dump 10.13  Distrib 5.1.42, for redhat-linux-gnu (x86_64)\n"
+        "--\n"
+        "-- Host: localhost    Database: db\n"
+        "-- ------------------------------------------------------\n"
+        "-- Server version       5.1.42-rs-log\n"
+        "\n"
+        "/*!40101 SET NAMES utf8 */;\n"
+        "\n" +
+        TABLE % dict(table='t1') +
+        TABLE % dict(table='t2') +
+        "-- Dump completed on 2010-04-22 14:44:42\n")
+
+def test_restore_stats():
+    """Test every byte of input and output is counted once"""
+    stats = RestoreStats()
+    node_filter = NodeFilter()
+    node_filter.register('table-ddl', skip_tables(include=['db.t1']))
+    node_filter.register('table-dml', skip_tables(include=['db.t1']))
+    result = StringIO()
+    stream_filter(node_filter, Scanner(TEXT.splitlines(True)), None,
+                  StreamSink(result), stats=stats)
+
+    assert_equals(stats.bytes_in, len(TEXT))
+    assert_equals(stats.lines, len(TEXT.splitlines()))
+    types = stats.types
+    assert_equals(sum([record.bytes_in for record in types.values()]),
+                  len(TEXT))
+    assert_equals(sum([record.bytes_out for record in types.values()]),
+                  len(result.getvalue()))
+    assert_equals(types['table-dml'].nodes, 2)
+    assert_equals(types['table-dml'].skipped, 1)
+    # the data of the skipped table is never tokenized
+    assert_equals(types['table-dml'].tokens, 9)
+    assert_equals(types['table-ddl'].tokens, 14)
+
+    tables = stats.tables
+    assert_equals(sorted(tables), ['db.t1', 'db.t2'])
+    assert_equals(tables['db.t1'].bytes_in, len(TABLE % dict(table='t1')))
+    assert_equals(tables['db.t2'].bytes_out, 0)
+    assert_equals(tables['db.t2'].skipped, 2)
+
+    report = stats.format()
+    ok_('table-dml' in report)
+    ok_('db.t1' in report)
+    fileobj = tempfile.NamedTemporaryFile()
+    stats.write_json(fileobj.name)
+    data = json.load(open(fileobj.name))
+    assert_equals(data['bytes_in'], len(TEXT))
+    assert_equals(data['tables']['db.t1']['nodes'], 2)
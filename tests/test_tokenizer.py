@@ -32,6 +32,48 @@ def test_tokenizer():
     except TokenizationError, exc:
         assert_equals(str(exc), 'No tokenization rule matched.')
 
+def test_compile_rules():
+    from holland_restore.tokenizer import compile_rules
+    def generic(line, scanner):
+        pass
+    foo = token_rules.tokenize_prefix('FOO', token_rules.make_token, 'Foo')
+    fab = token_rules.tokenize_prefix('FAB', token_rules.make_token, 'Fab')
+    bar = token_rules.tokenize_prefix('BAR', token_rules.make_token, 'Bar')
+    dispatch, fallback = compile_rules([foo, generic, fab, bar])
+    assert_equals(dispatch['F'], [foo, generic, fab])
+    assert_equals(dispatch['B'], [generic, bar])
+    assert_equals(fallback, [generic])
+
+def test_rule_dispatch_order():
+    """Dispatching on the first character must pick the same rule as trying
+    every rule in order"""
+    from holland_restore.tokenizer.rules import RULES
+    lines = [
+        "--\n",
+        "-- CHANGE MASTER TO MASTER_LOG_FILE='bin-log.000007';\n",
+        "CHANGE MASTER TO MASTER_LOG_FILE='bin-log.000007';\n",
+        "\n",
+        "/*!40101 SET NAMES utf8 */;\n",
+        "/*!40000 ALTER TABLE `actor` DISABLE KEYS */;\n",
+        "/*!30223 START SLAVE */;\n",
+        "USE `sakila`;\n",
+        "LOCK TABLES `actor` WRITE;\n",
+        "UNLOCK TABLES;\n",
+        "INSERT INTO `actor` VALUES (1,'PENELOPE');\n",
+        "REPLACE INTO `actor` VALUES (1,'PENELOPE');\n",
+        "SET @saved_cs_client     = @@character_set_client;\n",
+        "DROP TABLE IF EXISTS `actor`;\n",
+    ]
+    tokenizer = Tokenizer(lines, RULES)
+    for line in lines:
+        scanner = Scanner([line])
+        scanner.next()
+        for rule in RULES:
+            expected = rule(line, scanner)
+            if expected is not None:
+                break
+        assert_equals(tokenizer.next().symbol, expected.symbol)
+
 def test_tokenizer_pushback():
     tokenizer = Tokenizer(['Foo'], [lambda x, y: Token('sample', x, (), -1)])
     token1 = tokenizer.next()
@@ -39,6 +81,26 @@ def test_tokenizer_pushback():
     token2 = tokenizer.next()
     assert_equals(token1, token2)
 
+def test_tokenizer_peek():
+    rule = lambda x, y: Token(x.strip(), x, (), -1)
+    tokenizer = Tokenizer(['Foo\n', 'Bar\n', 'Baz\n'], [rule])
+    assert_equals(tokenizer.peek().symbol, 'Foo')
+    assert_equals(tokenizer.peek(3).symbol, 'Baz')
+    assert_raises(StopIteration, tokenizer.peek, 4)
+    ok_(tokenizer.lookahead(['Foo', 'Bar']))
+    ok_(not tokenizer.lookahead(['Foo', 'Baz']))
+    ok_(not tokenizer.lookahead(['Foo', 'Bar', 'Baz', 'Biz']))
+    assert_equals([token.symbol for token in tokenizer],
+                  ['Foo', 'Bar', 'Baz'])
+
+def test_tokenizer_pushback_order():
+    rule = lambda x, y: Token(x.strip(), x, (), -1)
+    tokenizer = Tokenizer(['Foo\n', 'Bar\n'], [rule])
+    foo = tokenizer.next()
+    tokenizer.peek()
+    tokenizer.push_back(foo)
+    assert_equals(tokenizer.next(), foo)
+    assert_equals(tokenizer.next().symbol, 'Bar')
 
 def test_tokenizer_iteration():
     tokenizer = Tokenizer(['Foo'], [lambda x, y: Token('sample', x, (), -1)])
@@ -0,0 +1,34 @@
+import re
+from nose.tools import *
+from holland_restore.tokenizer import Token
+from holland_restore.tokenizer.extract import EXTRACTORS, backtick_identifier, \
+                                              regex_extractor
+
+def test_backtick_identifier():
+    """The regex-free parser must agree with the regular expression"""
+    samples = [
+        "-- Table structure for table `actor`\n",
+        "CREATE TABLE `foo``bar` (\n",
+        "```leading` backticks",
+        "`` empty then `real`",
+        "unterminated `foo``",
+        "unterminated `foo",
+        "no identifier here",
+        "USE `db`;\n",
+    ]
+    for text in samples:
+        match = re.search('`((?:``|[^`])+)`', text, re.M|re.U)
+        expected = match and match.groups()
+        assert_equals(backtick_identifier(text), expected)
+
+def test_regex_extractor():
+    extract = regex_extractor('Database: (.*)$')
+    assert_equals(extract("-- Host: localhost    Database: sakila\n"),
+                  ('sakila',))
+    ok_(extract("-- Server version 5.1.42") is None)
+
+def test_token_extractor():
+    token = Token('CreateTable', ") ENGINE=InnoDB DEFAULT CHARSET=utf8;\n",
+                  (1, 1), 0)
+    assert_equals(token.extract(EXTRACTORS['engine']), ('InnoDB',))
+    assert_equals(token.extract(EXTRACTORS['identifier']), None)
@@ -0,0 +1,52 @@
+"""Unit tests for holland_restore.util"""
+
+from nose.tools import *
+from holland_restore.util import Filter, FilteredItem, LRUCache, PatternSet
+
+def test_filter():
+    check = Filter()
+    check.include(['sakila.*', 'mysql.user'])
+    check.exclude(['sakila.film_*', 'sakila.actor'])
+    check('sakila.customer')
+    check('mysql.user')
+    assert_raises(FilteredItem, check, 'mysql.proc')
+    assert_raises(FilteredItem, check, 'sakila.actor')
+    assert_raises(FilteredItem, check, 'sakila.film_text')
+    # cached verdicts give the same answer
+    check('sakila.customer')
+    assert_raises(FilteredItem, check, 'sakila.film_text')
+    try:
+        check('sakila.film_actor')
+    except FilteredItem, exc:
+        assert_equals(exc.args, ('sakila.film_actor', 'sakila.film_*'))
+
+def test_filter_many_names():
+    names = ['db%d.tbl%d' % (i % 50, i) for i in xrange(20000)]
+    check = Filter()
+    check.include(names + ['archive.*'])
+    check(names[-1])
+    check('archive.2010')
+    assert_raises(FilteredItem, check, 'db1.tbl0')
+
+def test_pattern_set():
+    patterns = PatternSet(['a.b', 'c.*', 'd.[xy]'])
+    ok_(patterns)
+    ok_('a.b' in patterns)
+    ok_('c.foo' in patterns)
+    ok_('a.bb' not in patterns)
+    assert_equals(patterns.find('a.b'), 'a.b')
+    assert_equals(patterns.find('c.foo'), 'c.*')
+    assert_equals(patterns.find('d.y'), 'd.[xy]')
+    ok_(patterns.find('a.bb') is None)
+    ok_(not PatternSet())
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert_equals(cache.get('a'), 1)
+    cache['c'] = 3
+    assert_equals(len(cache), 2)
+    ok_(cache.get('b') is None)
+    assert_equals(cache.get('a'), 1)
+    assert_equals(cache.get('c'), 3)
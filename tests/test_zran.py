@@ -0,0 +1,94 @@
+import os
+import gzip
+import zlib
+import random
+import shutil
+import tempfile
+from StringIO import StringIO
+from holland_restore import zran
+from holland_restore.index import IndexWriter, read_index
+from nose.plugins.skip import SkipTest
+from nose.tools import *
+
+def setup():
+    if not zran.available:
+        raise SkipTest("libz is not available")
+
+def make_text(size):
+    rng = random.Random(42)
+    words = ['INSERT', 'INTO', '`t`', 'VALUES', "'abc'", '(1,2)', 'NULL']
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(words) + str(rng.randint(0, 1000))
+        parts.append(word)
+        length += len(word) + 1
+    return ' '.join(parts)
+
+def gzip_members(*texts):
+    result = StringIO()
+    for text in texts:
+        member = gzip.GzipFile(fileobj=result, mode='wb')
+        member.write(text)
+        member.close()
+    return result.getvalue()
+
+def inflate(data, span, read_size=4096):
+    inflater = zran.Inflater(span=span)
+    result = []
+    for offset in xrange(0, len(data), read_size):
+        result.append(inflater.decompress(data[offset:offset + read_size]))
+    return ''.join(result), inflater.checkpoints
+
+def test_checkpoints():
+    text = make_text(1000000)
+    data = gzip_members(text[:300000], text[300000:])
+    result, checkpoints = inflate(data, span=50000)
+    assert_equals(result, text)
+    ok_(len(checkpoints) > 5)
+    offsets = [checkpoint.out_offset for checkpoint in checkpoints]
+    assert_equals(offsets, sorted(offsets))
+
+def test_read_range():
+    text = make_text(1000000)
+    data = gzip_members(text[:300000], text[300000:700000], text[700000:])
+    _, checkpoints = inflate(data, span=50000)
+    reader = zran.ZranReader(StringIO(data), checkpoints, read_size=4096)
+    rng = random.Random(0)
+    for _ in xrange(50):
+        start = rng.randrange(len(text))
+        end = min(len(text), start + rng.randrange(1, 200000))
+        assert_equals(''.join(reader.read_range(start, end)),
+                      text[start:end])
+    # consecutive ranges continue without resuming
+    assert_equals(''.join(reader.read_range(0, 1000)) +
+                  ''.join(reader.read_range(1000, len(text))), text)
+    assert_raises(IOError, list, reader.read_range(0, len(text) + 1))
+
+def test_end_of_input():
+    text = make_text(100000)
+    data = gzip_members(text[:30000], text[30000:])
+    inflater = zran.Inflater()
+    assert_equals(inflater.decompress(data[:-1]), text)
+    assert_raises(zlib.error, inflater.finish)
+    # zero padding after the last member is skipped
+    for read_size in (4096, len(data)):
+        inflater = zran.Inflater()
+        padded = data + '\0'*5000
+        result = ''.join([inflater.decompress(padded[i:i + read_size])
+                          for i in xrange(0, len(padded), read_size)])
+        assert_equals(result, text)
+        inflater.finish()
+        assert_equals(inflater.in_offset, len(padded))
+
+def test_index_checkpoints():
+    text = make_text(300000)
+    _, checkpoints = inflate(gzip_members(text), span=50000)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'dump.sql.gz.idx')
+        writer = IndexWriter(open(path, 'w'), 0, 0, checkpoints)
+        writer.finish((0, 0))
+        assert_equals(read_index(path).checkpoints, checkpoints)
+    finally:
+        shutil.rmtree(tmpdir)